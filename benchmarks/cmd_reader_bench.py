@@ -0,0 +1,93 @@
+#!/usr/bin/python
+"""
+Micro-benchmark of the command socket reader.
+
+A local fake server streams CR terminated status messages as fast as the
+socket allows.  The legacy byte-at-a-time loop that RxCmdLoop used to run is
+compared against the buffered CommandReader in messages per second.
+
+usage: python benchmarks/cmd_reader_bench.py [message count]
+"""
+from __future__ import print_function
+from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from popoto.framing import CommandReader
+
+
+def fakeServer(listener, count):
+    message = b'Info {"Info": "RxStatus", "SNR": 12.5, "Doppler": 0.01, "Channel": 0}\r'
+    block = message * 1000
+    conn, addr = listener.accept()
+    sent = 0
+    while sent < count:
+        n = min(1000, count - sent)
+        conn.sendall(block if n == 1000 else message * n)
+        sent += n
+    conn.close()
+    listener.close()
+
+
+def connect(count):
+    listener = socket(AF_INET, SOCK_STREAM)
+    listener.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    server = threading.Thread(target=fakeServer, args=(listener, count))
+    server.start()
+    sock = socket(AF_INET, SOCK_STREAM)
+    sock.connect(listener.getsockname())
+    return sock, server
+
+
+def legacyLoop(sock):
+    # The receive loop as it was: one recv per byte and string concatenation
+    messages = 0
+    rxString = ''
+    while True:
+        data = sock.recv(1)
+        if len(data) < 1:
+            break
+        if ord(data) != 13:
+            rxString = rxString + data.decode()
+        else:
+            idx = rxString.find("{")
+            msgType = rxString[0:idx].strip()
+            json.loads(rxString[idx:len(rxString)])
+            messages += 1
+            rxString = ''
+    return messages
+
+
+def bufferedLoop(sock):
+    messages = 0
+    reader = CommandReader(sock)
+    while reader.fill() > 0:
+        for msgType, jsonData in reader.frames():
+            json.loads(jsonData)
+            messages += 1
+    return messages
+
+
+def run(name, loop, count):
+    sock, server = connect(count)
+    start = time.time()
+    messages = loop(sock)
+    elapsed = time.time() - start
+    server.join()
+    sock.close()
+    rate = messages / elapsed
+    print('{:<10} {:8d} messages {:8.3f} s {:12.0f} msg/s'.format(name, messages, elapsed, rate))
+    return rate
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    before = run('recv(1)', legacyLoop, count)
+    after = run('buffered', bufferedLoop, count)
+    print('speedup    {:.1f}x'.format(after / before))
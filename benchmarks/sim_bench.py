@@ -0,0 +1,150 @@
+#!/usr/bin/python
+"""
+End to end benchmarks of the popoto API against the local modem simulator.
+
+Measures command round trip latency percentiles, pipelined replies per
+second, connect time (parameter enumeration), PCM record and play rates and
+upload throughput.  Results can be written as JSON and compared against a
+saved baseline, in which case the exit status is 1 if any result regressed by
+more than the tolerance, so the hot paths can be checked in CI.
+
+usage: python benchmarks/sim_bench.py [--json out.json] [--baseline base.json]
+                                      [--tolerance 0.25] [--quick]
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from popoto.popoto import popoto
+from popoto.correlation import waitForReplies
+from popoto.simulator import PopotoSimulator
+
+# Results where a smaller value is better; all others are rates
+LOWER_IS_BETTER = ('latency_p50_ms', 'latency_p90_ms', 'latency_p99_ms',
+                   'startup_serial_s', 'startup_window8_s', 'play_underruns')
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+def openModem(sim, paramWindow=1):
+    return popoto('127.0.0.1', sim.basePort, schemaCache=False, paramWindow=paramWindow)
+
+
+def closeModem(modem):
+    modem.is_running = False
+    modem.cmdsocket.close()
+    if modem.datasocket is not None:
+        modem.datasocket.close()
+
+
+def benchLatency(modem, count):
+    latencies = []
+    for i in range(count):
+        pending = modem.requestValueI('PayloadMode')
+        modem.waitForValue(pending, 3)
+        latencies.append(pending.latency() * 1e3)
+    return {'latency_p50_ms': percentile(latencies, 50),
+            'latency_p90_ms': percentile(latencies, 90),
+            'latency_p99_ms': percentile(latencies, 99)}
+
+
+def benchReplies(modem, count, window=100):
+    start = time.time()
+    for first in range(0, count, window):
+        pendingList = [modem.requestValueI('PayloadMode') for i in range(min(window, count - first))]
+        waitForReplies(pendingList, 5)
+    return {'replies_per_s': count / (time.time() - start)}
+
+
+def benchStartup(sim):
+    results = {}
+    for name, window in (('startup_serial_s', 1), ('startup_window8_s', 8)):
+        start = time.time()
+        modem = openModem(sim, window)
+        results[name] = time.time() - start
+        closeModem(modem)
+    return results
+
+
+def benchPcm(modem, sim, outFile, seconds):
+    recorder = modem.recPcmLoop(outFile, seconds, 0)
+    results = {'record_bytes_per_s': recorder.bytesReceived / recorder.elapsed}
+    player = modem.playPcmLoop(outFile, 0)
+    results['play_bytes_per_s'] = player.bytesSent / player.duration
+    results['play_underruns'] = player.underruns
+    return results
+
+
+def benchUpload(modem, inFile, size):
+    with open(inFile, 'wb') as fp:
+        fp.write(os.urandom(size))
+    uploader = modem.streamUpload(inFile, 1.0, chunkBytes=4096)
+    return {'upload_bytes_per_s': uploader.bytesPerSec}
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, value in sorted(results.items()):
+        if name not in baseline or not baseline[name]:
+            continue
+        ratio = value / float(baseline[name])
+        if name in LOWER_IS_BETTER:
+            worse = ratio > 1 + tolerance
+        else:
+            worse = ratio < 1 - tolerance
+        if worse:
+            regressions.append('{}: {:.4g} vs baseline {:.4g}'.format(name, value, baseline[name]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='popoto end to end benchmarks')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare against results saved with --json')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed fractional regression against the baseline')
+    parser.add_argument('--quick', action='store_true', help='smaller workloads')
+    args = parser.parse_args()
+
+    scale = 0.2 if args.quick else 1.0
+    workDir = tempfile.mkdtemp(prefix='popoto_bench')
+    # The simulator streams PCM unpaced, so recording measures the client's ceiling;
+    # playback is paced by PcmPlayer itself
+    sim = PopotoSimulator(basePort=0, rateScale=0).start()
+    results = {}
+    try:
+        modem = openModem(sim)
+        results.update(benchLatency(modem, int(1000 * scale)))
+        results.update(benchReplies(modem, int(20000 * scale)))
+        results.update(benchStartup(sim))
+        results.update(benchPcm(modem, sim, os.path.join(workDir, 'bench.pcm'), 20 * scale))
+        results.update(benchUpload(modem, os.path.join(workDir, 'upload.bin'),
+                                   int(16 * 1024 * 1024 * scale)))
+        closeModem(modem)
+    finally:
+        sim.stop()
+
+    for name, value in sorted(results.items()):
+        print('{:<24}{:>16.4g}'.format(name, value))
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as fp:
+            regressions = compare(results, json.load(fp), args.tolerance)
+        for line in regressions:
+            print('REGRESSION ' + line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,689 @@
+"""
+asyncio client for the Popoto modem.
+
+AsyncPopoto offers the command surface of the popoto class as coroutines and
+drives the command, data, pcmlog and pcmio ports with asyncio streams, so a
+single event loop can run command traffic and PCM streaming for many modems
+without a thread per connection.  It requires Python 3.6 or later.
+
+usage:
+    modem = AsyncPopoto('10.0.0.232')
+    await modem.connect()
+    await modem.setValueF('TxPowerWatts', 1.0)
+    level = await modem.getValueI('CarrierTxMode')
+    await modem.close()
+"""
+from __future__ import print_function
+import asyncio
+import json
+import mmap
+import os
+import time
+
+from .batch import isRejected
+from .boundedqueue import DROP_OLDEST, DROP_NEWEST
+from .correlation import PendingReply, ReplyCorrelator, REPLY_KEYS
+from .framing import CommandReader, formatCommand
+from .pcmformat import (PCM_FRAME_BYTES, PCM_FRAME_SAMPLES, PCMLOG_OFFSET, PCM_WORD_BYTES,
+                        floatsPerSecond, framesForDuration)
+from .pcmplay import chunkViews, frameSamples, playSource
+from .schemacache import SchemaCache
+from .trace import tracer
+
+
+class AsyncPendingReply(PendingReply):
+    """
+    A PendingReply that also completes an asyncio future.  It is created and
+    resolved on the event loop thread.
+    """
+    def __init__(self, command, key, infoMatch=False):
+        PendingReply.__init__(self, command, key, infoMatch)
+        self.future = asyncio.get_event_loop().create_future()
+
+    def resolve(self, msgType, reply):
+        PendingReply.resolve(self, msgType, reply)
+        if not self.future.done():
+            self.future.set_result(reply)
+
+
+class AsyncPopoto(object):
+    '''
+    An asyncio API for the Popoto Modem product
+
+    Replies to commands issued through request() are matched to the awaiting
+    coroutine; all other JSON messages from the modem are put on the replyQ,
+    a bounded asyncio.Queue.
+    '''
+    def __init__(self, ip='localhost', basePort=17000, schemaCache=True, paramWindow=1,
+                 replyQSize=1024, replyOverflow=DROP_OLDEST):
+        """
+        :param      ip:           The IP address of the modem
+        :type       ip:           string
+        :param      basePort:     The base port of the modem application
+        :type       basePort:     integer
+        :param      schemaCache:  True for the default on-disk schema cache, False to always
+                                  enumerate, or a SchemaCache instance
+        :type       schemaCache:  boolean or SchemaCache
+        :param      paramWindow:  Number of GetParameters requests kept in flight; above 1
+                                  relies on the modem answering requests past the end of
+                                  the chain with an 'invalid index' Info
+        :type       paramWindow:  integer
+        :param      replyQSize:     The capacity of the replyQ; 0 for unbounded
+        :type       replyQSize:     integer
+        :param      replyOverflow:  'drop_oldest' or 'drop_newest' when the replyQ is full.
+                                    The reader task never waits on the queue.
+        :type       replyOverflow:  string
+        """
+        if replyOverflow not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError('Unsupported overflow policy {}'.format(replyOverflow))
+        self.ip = ip
+        self.pcmioport  = basePort+3
+        self.pcmlogport = basePort+2
+        self.dataport   = basePort+1
+        self.cmdport    = basePort
+        self.correlator = ReplyCorrelator(AsyncPendingReply)
+        self.replyQ = None
+        self.replyQSize = replyQSize
+        self.replyOverflow = replyOverflow
+        self.replyDropped = 0
+        self.replyPeakDepth = 0
+        self.reader = None
+        self.writer = None
+        self.rxTask = None
+        self.dataReader = None
+        self.dataWriter = None
+        self.intParams = {}
+        self.floatParams = {}
+        self.version = None
+        if schemaCache is True:
+            schemaCache = SchemaCache()
+        self.schemaCache = schemaCache or None
+        self.paramWindow = paramWindow
+
+    async def connect(self, loadParameters=True):
+        """
+        Opens the command port, starts the reply reader task and loads the control
+        element schema.
+        """
+        self.reader, self.writer = await asyncio.open_connection(self.ip, self.cmdport)
+        self.replyQ = asyncio.Queue(max(self.replyQSize, 0))
+        self.rxTask = asyncio.ensure_future(self.rxCmdLoop())
+        if loadParameters:
+            await self.loadParameters()
+
+    async def close(self):
+        """
+        Stops the reply reader and closes the command and data ports.
+        """
+        if self.rxTask is not None:
+            self.rxTask.cancel()
+            self.rxTask = None
+        for writer in (self.writer, self.dataWriter):
+            if writer is not None:
+                writer.close()
+        self.writer = self.dataWriter = None
+
+    async def rxCmdLoop(self):
+        framer = CommandReader()
+        while True:
+            data = await self.reader.read(65536)
+            if not data:
+                break
+            framer.feed(data)
+            for msgType, jsonData in framer.frames():
+                try:
+                    reply = json.loads(jsonData)
+                except ValueError:
+                    tracer.warning("Unparseable JSON message {}", jsonData)
+                    continue
+                self.handleReply(msgType, reply)
+
+    def handleReply(self, msgType, reply):
+        if self.correlator.match(msgType, reply):
+            return
+        if self.replyQ.full():
+            self.replyDropped += 1
+            if self.replyOverflow == DROP_NEWEST:
+                return
+            self.replyQ.get_nowait()
+        self.replyQ.put_nowait(reply)
+        self.replyPeakDepth = max(self.replyPeakDepth, self.replyQ.qsize())
+
+    def replyStats(self):
+        """
+        :returns    stats:  The replyQ depth, peakDepth and dropped counters
+        :type       stats:  dictionary
+        """
+        depth = 0 if self.replyQ is None else self.replyQ.qsize()
+        return {'depth': depth, 'peakDepth': self.replyPeakDepth, 'dropped': self.replyDropped}
+
+    async def send(self, message):
+        """
+        Sends a command with optional arguments to Popoto.
+
+        :param      message:  The message contains a Popoto command with optional arguments
+        :type       message:  string
+        """
+        self.writer.write(formatCommand(message))
+        await self.writer.drain()
+
+    async def request(self, message, key=None, infoMatch=False, timeout=3):
+        """
+        Sends a command and waits for the reply carrying key.
+
+        :param      message:    The message contains a Popoto command with optional arguments
+        :type       message:    string
+        :param      key:        The reply key, by default the reply key of the command
+        :type       key:        string
+        :param      infoMatch:  Match key against the 'Info' text of a reply
+        :type       infoMatch:  boolean
+        :param      timeout:    The timeout in seconds
+        :type       timeout:    number
+        :returns    reply:      The reply, None on timeout
+        :type       reply:      dictionary
+        """
+        if key is None:
+            command = message.split(' ', 1)[0]
+            key = REPLY_KEYS.get(command, command)
+        pending = self.correlator.expect(message, key, infoMatch)
+        self.writer.write(formatCommand(message))
+        await self.writer.drain()
+        return await self.waitFor(pending, timeout)
+
+    async def waitFor(self, pending, timeout):
+        try:
+            return await asyncio.wait_for(asyncio.shield(pending.future), timeout)
+        except asyncio.TimeoutError:
+            self.correlator.cancel(pending)
+            return None
+
+    async def startRx(self):
+        """
+        startRx places Popoto modem in receive mode.
+        """
+        await self.send('Event_StartRx')
+
+    async def transmitJSON(self, JSmessage):
+        """
+        The transmitJSON method sends an arbitrary user JSON message for transmission out the
+        acoustic modem.
+
+        :param      JSmessage:  The Users JSON message
+        :type       JSmessage:  string
+        """
+        message = "{ \"Command\": \"TransmitJSON\", \"Arguments\": " +JSmessage+" }"
+        try:
+            json.loads(message)
+        except ValueError:
+            tracer.warning("Invalid JSON message: {}", JSmessage)
+            return
+        self.writer.write((message + '\n').encode('utf-8'))
+        await self.writer.drain()
+
+    async def sendRange(self, power=.1, timeout=3):
+        """
+        Send a command to Popoto to initiate a ranging cycle to another modem.
+        The ranging settings and the ping go out in one write and their
+        acknowledgements are awaited together.
+
+        :param      power:    The power in watts
+        :type       power:    number
+        :param      timeout:  The seconds to wait for the acknowledgements
+        :type       timeout:  number
+        :returns    failed:   The settings that were rejected or not acknowledged
+        :type       failed:   list of strings
+        """
+        pendingList = await self.writeSetValues({'TxPowerWatts': float(power),
+                                                 'CarrierTxMode': 0}, ['Event_sendRanging'])
+        return await self.waitAcks(pendingList, timeout)
+
+    async def setValueI(self, Element, value):
+        await self.send('SetValue {} int {} 0'.format(Element, value))
+
+    async def setValueF(self, Element, value):
+        await self.send('SetValue {} float {} 0'.format(Element, value))
+
+    async def setValues(self, values, timeout=3):
+        """
+        Sets several Popoto variables with one write and waits for all the
+        acknowledgements together.  The format of each element is taken from the
+        parameter list, or from the type of its value when the list lacks it.
+
+        :param      values:   Element name to value
+        :type       values:   dictionary
+        :param      timeout:  The overall timeout in seconds
+        :type       timeout:  number
+        :returns    failed:   The elements that were rejected or not acknowledged
+        :type       failed:   list of strings
+        """
+        return await self.waitAcks(await self.writeSetValues(values), timeout)
+
+    async def writeSetValues(self, values, commands=()):
+        """
+        Writes a SetValue per element, followed by commands, in one write.
+
+        :returns    pendingList:  The acknowledgements expected, one per element
+        :type       pendingList:  list of AsyncPendingReply
+        """
+        lines = []
+        pendingList = []
+        for Element, value in values.items():
+            if Element in self.floatParams or Element in self.intParams:
+                fmt = 'float' if Element in self.floatParams else 'int'
+            else:
+                fmt = 'float' if isinstance(value, float) else 'int'
+            message = 'SetValue {} {} {} 0'.format(Element, fmt, value)
+            pendingList.append(self.correlator.expect(message, Element, True))
+            lines.append(formatCommand(message))
+        lines.extend(formatCommand(command) for command in commands)
+        self.writer.write(b''.join(lines))
+        await self.writer.drain()
+        return pendingList
+
+    async def waitAcks(self, pendingList, timeout):
+        replies = await asyncio.gather(*[self.waitFor(p, timeout) for p in pendingList])
+        return [p.key for p, reply in zip(pendingList, replies)
+                if reply is None or isRejected(reply, p.key)]
+
+    async def getValueI(self, Element, timeout=3):
+        reply = await self.request('GetValue {} int  0'.format(Element), Element, timeout=timeout)
+        return None if reply is None else reply.get(Element)
+
+    async def getValueF(self, Element, timeout=3):
+        reply = await self.request('GetValue {} float  0'.format(Element), Element, timeout=timeout)
+        return None if reply is None else reply.get(Element)
+
+    async def getValues(self, Elements, timeout=3):
+        """
+        Gets several Popoto variables with all the requests in flight at once.
+
+        :returns    values:  Element name to value, None where a reply timed out
+        :type       values:  dictionary
+        """
+        getters = [self.getValueF(e, timeout) if e in self.floatParams else
+                   self.getValueI(e, timeout) for e in Elements]
+        return dict(zip(Elements, await asyncio.gather(*getters)))
+
+    async def getVersion(self, timeout=3):
+        reply = await self.request('GetVersion', timeout=timeout)
+        return None if reply is None else reply.get(REPLY_KEYS['GetVersion'])
+
+    async def getRtc(self, timeout=3):
+        reply = await self.request('GetRTC', timeout=timeout)
+        return None if reply is None else reply.get(REPLY_KEYS['GetRTC'])
+
+    async def setRtc(self, clockstr):
+        await self.send('SetRTC {}'.format(clockstr))
+
+    async def loadParameters(self):
+        """
+        Fills intParams and floatParams from the schema cache when the modem
+        version matches, otherwise by enumeration.  Only a complete enumeration
+        is cached.
+        """
+        if self.schemaCache is not None:
+            self.version = await self.getVersion()
+            if self.version is not None:
+                cached = self.schemaCache.load(self.ip, self.cmdport, self.version)
+                if cached is not None:
+                    self.intParams, self.floatParams = cached
+                    return
+        complete = await self.getAllParameters(self.paramWindow)
+        if not complete:
+            tracer.warning("Parameter enumeration incomplete; schema not cached")
+        elif self.schemaCache is not None and self.version is not None:
+            self.schemaCache.store(self.ip, self.cmdport, self.version,
+                                   self.intParams, self.floatParams)
+
+    async def getAllParameters(self, window=1):
+        """
+        Gets all Popoto control element info strings, keeping up to window
+        GetParameters requests in flight along the nextidx chain.
+
+        :returns    complete:  True if the walk reached the element with nextidx -1
+        :type       complete:  boolean
+        """
+        inflight = {}
+        nextSpec = 0
+        idx = 0
+        while idx >= 0:
+            for i in [idx] + list(range(max(nextSpec, idx + 1), idx + window)):
+                if i not in inflight:
+                    inflight[i] = self.correlator.expect('GetParameters {}'.format(i), 'Element')
+                    self.writer.write(formatCommand('GetParameters {}'.format(i)))
+            nextSpec = max(nextSpec, idx + window)
+            await self.writer.drain()
+
+            pending = inflight.pop(idx)
+            reply = await self.waitFor(pending, 3)
+            if reply is None or 'Element' not in reply:
+                tracer.warning("GetParameters {} failed: {}", idx, reply)
+                break
+            El = reply['Element']
+            idx = int(El.get('nextidx', -1))
+            if idx > 0:
+                if El['Format'] == 'int':
+                    self.intParams[El['Name']] = El
+                else:
+                    self.floatParams[El['Name']] = El
+
+        # Requests sent past the end are answered with an invalid index Info
+        stale = list(inflight.values())
+        if stale:
+            await asyncio.gather(*[self.waitFor(p, 0.5) for p in stale])
+        # A timeout or an error reply leaves idx at the element not read
+        return idx < 0
+
+    async def recordPcm(self, outFile, duration, bb):
+        """
+        Records passband/baseband pcmlog frames for duration seconds into a
+        preallocated, memory mapped file.
+
+        :returns    frames:  The number of whole frames recorded
+        :type       frames:  integer
+        """
+        reader, writer = await asyncio.open_connection(self.ip, self.pcmlogport)
+        await self.setValueI('RecordMode', bb)
+        nbytes = framesForDuration(duration, bb) * PCM_FRAME_BYTES
+        offset = 0
+        try:
+            with open(outFile, 'w+b') as fpout:
+                fpout.truncate(nbytes)
+                mm = mmap.mmap(fpout.fileno(), nbytes)
+                try:
+                    while offset < nbytes:
+                        data = await reader.read(nbytes - offset)
+                        if not data:
+                            break
+                        mm[offset:offset + len(data)] = data
+                        offset += len(data)
+                finally:
+                    mm.close()
+                if offset < nbytes:
+                    fpout.truncate(offset - offset % PCM_FRAME_BYTES)
+        finally:
+            writer.close()
+            await self.setValueI('RecordMode', 0)
+        return offset // PCM_FRAME_BYTES
+
+    async def pcmBlocks(self, blockSize, bb=0):
+        """
+        Async generator of fixed size float32 (passband) or complex64 (baseband)
+        sample blocks read live from the pcmlog port.  TCP flow control bounds the
+        buffering when the consumer falls behind.
+        """
+        import numpy as np
+        from .pcmparse import parseFrames
+
+        reader, writer = await asyncio.open_connection(self.ip, self.pcmlogport)
+        await self.setValueI('RecordMode', bb)
+        dtype = np.complex64 if bb else np.float32
+        block = np.empty(blockSize, dtype)
+        blockFill = 0
+        try:
+            while True:
+                try:
+                    data = await reader.readexactly(PCM_FRAME_BYTES * 8)
+                except asyncio.IncompleteReadError as err:
+                    data = err.partial
+                    if len(data) < PCM_FRAME_BYTES:
+                        return
+                samples = parseFrames(data, bb).samples
+                used = 0
+                while used < len(samples):
+                    take = min(blockSize - blockFill, len(samples) - used)
+                    block[blockFill:blockFill + take] = samples[used:used + take]
+                    blockFill += take
+                    used += take
+                    if blockFill == blockSize:
+                        yield block
+                        block = np.empty(blockSize, dtype)
+                        blockFill = 0
+        finally:
+            writer.close()
+            await self.setValueI('RecordMode', 0)
+
+    async def playPcm(self, source, bb, lead=0.2, chunkFrames=8):
+        """
+        Plays a file of pcmlog frames, a sample array or an iterable of sample
+        blocks, paced to the sample rate, and returns when the last sample has
+        been played.
+
+        :returns    underruns:  The number of chunks sent after they were due
+        :type       underruns:  integer
+        """
+        reader, writer = await asyncio.open_connection(self.ip, self.pcmlogport)
+        await self.setValueI('PlayMode', bb)
+        await self.send('StartNetPlay 0 0')
+        rate = float(floatsPerSecond(bb))
+        samplesSent = 0
+        underruns = 0
+        start = time.time()
+        try:
+            for chunk in playSource(source, chunkFrames):
+                due = start + samplesSent / rate
+                now = time.time()
+                if now < due - lead:
+                    await asyncio.sleep(due - lead - now)
+                elif now > due and samplesSent > 0:
+                    underruns += 1
+                    start += now - due
+                frames, rest = divmod(len(chunk), PCM_FRAME_BYTES)
+                # The transport may keep the data after write returns
+                writer.write(bytes(chunk))
+                await writer.drain()
+                samplesSent += frames * PCM_FRAME_SAMPLES
+                if rest > PCMLOG_OFFSET * PCM_WORD_BYTES:
+                    samplesSent += rest // PCM_WORD_BYTES - PCMLOG_OFFSET
+            remaining = start + samplesSent / rate - time.time()
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+        finally:
+            await self.send('Event_playPcmQueueEmpty')
+            writer.close()
+        return underruns
+
+    async def openDataPort(self):
+        if self.dataWriter is None:
+            self.dataReader, self.dataWriter = await asyncio.open_connection(self.ip, self.dataport)
+
+    async def streamUpload(self, filename, power, chunkBytes=256):
+        """
+        Uploads a file for acoustic transmission in ConsolePacketBytes chunks.
+
+        :returns    sent:  The number of bytes sent, None if the modem rejected the setup
+        :type       sent:  integer
+        """
+        await self.openDataPort()
+        nbytes = os.path.getsize(filename)
+        failed = await self.setValues({'TCPecho': 0, 'ConsolePacketBytes': chunkBytes,
+                                       'ConsoleTimeoutMS': 500, 'StreamingTxLen': nbytes,
+                                       'PayloadMode': 1, 'TxPowerWatts': float(power)})
+        if failed:
+            tracer.warning("Upload setup failed for {}", failed)
+            return None
+        sent = 0
+        buf = bytearray(chunkBytes)
+        with open(filename, 'rb') as fp:
+            while True:
+                count = fp.readinto(buf)
+                if not count:
+                    break
+                self.dataWriter.write(bytes(buf[:count]))
+                await self.dataWriter.drain()
+                sent += count
+        return sent
+
+    async def dataPayloads(self, payloadGap=0.5, maxPayload=65536):
+        """
+        Async generator of payloads received on the data port as
+        (data, startTime, endTime).  A payload ends after payloadGap idle seconds.
+        """
+        await self.openDataPort()
+        while True:
+            data = await self.dataReader.read(maxPayload)
+            if not data:
+                return
+            parts = [data]
+            size = len(data)
+            startTime = endTime = time.time()
+            while size < maxPayload:
+                try:
+                    data = await asyncio.wait_for(self.dataReader.read(maxPayload - size), payloadGap)
+                except asyncio.TimeoutError:
+                    break
+                if not data:
+                    break
+                parts.append(data)
+                size += len(data)
+                endTime = time.time()
+            yield b''.join(parts), startTime, endTime
+
+    async def openPcmIo(self, bb=0, lead=0.05):
+        """
+        Opens the pcmio port for full duplex passband/baseband pcm, with PlayMode
+        and RecordMode set to bb.  They are set back to passband when the
+        returned stream is closed.
+
+        :param      bb:       passband or baseband selection
+        :type       bb:       number 0/1 passband/baseband
+        :param      lead:     The most seconds of signal written ahead of real time
+        :type       lead:     number
+        :returns    pcmio:    The framed pcmio stream
+        :type       pcmio:    AsyncPcmIo
+        :raises     IOError:  If the modem rejects the PCM mode
+        """
+        reader, writer = await asyncio.open_connection(self.ip, self.pcmioport)
+        failed = await self.setValues({'PlayMode': bb, 'RecordMode': bb})
+        if failed:
+            writer.close()
+            raise IOError('Setting the PCM mode failed for {}'.format(failed))
+
+        async def onClose():
+            failed = await self.setValues({'PlayMode': 0, 'RecordMode': 0})
+            if failed:
+                tracer.warning("Restoring passband PCM failed for {}", failed)
+
+        return AsyncPcmIo(reader, writer, bb, lead, onClose)
+
+
+class AsyncPcmIo(object):
+    """
+    AsyncPcmIo frames samples on the pcmio port in pcmlog frames in both
+    directions.  write() packs samples into frames carrying consecutive frame
+    counters and sends them paced to the sample rate, at most lead seconds
+    ahead; read() returns received samples, keeping the rest of a frame for the
+    next read.  Samples are float32 for passband and complex64 for baseband.
+
+    Received frames wait in the socket until read, so TCP flow control bounds
+    the buffering when the application falls behind.
+
+    usage:
+        pcmio = await modem.openPcmIo(bb=1)
+        await pcmio.write(probe)
+        response = await pcmio.read(len(probe))
+        await pcmio.close()
+    """
+    def __init__(self, reader, writer, bb, lead=0.05, onClose=None):
+        """
+        :param      reader:   The pcmio stream reader
+        :type       reader:   asyncio.StreamReader
+        :param      writer:   The pcmio stream writer
+        :type       writer:   asyncio.StreamWriter
+        :param      bb:       passband or baseband selection
+        :type       bb:       number 0/1 passband/baseband
+        :param      lead:     The most seconds of signal written ahead of real time
+        :type       lead:     number
+        :param      onClose:  Coroutine function awaited once on close
+        :type       onClose:  function
+        """
+        import numpy as np
+
+        self.reader = reader
+        self.writer = writer
+        self.bb = bb
+        self.dtype = np.complex64 if bb else np.float32
+        self.framePeriod = PCM_FRAME_SAMPLES / float(floatsPerSecond(bb))
+        self.lead = lead
+        self.onClose = onClose
+        self.rest = np.empty(0, self.dtype)
+        self.start = None
+        self.lastCounter = None
+        self.txFrames = 0
+        self.txLate = 0
+        self.rxFrames = 0
+        self.rxLost = 0
+
+    async def write(self, samples):
+        """
+        Sends samples, zero padding the last frame, and returns when the last
+        frame is written no more than lead seconds ahead of real time.
+
+        :param      samples:  float32 (passband) or complex64 (baseband) samples
+        :type       samples:  numpy.ndarray
+        """
+        frames = frameSamples(samples, self.txFrames & 0xffffffff)
+        if self.start is None:
+            self.start = time.time()
+        for frame in chunkViews(frames, 1):
+            due = self.start + self.txFrames * self.framePeriod
+            now = time.time()
+            if now < due - self.lead:
+                await asyncio.sleep(due - self.lead - now)
+            elif now > due + self.framePeriod:
+                # Fell behind real time; the modem has played silence meanwhile
+                self.txLate += 1
+                self.start += now - due
+            self.writer.write(bytes(frame))
+            await self.writer.drain()
+            self.txFrames += 1
+
+    async def read(self, count):
+        """
+        Returns the next count received samples.
+
+        :param      count:    The number of samples
+        :type       count:    integer
+        :returns    samples:  The samples; fewer than count if the port closed
+        :type       samples:  numpy.ndarray
+        """
+        import numpy as np
+        from .pcmparse import parseFrames
+
+        out = np.empty(count, self.dtype)
+        got = min(count, len(self.rest))
+        out[:got] = self.rest[:got]
+        self.rest = self.rest[got:]
+        while got < count:
+            try:
+                data = await self.reader.readexactly(PCM_FRAME_BYTES)
+            except asyncio.IncompleteReadError:
+                break
+            frame = parseFrames(data, self.bb)
+            counter = int(frame.counters[0])
+            if self.lastCounter is not None and counter != (self.lastCounter + 1) & 0xffffffff:
+                self.rxLost += 1
+            self.lastCounter = counter
+            self.rxFrames += 1
+            take = min(count - got, len(frame.samples))
+            out[got:got + take] = frame.samples[:take]
+            self.rest = frame.samples[take:].copy()
+            got += take
+        return out[:got]
+
+    async def close(self):
+        """
+        Closes the pcmio port and restores passband PCM.
+        """
+        self.writer.close()
+        if self.onClose is not None:
+            onClose, self.onClose = self.onClose, None
+            await onClose()
+
+    def stats(self):
+        """
+        :returns    stats:  Frames each way, late transmit frames and receive counter gaps
+        :type       stats:  dictionary
+        """
+        return {'txFrames': self.txFrames, 'txLate': self.txLate,
+                'rxFrames': self.rxFrames, 'rxLost': self.rxLost}
@@ -0,0 +1,171 @@
+"""
+Batched SetValue transactions.
+
+A SetValueBatch collects SetValue commands (and optionally other commands)
+and writes them to the command socket in a single send.  The acknowledgements
+are then awaited together, so reconfiguring several elements costs one round
+trip instead of one per element.
+"""
+from __future__ import print_function
+import time
+
+# Words in a SetValue acknowledgement that mark it as a rejection, e.g.
+# 'SetValue invalid element X' or 'SetValue X invalid value Y', once the
+# element name is taken out of it
+ACK_ERROR_WORDS = ('error', 'invalid', 'fail')
+
+
+class BatchResult(object):
+    """
+    The outcome of a flushed batch.  acked maps each element to its
+    acknowledgement, failed lists the elements that were rejected or not
+    acknowledged in time.
+    """
+    def __init__(self, pendingList, correlator=None):
+        """
+        :param      pendingList:  The pending acknowledgements
+        :type       pendingList:  list of PendingReply
+        :param      correlator:   The correlator the acknowledgements were registered
+                                  with, to withdraw those not received in time
+        :type       correlator:   ReplyCorrelator
+        """
+        self.pendingList = pendingList
+        self.correlator = correlator
+        self.acked = {}
+        self.failed = []
+        self.complete = False
+
+    def wait(self, timeout=3):
+        """
+        Waits for all acknowledgements with one overall timeout.  Those not
+        received in time are withdrawn, so a late one cannot be taken for the
+        acknowledgement of a later SetValue of the same element.
+
+        :param      timeout:  The timeout in seconds
+        :type       timeout:  number
+        :returns    result:   This result, now complete
+        :type       result:   BatchResult
+        """
+        deadline = time.time() + timeout
+        for pending in self.pendingList:
+            reply = pending.result(max(0, deadline - time.time()))
+            if reply is None:
+                if self.correlator is not None:
+                    self.correlator.cancel(pending)
+                self.failed.append(pending.key)
+            elif isRejected(reply, pending.key):
+                self.failed.append(pending.key)
+            else:
+                self.acked[pending.key] = reply
+        self.complete = True
+        return self
+
+    def ok(self):
+        """
+        :returns    ok:  True if every element was acknowledged
+        :type       ok:  boolean
+        """
+        return self.complete and not self.failed
+
+
+def isRejected(reply, Element=None):
+    """
+    :param      reply:     The acknowledgement
+    :type       reply:     dictionary
+    :param      Element:   The element the acknowledgement is for; its name is ignored,
+                           so an element named e.g. ErrorCount can be acknowledged
+    :type       Element:   string
+    :returns    rejected:  True if the acknowledgement reports an error
+    :type       rejected:  boolean
+    """
+    info = reply.get('Info')
+    if not info:
+        return False
+    info = str(info)
+    if Element:
+        info = info.replace(Element, ' ')
+    info = info.lower()
+    for word in ACK_ERROR_WORDS:
+        if word in info:
+            return True
+    return False
+
+
+class SetValueBatch(object):
+    """
+    Collects commands for a single write to the command socket.
+
+    usage:
+        with modem.batch() as b:
+            b.setValueI('PayloadMode', 1)
+            b.setValueF('TxPowerWatts', 2.5)
+        if not b.result.ok():
+            print(b.result.failed)
+    """
+    def __init__(self, modem, timeout=3):
+        """
+        :param      modem:    The popoto instance the batch is sent through
+        :type       modem:    popoto
+        :param      timeout:  The acknowledgement timeout used by the with statement
+        :type       timeout:  number
+        """
+        self.modem = modem
+        self.timeout = timeout
+        self.commands = []
+        self.result = None
+
+    def setValueI(self, Element, value):
+        """
+        Adds a SetValue of a Popoto integer variable to the batch.
+        """
+        self.commands.append(('SetValue {} int {} 0'.format(Element, value), Element))
+        return self
+
+    def setValueF(self, Element, value):
+        """
+        Adds a SetValue of a Popoto float variable to the batch.
+        """
+        self.commands.append(('SetValue {} float {} 0'.format(Element, value), Element))
+        return self
+
+    def command(self, message):
+        """
+        Adds a command that is not acknowledged, e.g. an Event_, to the batch.
+        It is sent after the commands added before it.
+        """
+        self.commands.append((message, None))
+        return self
+
+    def flush(self):
+        """
+        Writes the batched commands in one send without waiting.  The result must
+        be waited on, or the acknowledgements stay registered until they arrive.
+
+        :returns    result:  The result to wait on for the acknowledgements
+        :type       result:  BatchResult
+        """
+        commands = self.commands
+        self.commands = []
+        self.result = BatchResult(self.modem.requestMany(commands), self.modem.correlator)
+        return self.result
+
+    def commit(self, timeout=None):
+        """
+        Writes the batched commands in one send and waits for all acknowledgements.
+
+        :param      timeout:  The timeout in seconds, the batch timeout if None
+        :type       timeout:  number
+        :returns    result:   The completed result
+        :type       result:   BatchResult
+        """
+        if timeout is None:
+            timeout = self.timeout
+        return self.flush().wait(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.commit()
+        return False
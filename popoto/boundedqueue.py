@@ -0,0 +1,182 @@
+"""
+A bounded FIFO with an explicit overflow policy.
+
+BoundedQueue offers the put/get/qsize/empty subset of Queue.Queue, so it can
+stand in where a Queue is consumed, but never grows past its capacity.  When
+it is full a put either discards the oldest item, discards the new item, or
+blocks the producer, and the number of discarded items is counted.  The
+memory held by the queued items is tracked approximately, see itemBytes.
+"""
+from __future__ import print_function
+import sys
+import threading
+import time
+from collections import deque
+
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+def itemBytes(item):
+    """
+    Estimates the memory an item holds: the buffer size of bytes and NumPy
+    arrays, and sys.getsizeof summed through dicts, lists and tuples, as for
+    parsed JSON replies.  Objects shared between items are counted for each.
+
+    :returns    size:  The approximate size in bytes
+    :type       size:  integer
+    """
+    nbytes = getattr(item, 'nbytes', None)
+    if nbytes is not None:
+        return nbytes
+    size = sys.getsizeof(item)
+    if isinstance(item, dict):
+        for key, value in item.items():
+            size += itemBytes(key) + itemBytes(value)
+    elif isinstance(item, (list, tuple)):
+        for value in item:
+            size += itemBytes(value)
+    return size
+
+
+class BoundedQueue(object):
+    """
+    BoundedQueue is a thread safe FIFO holding at most maxsize items.
+    """
+    def __init__(self, maxsize, policy=DROP_OLDEST, sizeOf=itemBytes):
+        """
+        :param      maxsize:  The capacity; 0 or less means unbounded
+        :type       maxsize:  integer
+        :param      policy:   DROP_OLDEST, DROP_NEWEST or BLOCK
+        :type       policy:   string
+        :param      sizeOf:   Estimates the bytes an item holds, None to not track bytes
+        :type       sizeOf:   function
+        """
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy {}'.format(policy))
+        self.maxsize = maxsize
+        self.policy = policy
+        self.items = deque()
+        self.sizeOf = sizeOf
+        self.sizes = deque()
+        self.bytes = 0
+        self.peakBytes = 0
+        self.mutex = threading.Lock()
+        self.notEmpty = threading.Condition(self.mutex)
+        self.notFull = threading.Condition(self.mutex)
+        self.putCount = 0
+        self.dropped = 0
+        self.peakDepth = 0
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Adds an item, applying the overflow policy if the queue is full.  With the
+        BLOCK policy a put that cannot complete within timeout drops the item.
+
+        :returns    queued:  False if the new item was dropped
+        :type       queued:  boolean
+        """
+        with self.mutex:
+            if 0 < self.maxsize <= len(self.items):
+                if self.policy == DROP_OLDEST:
+                    self.popleft()
+                    self.dropped += 1
+                elif self.policy == DROP_NEWEST or not block:
+                    self.dropped += 1
+                    return False
+                else:
+                    deadline = None if timeout is None else time.time() + timeout
+                    while len(self.items) >= self.maxsize:
+                        remaining = None if deadline is None else deadline - time.time()
+                        if remaining is not None and remaining <= 0:
+                            self.dropped += 1
+                            return False
+                        self.notFull.wait(remaining)
+            self.items.append(item)
+            if self.sizeOf is not None:
+                size = self.sizeOf(item)
+                self.sizes.append(size)
+                self.bytes += size
+                if self.bytes > self.peakBytes:
+                    self.peakBytes = self.bytes
+            self.putCount += 1
+            if len(self.items) > self.peakDepth:
+                self.peakDepth = len(self.items)
+            self.notEmpty.notify()
+            return True
+
+    def get(self, block=True, timeout=None):
+        """
+        Removes and returns the oldest item.
+
+        :raises     Queue.Empty:  If no item is available within timeout
+        """
+        with self.mutex:
+            if not block:
+                if not self.items:
+                    raise Queue.Empty
+            elif timeout is None:
+                while not self.items:
+                    self.notEmpty.wait()
+            else:
+                deadline = time.time() + timeout
+                while not self.items:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise Queue.Empty
+                    self.notEmpty.wait(remaining)
+            item = self.popleft()
+            self.notFull.notify()
+            return item
+
+    def popleft(self):
+        # Called with the mutex held
+        if self.sizes:
+            self.bytes -= self.sizes.popleft()
+        return self.items.popleft()
+
+    def clear(self):
+        """
+        Discards all queued items and wakes producers blocked on a full queue.
+        """
+        with self.mutex:
+            self.items.clear()
+            self.sizes.clear()
+            self.bytes = 0
+            self.notFull.notify_all()
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def put_nowait(self, item):
+        return self.put(item, False)
+
+    def qsize(self):
+        return len(self.items)
+
+    def empty(self):
+        return not self.items
+
+    def full(self):
+        return 0 < self.maxsize <= len(self.items)
+
+    def stats(self):
+        """
+        :returns    stats:  depth, peakDepth, putCount and dropped counters, and the
+                            approximate bytes held now and at the peak (None if
+                            bytes are not tracked)
+        :type       stats:  dictionary
+        """
+        with self.mutex:
+            tracked = self.sizeOf is not None
+            return {'depth': len(self.items), 'peakDepth': self.peakDepth,
+                    'putCount': self.putCount, 'dropped': self.dropped,
+                    'bytes': self.bytes if tracked else None,
+                    'peakBytes': self.peakBytes if tracked else None}
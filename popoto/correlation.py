@@ -0,0 +1,231 @@
+"""
+Request/response correlation for the Popoto command socket.
+
+Popoto answers commands on the same socket it uses for unsolicited status,
+and the replies carry no sequence number.  Replies are therefore matched to
+outstanding requests by the key they are known to carry: the element name
+of a GetValue, 'Element' for GetParameters, and so on.  Requests waiting on
+the same key are answered in the order they were sent, which is the order
+the modem processes them.
+"""
+from __future__ import print_function
+import threading
+import time
+from collections import deque
+
+# Top level reply keys of the commands that do not answer with the element name
+REPLY_KEYS = {
+    'GetParameters': 'Element',
+    'GetVersion':    'Version',
+    'GetRTC':        'RTC',
+}
+
+# Info text that answers a request in place of its reply key, e.g. a
+# GetParameters sent past the last element
+REPLY_ERRORS = {
+    'Element': 'GetParameters invalid index',
+}
+
+
+class PendingReply(object):
+    """
+    A blocking handle on the reply to one command.
+    """
+    def __init__(self, command, key, infoMatch=False):
+        """
+        :param      command:    The command string that was sent
+        :type       command:    string
+        :param      key:        The reply key that identifies the answer
+        :type       key:        string
+        :param      infoMatch:  Match on key appearing in an 'Info' string instead of
+                                a top level reply key
+        :type       infoMatch:  boolean
+        """
+        self.command = command
+        self.key = key
+        self.infoMatch = infoMatch
+        self.msgType = None
+        self.reply = None
+        self.sentTime = time.time()
+        self.replyTime = None
+        self.event = threading.Event()
+
+    def done(self):
+        """
+        :returns    done:  True once the reply has arrived
+        :type       done:  boolean
+        """
+        return self.event.is_set()
+
+    def resolve(self, msgType, reply):
+        self.msgType = msgType
+        self.reply = reply
+        self.replyTime = time.time()
+        self.event.set()
+
+    def result(self, timeout=None):
+        """
+        Blocks until the reply arrives or the timeout (in seconds) expires.
+
+        :param      timeout:  The timeout, None to wait forever
+        :type       timeout:  number
+        :returns    reply:    The decoded reply, None on timeout
+        :type       reply:    dictionary
+        """
+        self.event.wait(timeout)
+        return self.reply
+
+    def latency(self):
+        """
+        :returns    latency:  Seconds from send to reply, None while pending
+        :type       latency:  number
+        """
+        if self.replyTime is None:
+            return None
+        return self.replyTime - self.sentTime
+
+
+class ReplyCorrelator(object):
+    """
+    ReplyCorrelator keeps the outstanding requests keyed by the reply key
+    they wait for.  Matching a reply is a dictionary lookup per top level key
+    of the reply; only requests registered with infoMatch scan 'Info' text.
+    """
+    def __init__(self, pendingClass=PendingReply):
+        """
+        :param      pendingClass:  The handle class created by expect
+        :type       pendingClass:  PendingReply subclass
+        """
+        self.pendingClass = pendingClass
+        # Called with each resolved request, e.g. to record its latency
+        self.observer = None
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.infoPending = deque()
+
+    def expect(self, command, key, infoMatch=False):
+        """
+        Registers a request whose reply will carry key.  Call this before the
+        command is written to the socket so a fast reply cannot be missed.
+
+        :param      command:    The command string
+        :type       command:    string
+        :param      key:        The reply key
+        :type       key:        string
+        :param      infoMatch:  Match key against 'Info' text instead
+        :type       infoMatch:  boolean
+        :returns    pending:    The handle for the reply
+        :type       pending:    PendingReply
+        """
+        pending = self.pendingClass(command, key, infoMatch)
+        with self.lock:
+            if infoMatch:
+                self.infoPending.append(pending)
+            else:
+                self.pending.setdefault(key, deque()).append(pending)
+        return pending
+
+    def cancel(self, pending):
+        """
+        Withdraws a request that is no longer wanted, e.g. after a timeout, so
+        that a late reply is not matched to the next request with the same key.
+        """
+        with self.lock:
+            if pending.infoMatch:
+                waiting = self.infoPending
+            else:
+                waiting = self.pending.get(pending.key)
+                if waiting is None:
+                    return
+            try:
+                waiting.remove(pending)
+            except ValueError:
+                return
+            if not waiting and not pending.infoMatch:
+                del self.pending[pending.key]
+
+    def failAll(self):
+        """
+        Withdraws every outstanding request and wakes its waiters with no
+        reply, as on a timeout, e.g. when the connection is lost.
+        """
+        with self.lock:
+            failed = [p for waiting in self.pending.values() for p in waiting]
+            failed.extend(self.infoPending)
+            self.pending = {}
+            self.infoPending = deque()
+        for pending in failed:
+            pending.resolve(None, None)
+
+    def match(self, msgType, reply):
+        """
+        Hands a reply to the oldest request waiting for it.
+
+        :param      msgType:  The message type prefix
+        :type       msgType:  string
+        :param      reply:    The decoded reply
+        :type       reply:    dictionary
+        :returns    matched:  True if the reply was consumed by a request
+        :type       matched:  boolean
+        """
+        if not isinstance(reply, dict):
+            return False
+        found = None
+        with self.lock:
+            if self.pending:
+                for key in reply:
+                    waiting = self.pending.get(key)
+                    if waiting:
+                        found = waiting.popleft()
+                        if not waiting:
+                            del self.pending[key]
+                        break
+            info = reply.get('Info') if found is None else None
+            if info and self.pending:
+                info = str(info)
+                for key, text in REPLY_ERRORS.items():
+                    waiting = self.pending.get(key)
+                    if waiting and text in info:
+                        # Requests are answered in order, so the error is the oldest's
+                        found = waiting.popleft()
+                        if not waiting:
+                            del self.pending[key]
+                        break
+            if found is None and info and self.infoPending:
+                for pending in self.infoPending:
+                    if pending.key in info:
+                        found = pending
+                        self.infoPending.remove(pending)
+                        break
+        if found is None:
+            return False
+        found.resolve(msgType, reply)
+        if self.observer is not None:
+            self.observer(found)
+        return True
+
+    def outstanding(self):
+        """
+        :returns    count:  The number of requests still waiting for a reply
+        :type       count:  integer
+        """
+        with self.lock:
+            return sum(len(w) for w in self.pending.values()) + len(self.infoPending)
+
+
+def waitForReplies(pendingList, timeout):
+    """
+    Waits for a group of pipelined requests with one overall timeout.
+
+    :param      pendingList:  The handles returned by the request calls
+    :type       pendingList:  list of PendingReply
+    :param      timeout:      The overall timeout in seconds
+    :type       timeout:      number
+    :returns    replies:      The replies in request order, None where timed out
+    :type       replies:      list
+    """
+    deadline = time.time() + timeout
+    replies = []
+    for pending in pendingList:
+        replies.append(pending.result(max(0, deadline - time.time())))
+    return replies
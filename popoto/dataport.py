@@ -0,0 +1,230 @@
+"""
+Streaming transfers on the Popoto data port.
+
+DataUploader sends a file to the data socket in chunks matched to the
+modem's ConsolePacketBytes, reading each chunk into one reusable buffer, so
+memory use does not depend on the file size.  Every byte accepted by the
+socket is accounted for, which lets an interrupted upload resume from the
+exact offset, and the achieved throughput is reported as it goes.
+
+DataReceiver is the receive side: a background reader that reassembles the
+acoustic payloads the modem forwards to the data socket.
+"""
+from __future__ import print_function
+import os
+import select
+import socket
+import threading
+import time
+from collections import namedtuple
+
+from .boundedqueue import BoundedQueue, DROP_OLDEST
+
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+
+class DataUploader(object):
+    """
+    DataUploader streams a file, or the tail of a file from an offset, to a
+    connected data socket.
+    """
+    def __init__(self, sock, chunkBytes=256, progress=None, progressInterval=1.0):
+        """
+        :param      sock:              The connected data socket
+        :type       sock:              socket
+        :param      chunkBytes:        The bytes per send, normally ConsolePacketBytes
+        :type       chunkBytes:        integer
+        :param      progress:          Called as progress(sent, total, bytesPerSec)
+        :type       progress:          function
+        :param      progressInterval:  The seconds between progress calls
+        :type       progressInterval:  number
+        """
+        self.sock = sock
+        self.chunkBytes = chunkBytes
+        self.progress = progress
+        self.progressInterval = progressInterval
+        self.buf = bytearray(chunkBytes)
+        self.position = 0
+        self.sent = 0
+        self.total = 0
+        self.elapsed = 0
+        self.bytesPerSec = 0
+
+    def upload(self, filename, offset=0, length=None):
+        """
+        Sends length bytes of a file starting at offset.  If the socket fails the
+        exception propagates and position holds the file offset to resume from.
+
+        :param      filename:  The filename to be sent with path
+        :type       filename:  string
+        :param      offset:    The file offset to start from
+        :type       offset:    integer
+        :param      length:    The number of bytes to send, the rest of the file if None
+        :type       length:    integer
+        :returns    sent:      The number of bytes sent
+        :type       sent:      integer
+        """
+        if length is None:
+            length = os.path.getsize(filename) - offset
+        self.total = length
+        self.sent = 0
+        self.position = offset
+        view = memoryview(self.buf)
+        start = time.time()
+        nextReport = start + self.progressInterval
+        with open(filename, 'rb') as fp:
+            fp.seek(offset)
+            try:
+                while self.sent < length:
+                    count = fp.readinto(view[:min(self.chunkBytes, length - self.sent)])
+                    if not count:
+                        break
+                    # send() may take part of the chunk; the socket blocks while the
+                    # modem's receive window is full, which paces the upload
+                    done = 0
+                    while done < count:
+                        n = self.sock.send(view[done:count])
+                        done += n
+                        self.sent += n
+                        self.position += n
+                    now = time.time()
+                    if self.progress is not None and now >= nextReport:
+                        self.progress(self.sent, self.total, self.rate(now - start))
+                        nextReport = now + self.progressInterval
+            finally:
+                self.elapsed = time.time() - start
+                self.bytesPerSec = self.rate(self.elapsed)
+        if self.progress is not None:
+            self.progress(self.sent, self.total, self.bytesPerSec)
+        return self.sent
+
+    def rate(self, elapsed):
+        if elapsed <= 0:
+            return 0
+        return self.sent / elapsed
+
+
+# A payload received on the data port.  packets holds one (offset, length, time)
+# tuple per socket read, giving the arrival time of each part of data.
+DataPayload = namedtuple('DataPayload', 'data packets startTime endTime')
+
+
+class DataReceiver(object):
+    """
+    DataReceiver reads the data socket on a background thread and reassembles
+    the incoming bytes into payloads.  A payload ends when the socket has been
+    idle for payloadGap seconds, the same way the modem closes a packet after
+    ConsoleTimeoutMS, or when it reaches maxPayload bytes.
+
+    The socket is read with recv_into directly into one preallocated payload
+    buffer, so a long running receiver does not grow its memory; each finished
+    payload is copied out once as an immutable bytes object.
+    """
+    def __init__(self, sock, callback=None, maxPayloads=64, overflow=DROP_OLDEST,
+                 payloadGap=0.5, maxPayload=65536, outDir=None):
+        """
+        :param      sock:         The connected data socket
+        :type       sock:         socket
+        :param      callback:     Called with each DataPayload on the receive thread.
+                                  When None payloads are put on the queue.
+        :type       callback:     function
+        :param      maxPayloads:  The capacity of the payload queue
+        :type       maxPayloads:  integer
+        :param      overflow:     DROP_OLDEST, DROP_NEWEST or BLOCK when the queue is full
+        :type       overflow:     string
+        :param      payloadGap:   The idle seconds that end a payload
+        :type       payloadGap:   number
+        :param      maxPayload:   The largest payload in bytes
+        :type       maxPayload:   integer
+        :param      outDir:       If set, each payload is also written to a file there
+        :type       outDir:       string
+        """
+        self.sock = sock
+        self.callback = callback
+        self.queue = BoundedQueue(maxPayloads, overflow)
+        self.payloadGap = payloadGap
+        self.buf = bytearray(maxPayload)
+        self.outDir = outDir
+        self.payloads = 0
+        self.bytesReceived = 0
+        self.is_running = False
+        self.thread = None
+
+    def start(self):
+        self.is_running = True
+        self.thread = threading.Thread(target=self.run, name="DataRxLoop")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def run(self):
+        view = memoryview(self.buf)
+        size = len(self.buf)
+        fill = 0
+        packets = []
+        tick = min(self.payloadGap, 0.1)
+        while self.is_running:
+            readable, writable, failed = select.select([self.sock], [], [], tick)
+            now = time.time()
+            if not readable:
+                if fill and now - packets[-1][2] >= self.payloadGap:
+                    self.deliver(fill, packets)
+                    fill = 0
+                    packets = []
+                continue
+            try:
+                count = self.sock.recv_into(view[fill:])
+            except socket.error:
+                break
+            if count == 0:
+                break
+            packets.append((fill, count, now))
+            fill += count
+            self.bytesReceived += count
+            if fill == size:
+                self.deliver(fill, packets)
+                fill = 0
+                packets = []
+        if fill:
+            self.deliver(fill, packets)
+        self.is_running = False
+
+    def deliver(self, fill, packets):
+        payload = DataPayload(bytes(self.buf[:fill]), packets, packets[0][2], packets[-1][2])
+        self.payloads += 1
+        if self.outDir is not None:
+            name = os.path.join(self.outDir, 'payload_{}_{:06d}.bin'.format(
+                time.strftime('%Y%m%d-%H%M%S', time.localtime(payload.startTime)), self.payloads))
+            with open(name, 'wb') as fp:
+                fp.write(payload.data)
+        if self.callback is not None:
+            self.callback(payload)
+        else:
+            self.queue.put(payload)
+
+    def read(self, timeout=None):
+        """
+        Returns the next payload from the queue.
+
+        :param      timeout:  The timeout in seconds, None to wait forever
+        :type       timeout:  number
+        :returns    payload:  The next payload, None on timeout
+        :type       payload:  DataPayload
+        """
+        try:
+            return self.queue.get(True, timeout)
+        except Queue.Empty:
+            return None
+
+    def stop(self):
+        """
+        Stops the receive thread.  The socket is left open.
+        """
+        self.is_running = False
+        self.queue.clear()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
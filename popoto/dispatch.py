@@ -0,0 +1,210 @@
+"""
+Topic based routing of the messages Popoto sends on the command socket.
+
+Status and unsolicited messages are routed by their message type prefix
+(e.g. 'Info') and by their top level JSON keys (e.g. 'Info', 'Element',
+'Application.0') to subscriptions.  A subscription either calls a callback
+on the receive thread or holds the messages in its own bounded queue, so a
+consumer sees only the messages it asked for and never has to search a
+shared queue.
+
+Routing a message costs one dictionary lookup for the message type and one
+per top level key, independent of the number of subscriptions.
+"""
+from __future__ import print_function
+import threading
+
+from .boundedqueue import BoundedQueue, DROP_OLDEST
+from .trace import tracer
+
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+# Subscribing to ANY_TOPIC receives every message that reaches the dispatcher
+ANY_TOPIC = '*'
+
+
+class Subscription(object):
+    """
+    One consumer of a topic.  Messages are handed to the callback if one was
+    given, otherwise they are queued for read().
+    """
+    def __init__(self, dispatcher, topic, byType, callback=None, maxsize=64,
+                 overflow=DROP_OLDEST, consume=True, blockTimeout=0.1):
+        """
+        :param      dispatcher:  The dispatcher the subscription is registered with
+        :type       dispatcher:  EventDispatcher
+        :param      topic:       The top level key or message type subscribed to
+        :type       topic:       string
+        :param      byType:      True if topic is a message type prefix
+        :type       byType:      boolean
+        :param      callback:    Called as callback(msgType, reply) on the receive thread
+        :type       callback:    function
+        :param      maxsize:     The capacity of the queue when there is no callback
+        :type       maxsize:     integer
+        :param      overflow:    DROP_OLDEST, DROP_NEWEST or BLOCK when the queue is full
+        :type       overflow:    string
+        :param      consume:     False to observe the messages while leaving them routed
+                                 as if the subscription did not exist
+        :type       consume:     boolean
+        :param      blockTimeout:  With BLOCK, the most seconds the receive thread waits
+                                   for queue space before dropping the message
+        :type       blockTimeout:  number
+        """
+        self.dispatcher = dispatcher
+        self.topic = topic
+        self.byType = byType
+        self.callback = callback
+        self.consume = consume
+        self.blockTimeout = blockTimeout
+        self.queue = None
+        if callback is None:
+            self.queue = BoundedQueue(maxsize, overflow)
+        self.delivered = 0
+        self.errors = 0
+
+    def deliver(self, msgType, reply):
+        self.delivered += 1
+        if self.callback is None:
+            # Only BLOCK waits, and for at most blockTimeout, so a slow reader
+            # cannot stall the receive thread indefinitely
+            self.queue.put(reply, True, self.blockTimeout)
+            return
+        try:
+            self.callback(msgType, reply)
+        except Exception as e:
+            self.errors += 1
+            tracer.warning("Subscriber to {} failed: {}", self.topic, e)
+
+    def read(self, timeout=None):
+        """
+        Returns the next queued message.
+
+        :param      timeout:  The timeout in seconds, None to wait forever
+        :type       timeout:  number
+        :returns    reply:    The decoded message, None on timeout
+        :type       reply:    dictionary
+        """
+        try:
+            return self.queue.get(True, timeout)
+        except Queue.Empty:
+            return None
+
+    def stats(self):
+        """
+        :returns    stats:  delivered and callback error counts, plus the queue counters
+        :type       stats:  dictionary
+        """
+        stats = {'delivered': self.delivered, 'errors': self.errors}
+        if self.queue is not None:
+            stats.update(self.queue.stats())
+        return stats
+
+    def unsubscribe(self):
+        self.dispatcher.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.unsubscribe()
+
+
+class EventDispatcher(object):
+    """
+    EventDispatcher keeps the subscriptions in two tables, one keyed by message
+    type and one by top level reply key.  The tables are replaced rather than
+    modified when a subscription is added or removed, so dispatch() reads them
+    without taking a lock.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.byType = {}
+        self.byKey = {}
+        self.unrouted = 0
+
+    def subscribe(self, topic, callback=None, maxsize=64, overflow=DROP_OLDEST, byType=False,
+                  consume=True, blockTimeout=0.1):
+        """
+        Subscribes to the messages carrying a top level key, or with byType to the
+        messages with a message type prefix.
+
+        :param      topic:     The key or message type, ANY_TOPIC for every message
+        :type       topic:     string
+        :param      callback:  Called as callback(msgType, reply); None to queue the messages
+        :type       callback:  function
+        :param      maxsize:   The capacity of the subscription queue
+        :type       maxsize:   integer
+        :param      overflow:  DROP_OLDEST, DROP_NEWEST or BLOCK when the queue is full
+        :type       overflow:  string
+        :param      byType:    Match topic against the message type prefix
+        :type       byType:    boolean
+        :param      consume:   False to observe without taking the messages from the replyQ
+        :type       consume:   boolean
+        :param      blockTimeout:  With BLOCK, the most seconds a full queue holds up the
+                                   receive thread before the message is dropped
+        :type       blockTimeout:  number
+        :returns    sub:       The subscription
+        :type       sub:       Subscription
+        """
+        sub = Subscription(self, topic, byType, callback, maxsize, overflow, consume,
+                           blockTimeout)
+        with self.lock:
+            table = dict(self.byType if byType else self.byKey)
+            table[topic] = table.get(topic, ()) + (sub,)
+            if byType:
+                self.byType = table
+            else:
+                self.byKey = table
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            table = dict(self.byType if sub.byType else self.byKey)
+            remaining = tuple(s for s in table.get(sub.topic, ()) if s is not sub)
+            if remaining:
+                table[sub.topic] = remaining
+            else:
+                table.pop(sub.topic, None)
+            if sub.byType:
+                self.byType = table
+            else:
+                self.byKey = table
+
+    def dispatch(self, msgType, reply):
+        """
+        Delivers a message to every subscription matching its type or keys.  A
+        subscription matching several keys of one message receives it once.
+
+        :param      msgType:    The message type prefix
+        :type       msgType:    string
+        :param      reply:      The decoded message
+        :type       reply:      dictionary
+        :returns    consumed:   True if at least one consuming subscription received the
+                                message
+        :type       consumed:   boolean
+        """
+        byType = self.byType
+        byKey = self.byKey
+        subs = byType.get(msgType, ()) + byType.get(ANY_TOPIC, ()) + byKey.get(ANY_TOPIC, ())
+        if byKey and isinstance(reply, dict):
+            for key in reply:
+                found = byKey.get(key)
+                if found:
+                    subs += found
+        if not subs:
+            self.unrouted += 1
+            return False
+        if len(subs) == 1:
+            subs[0].deliver(msgType, reply)
+            return subs[0].consume
+        seen = set()
+        consumed = False
+        for sub in subs:
+            if id(sub) not in seen:
+                seen.add(id(sub))
+                sub.deliver(msgType, reply)
+                consumed = consumed or sub.consume
+        return consumed
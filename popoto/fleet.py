@@ -0,0 +1,526 @@
+"""
+Driving a rack of Popoto modems from one I/O thread.
+
+PopotoFleet multiplexes the command socket of every modem over a single
+selectors loop.  Connections are opened without blocking and in parallel,
+parameter schemas are loaded for all modems at once (from the schema cache
+where possible), and commands can be broadcast to the whole fleet or a group
+with the replies collected per modem.  The number of threads stays at one
+however many modems are attached.
+
+usage:
+    fleet = PopotoFleet(['10.0.0.10', '10.0.0.11', ('10.0.0.12', 18000)])
+    fleet.connect()
+    fleet.setValueI('CarrierTxMode', 0)
+    levels = fleet.group(['10.0.0.10:17000']).getValueF('TxPowerWatts')
+"""
+from __future__ import print_function
+import errno
+import json
+import selectors
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+from .batch import isRejected
+from .boundedqueue import BoundedQueue, DROP_OLDEST
+from .correlation import ReplyCorrelator, REPLY_KEYS
+from .dispatch import EventDispatcher
+from .framing import CommandReader, formatCommand
+from .schemacache import SchemaCache
+from .trace import tracer
+
+
+class FleetModem(object):
+    """
+    The connection state of one modem in a fleet.  Replies that do not answer
+    a request go to the subscribers of its dispatcher, or else on its replyQ.
+    """
+    def __init__(self, ip, basePort=17000, replyQSize=1024):
+        self.ip = ip
+        self.cmdport = basePort
+        self.name = '{}:{}'.format(ip, basePort)
+        self.sock = None
+        self.reader = None
+        self.connected = False
+        self.error = None
+        self.errorcount = 0
+        self.correlator = ReplyCorrelator()
+        self.dispatcher = EventDispatcher()
+        self.replyQ = BoundedQueue(replyQSize, DROP_OLDEST)
+        self.outbuf = bytearray()
+        self.outLock = threading.Lock()
+        self.intParams = {}
+        self.floatParams = {}
+        self.version = None
+
+
+class ParamWalker(object):
+    """
+    Walks the nextidx chain of one modem without blocking.  step() consumes
+    whatever replies have arrived and keeps window requests in flight, so the
+    walks of all modems advance together on one thread.  complete is set
+    once the walk reaches the element with nextidx -1.
+    """
+    def __init__(self, fleet, modem, window, timeout=3):
+        self.fleet = fleet
+        self.modem = modem
+        self.window = window
+        self.timeout = timeout
+        self.inflight = {}
+        self.nextSpec = 0
+        self.idx = 0
+        self.active = True
+        self.complete = False
+        self.issue()
+
+    def issue(self):
+        for i in [self.idx] + list(range(max(self.nextSpec, self.idx + 1), self.idx + self.window)):
+            if i not in self.inflight:
+                self.inflight[i] = self.fleet.requestModem(self.modem, 'GetParameters {}'.format(i))
+        self.nextSpec = max(self.nextSpec, self.idx + self.window)
+
+    def step(self):
+        while self.active:
+            pending = self.inflight[self.idx]
+            if not pending.done():
+                if time.time() - pending.sentTime > self.timeout:
+                    tracer.warning("GetParameter Timeout on {}", self.modem.name)
+                    self.modem.correlator.cancel(pending)
+                    self.active = False
+                return
+            del self.inflight[self.idx]
+            reply = pending.reply or {}
+            El = reply.get('Element')
+            if El is None:
+                tracer.warning("GetParameters {} failed on {}: {}", self.idx, self.modem.name,
+                               reply.get('Info', self.modem.error))
+                self.active = False
+                return
+            self.idx = int(El.get('nextidx', -1))
+            if self.idx > 0:
+                if El['Format'] == 'int':
+                    self.modem.intParams[El['Name']] = El
+                else:
+                    self.modem.floatParams[El['Name']] = El
+                self.issue()
+            else:
+                self.complete = self.idx < 0
+                self.active = False
+
+
+class PopotoFleet(object):
+    '''
+    A manager for many Popoto modems sharing one selector based I/O thread.
+
+    Methods that address modems take names, a list of modem names ('ip:port'),
+    and act on the whole fleet when names is None.  Requests return a
+    dictionary of modem name to result.
+    '''
+    def __init__(self, modems, schemaCache=True, paramWindow=1, replyQSize=1024):
+        """
+        :param      modems:       The modems, as ip strings or (ip, basePort) tuples
+        :type       modems:       list
+        :param      schemaCache:  True for the default on-disk schema cache, False to always
+                                  enumerate, or a SchemaCache instance
+        :type       schemaCache:  boolean or SchemaCache
+        :param      paramWindow:  Number of GetParameters requests in flight per modem; above
+                                  1 relies on the modems answering requests past the end
+                                  of the chain with an 'invalid index' Info
+        :type       paramWindow:  integer
+        :param      replyQSize:   The capacity of each modem's replyQ.  The oldest
+                                  message is dropped when it is full.
+        :type       replyQSize:   integer
+        """
+        self.modems = OrderedDict()
+        for entry in modems:
+            if isinstance(entry, tuple):
+                modem = FleetModem(*entry, replyQSize=replyQSize)
+            else:
+                modem = FleetModem(entry, replyQSize=replyQSize)
+            self.modems[modem.name] = modem
+        if schemaCache is True:
+            schemaCache = SchemaCache()
+        self.schemaCache = schemaCache or None
+        self.paramWindow = paramWindow
+        self.selector = selectors.DefaultSelector()
+        self.wakeRx, self.wakeTx = socket.socketpair()
+        self.wakeRx.setblocking(False)
+        self.wakeTx.setblocking(False)
+        self.selector.register(self.wakeRx, selectors.EVENT_READ, None)
+        self.progress = threading.Condition()
+        self.is_running = False
+        self.ioThread = None
+
+    def connect(self, timeout=5, loadParameters=True):
+        """
+        Connects to all modems in parallel and loads their parameter schemas.
+
+        :param      timeout:         The connect timeout in seconds
+        :type       timeout:         number
+        :param      loadParameters:  Load the parameter schemas after connecting
+        :type       loadParameters:  boolean
+        :returns    failed:          Modem name to error for the modems that did not connect
+        :type       failed:          dictionary
+        """
+        for modem in self.modems.values():
+            modem.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            modem.sock.setblocking(False)
+            modem.reader = CommandReader(modem.sock)
+            err = modem.sock.connect_ex((modem.ip, modem.cmdport))
+            if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                modem.error = err
+                continue
+            self.selector.register(modem.sock, selectors.EVENT_WRITE, modem)
+
+        self.is_running = True
+        self.ioThread = threading.Thread(target=self.ioLoop, name="FleetIoLoop")
+        self.ioThread.daemon = True
+        self.ioThread.start()
+
+        deadline = time.time() + timeout
+        with self.progress:
+            while time.time() < deadline:
+                if all(m.connected or m.error is not None for m in self.modems.values()):
+                    break
+                self.progress.wait(deadline - time.time())
+        failed = {}
+        for modem in self.modems.values():
+            if not modem.connected:
+                failed[modem.name] = modem.error if modem.error is not None else 'timeout'
+        if loadParameters:
+            self.loadParameters()
+        return failed
+
+    def close(self):
+        """
+        Stops the I/O thread and closes every command socket.
+        """
+        self.is_running = False
+        self.wake()
+        if self.ioThread is not None:
+            self.ioThread.join()
+            self.ioThread = None
+        for modem in self.modems.values():
+            if modem.sock is not None:
+                modem.sock.close()
+                modem.sock = None
+            modem.connected = False
+
+    # ---------------------------------------------------------------
+    # I/O thread
+    # ---------------------------------------------------------------
+    def ioLoop(self):
+        while self.is_running:
+            for key, events in self.selector.select(0.5):
+                modem = key.data
+                if modem is None:
+                    self.drainWake()
+                    continue
+                if not modem.connected:
+                    self.finishConnect(modem)
+                    continue
+                if events & selectors.EVENT_READ:
+                    self.readModem(modem)
+                if events & selectors.EVENT_WRITE and modem.connected:
+                    self.flush(modem)
+        tracer.debug("exiting FleetIoLoop")
+
+    def finishConnect(self, modem):
+        err = modem.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            modem.error = err
+            self.selector.unregister(modem.sock)
+        else:
+            modem.connected = True
+            self.flush(modem)
+        with self.progress:
+            self.progress.notify_all()
+
+    def readModem(self, modem):
+        error = 'closed by the modem'
+        try:
+            count = modem.reader.fill()
+        except (BlockingIOError, InterruptedError):
+            return
+        except socket.error as s_err:
+            modem.errorcount += 1
+            count = 0
+            error = s_err
+        for msgType, jsonData in modem.reader.frames():
+            try:
+                reply = json.loads(jsonData)
+            except ValueError:
+                tracer.warning("Unparseable JSON message from {}: {}", modem.name, jsonData)
+                continue
+            if modem.correlator.match(msgType, reply):
+                continue
+            if not modem.dispatcher.dispatch(msgType, reply):
+                modem.replyQ.put(reply, False)
+        if count == 0:
+            self.dropModem(modem, error)
+        with self.progress:
+            self.progress.notify_all()
+
+    def flush(self, modem):
+        error = None
+        with modem.outLock:
+            if modem.outbuf:
+                try:
+                    sent = modem.sock.send(modem.outbuf)
+                    del modem.outbuf[:sent]
+                except (BlockingIOError, InterruptedError):
+                    pass
+                except socket.error as s_err:
+                    modem.errorcount += 1
+                    error = s_err
+            events = selectors.EVENT_READ
+            if modem.outbuf:
+                events |= selectors.EVENT_WRITE
+        if error is not None:
+            self.dropModem(modem, error)
+            return
+        self.selector.modify(modem.sock, events, modem)
+
+    def dropModem(self, modem, error):
+        """
+        Takes a modem whose command socket failed or was closed out of the
+        loop.  Its unsent commands are discarded and its outstanding requests
+        fail at once rather than at their timeouts.
+        """
+        tracer.warning("Lost connection to {}: {}", modem.name, error)
+        with modem.outLock:
+            modem.connected = False
+            modem.error = error
+            del modem.outbuf[:]
+        try:
+            self.selector.unregister(modem.sock)
+        except (KeyError, ValueError):
+            pass
+        modem.correlator.failAll()
+        with self.progress:
+            self.progress.notify_all()
+
+    def wake(self):
+        try:
+            self.wakeTx.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def drainWake(self):
+        try:
+            while self.wakeRx.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        for modem in self.modems.values():
+            if modem.connected and modem.outbuf:
+                self.flush(modem)
+
+    # ---------------------------------------------------------------
+    # Commands
+    # ---------------------------------------------------------------
+    def select(self, names):
+        if names is None:
+            return list(self.modems.values())
+        return [self.modems[name] for name in names]
+
+    def queueModem(self, modem, data):
+        with modem.outLock:
+            if not self.dropped(modem):
+                modem.outbuf += data
+        self.wake()
+
+    def requestModem(self, modem, message, key=None, infoMatch=False):
+        """
+        Queues a command for one modem and returns a handle on its reply.
+        """
+        if key is None:
+            command = message.split(' ', 1)[0]
+            key = REPLY_KEYS.get(command, command)
+        with modem.outLock:
+            pending = modem.correlator.expect(message, key, infoMatch)
+            dropped = self.dropped(modem)
+            if not dropped:
+                modem.outbuf += formatCommand(message)
+        if dropped:
+            modem.correlator.failAll()
+        else:
+            self.wake()
+        return pending
+
+    def dropped(self, modem):
+        # Failed to connect, or lost the connection
+        return modem.error is not None and not modem.connected
+
+    def gather(self, pendingByName, timeout):
+        deadline = time.time() + timeout
+        replies = {}
+        for name, pending in pendingByName.items():
+            reply = pending.result(max(0, deadline - time.time()))
+            if reply is None:
+                self.modems[name].correlator.cancel(pending)
+            replies[name] = reply
+        return replies
+
+    def send(self, message, names=None):
+        """
+        Sends a command to every selected modem without waiting for replies.
+        """
+        data = formatCommand(message)
+        for modem in self.select(names):
+            self.queueModem(modem, data)
+
+    def request(self, message, key=None, infoMatch=False, names=None, timeout=3):
+        """
+        Sends a command to every selected modem and collects the replies.
+
+        :returns    replies:  Modem name to reply, None where the reply timed out
+        :type       replies:  dictionary
+        """
+        pendingByName = OrderedDict()
+        for modem in self.select(names):
+            pendingByName[modem.name] = self.requestModem(modem, message, key, infoMatch)
+        return self.gather(pendingByName, timeout)
+
+    def startRx(self, names=None):
+        self.send('Event_StartRx', names)
+
+    def setValueI(self, Element, value, names=None, timeout=3):
+        """
+        Sets an integer variable on every selected modem.
+
+        :returns    acked:  Modem name to True if the modem acknowledged the value
+        :type       acked:  dictionary
+        """
+        replies = self.request('SetValue {} int {} 0'.format(Element, value), Element, True,
+                               names, timeout)
+        return OrderedDict((name, reply is not None and not isRejected(reply, Element))
+                           for name, reply in replies.items())
+
+    def setValueF(self, Element, value, names=None, timeout=3):
+        """
+        Sets a float variable on every selected modem.
+
+        :returns    acked:  Modem name to True if the modem acknowledged the value
+        :type       acked:  dictionary
+        """
+        replies = self.request('SetValue {} float {} 0'.format(Element, value), Element, True,
+                               names, timeout)
+        return OrderedDict((name, reply is not None and not isRejected(reply, Element))
+                           for name, reply in replies.items())
+
+    def getValueI(self, Element, names=None, timeout=3):
+        """
+        :returns    values:  Modem name to value, None where the reply timed out
+        :type       values:  dictionary
+        """
+        replies = self.request('GetValue {} int  0'.format(Element), Element, names=names,
+                               timeout=timeout)
+        return OrderedDict((name, None if reply is None else reply.get(Element))
+                           for name, reply in replies.items())
+
+    def getValueF(self, Element, names=None, timeout=3):
+        """
+        :returns    values:  Modem name to value, None where the reply timed out
+        :type       values:  dictionary
+        """
+        replies = self.request('GetValue {} float  0'.format(Element), Element, names=names,
+                               timeout=timeout)
+        return OrderedDict((name, None if reply is None else reply.get(Element))
+                           for name, reply in replies.items())
+
+    def getVersion(self, names=None, timeout=3):
+        key = REPLY_KEYS['GetVersion']
+        replies = self.request('GetVersion', names=names, timeout=timeout)
+        return OrderedDict((name, None if reply is None else reply.get(key))
+                           for name, reply in replies.items())
+
+    def loadParameters(self, names=None):
+        """
+        Loads the parameter schemas of the selected modems in parallel, from the
+        schema cache where the modem version matches.  Only complete walks are
+        cached.
+        """
+        modems = [m for m in self.select(names) if m.connected]
+        if self.schemaCache is not None:
+            versions = self.getVersion([m.name for m in modems])
+            walk = []
+            for modem in modems:
+                modem.version = versions[modem.name]
+                cached = None
+                if modem.version is not None:
+                    cached = self.schemaCache.load(modem.ip, modem.cmdport, modem.version)
+                if cached is None:
+                    walk.append(modem)
+                else:
+                    modem.intParams, modem.floatParams = cached
+        else:
+            walk = modems
+
+        walkers = [ParamWalker(self, modem, self.paramWindow) for modem in walk]
+        with self.progress:
+            while any(w.active for w in walkers):
+                for walker in walkers:
+                    walker.step()
+                self.progress.wait(0.1)
+
+        # Requests sent past the end of each chain are answered with an invalid
+        # index Info along with the last element, so normally none are left
+        stale = OrderedDict()
+        for walker in walkers:
+            for idx, pending in walker.inflight.items():
+                stale[(walker.modem.name, idx)] = pending
+        deadline = time.time() + 0.5
+        for (name, idx), pending in stale.items():
+            if pending.result(max(0, deadline - time.time())) is None:
+                self.modems[name].correlator.cancel(pending)
+
+        for walker in walkers:
+            modem = walker.modem
+            if not walker.complete:
+                tracer.warning("Parameter enumeration of {} incomplete; schema not cached", modem.name)
+            elif self.schemaCache is not None and modem.version is not None:
+                self.schemaCache.store(modem.ip, modem.cmdport, modem.version,
+                                       modem.intParams, modem.floatParams)
+
+    def group(self, names):
+        """
+        :param      names:  The modem names in the group
+        :type       names:  list of strings
+        :returns    group:  A view of the fleet whose commands address only names
+        :type       group:  FleetGroup
+        """
+        return FleetGroup(self, names)
+
+
+class FleetGroup(object):
+    """
+    A subset of a fleet.  Its commands are the fleet commands restricted to
+    the modems of the group.
+    """
+    def __init__(self, fleet, names):
+        self.fleet = fleet
+        self.names = list(names)
+
+    def send(self, message):
+        self.fleet.send(message, self.names)
+
+    def request(self, message, key=None, infoMatch=False, timeout=3):
+        return self.fleet.request(message, key, infoMatch, self.names, timeout)
+
+    def startRx(self):
+        self.fleet.startRx(self.names)
+
+    def setValueI(self, Element, value, timeout=3):
+        return self.fleet.setValueI(Element, value, self.names, timeout)
+
+    def setValueF(self, Element, value, timeout=3):
+        return self.fleet.setValueF(Element, value, self.names, timeout)
+
+    def getValueI(self, Element, timeout=3):
+        return self.fleet.getValueI(Element, self.names, timeout)
+
+    def getValueF(self, Element, timeout=3):
+        return self.fleet.getValueF(Element, self.names, timeout)
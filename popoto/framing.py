@@ -0,0 +1,132 @@
+"""
+Buffered framing of the Popoto command socket.
+
+Popoto sends every reply and status message on the command socket as a
+single CR terminated line of the form
+
+    <msgType> { ...json... }
+
+The CommandReader pulls large chunks from the socket into one reusable
+buffer, finds the CR terminators in place and hands back the message type
+prefix and the JSON text of each complete line.
+"""
+from __future__ import print_function
+
+CMD_TERMINATOR = b'\r'
+CMD_JSON_START = b'{'
+
+
+class CommandReader(object):
+    """
+    CommandReader reads CR terminated frames from the Popoto command socket.
+
+    Data is received with recv_into directly into a preallocated bytearray.
+    Complete frames are located with bytearray.find, so no intermediate
+    strings are built while a line is accumulating.  A partial frame left at
+    the end of the buffer is moved to the front before the next read, and the
+    buffer only grows if a single frame is larger than the whole buffer.
+    """
+    def __init__(self, sock=None, bufSize=65536):
+        """
+        :param      sock:     The connected command socket, None when data is fed
+        :type       sock:     socket
+        :param      bufSize:  The initial receive buffer size in bytes
+        :type       bufSize:  integer
+        """
+        self.sock = sock
+        self.buf = bytearray(bufSize)
+        self.start = 0
+        self.end = 0
+
+    def makeRoom(self, needed=1):
+        """
+        Ensures at least needed free bytes follow the buffered data.
+        """
+        if self.start == self.end:
+            self.start = self.end = 0
+        if len(self.buf) - self.end >= needed:
+            return
+        pending = self.end - self.start
+        if self.start > 0:
+            # Slide the partial frame to the front of the buffer
+            self.buf[0:pending] = self.buf[self.start:self.end]
+            self.start = 0
+            self.end = pending
+        if len(self.buf) - self.end < needed:
+            # A single frame fills the buffer; make room for the rest of it
+            self.buf.extend(bytearray(max(needed, len(self.buf))))
+
+    def fill(self):
+        """
+        Reads whatever is available on the socket into the buffer.
+
+        :returns    count:  The number of bytes read, 0 if the peer closed the socket
+        :type       count:  integer
+        """
+        self.makeRoom()
+        count = self.sock.recv_into(memoryview(self.buf)[self.end:])
+        self.end += count
+        return count
+
+    def feed(self, data):
+        """
+        Appends data read elsewhere, e.g. by an asyncio stream, to the buffer.
+
+        :param      data:  The received bytes
+        :type       data:  bytes
+        """
+        self.makeRoom(len(data))
+        self.buf[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def frames(self):
+        """
+        Generator over the complete frames currently held in the buffer.
+        Each frame is consumed as it is yielded; a trailing partial frame stays
+        in the buffer until the next fill.
+
+        :returns    frame:  (msgType, jsonText) for each CR terminated line
+        :type       frame:  tuple of strings
+        """
+        buf = self.buf
+        while True:
+            eol = buf.find(CMD_TERMINATOR, self.start, self.end)
+            if eol < 0:
+                return
+            sol = self.start
+            self.start = eol + 1
+
+            brace = buf.find(CMD_JSON_START, sol, eol)
+            if brace < 0:
+                msgType = bytes(buf[sol:eol]).strip().decode('utf-8', 'replace')
+                jsonText = ''
+            else:
+                msgType = bytes(buf[sol:brace]).strip().decode('utf-8', 'replace')
+                jsonText = bytes(buf[brace:eol]).decode('utf-8', 'replace')
+            if msgType or jsonText:
+                yield msgType, jsonText
+
+
+def formatCommand(message):
+    """
+    Builds the JSON command line for a Popoto command with optional arguments
+
+    :param      message:  The message contains a Popoto command with optional arguments
+    :type       message:  string
+    :returns    line:     The newline terminated JSON command
+    :type       line:     bytes
+    """
+    args =message.split(' ',1)
+
+    # Break up the command and optional arguements around the space
+    if len(args) > 1:
+        command = args[0]
+        arguments = args[1]
+    else:
+        command = message
+        arguments = "Unused Arguments"
+
+    # Build the JSON message
+    message = "{ \"Command\": \"" + command + "\", \"Arguments\": \""+arguments + "\"}"
+
+    return (message + '\n').encode('utf-8')
@@ -0,0 +1,292 @@
+"""
+Client side metrics for the Popoto API.
+
+ClientMetrics keeps
+    per command round trip latency histograms, fed as replies are matched
+    byte and frame counts for the pcmlog, data and pcmio sockets
+    queue depth and drop counters (the replyQ)
+    error counters by kind
+
+Recording is cheap enough to leave on: a latency observation is a bisect
+into fixed buckets, and socket throughput is not counted in the transfer
+loops at all.  The transfer objects (recorders, players, uploaders) already
+count what they move; they are attached as sources and read only when a
+snapshot is taken.
+
+snapshot() returns the metrics as a dictionary, with socket rates over the
+interval since the previous snapshot the caller passes back in, and
+prometheusText() renders them in the Prometheus text exposition format,
+which writePrometheus() or a background exporter can write to a file for the
+node_exporter textfile collector.
+"""
+from __future__ import print_function
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from .trace import tracer
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class LatencyHistogram(object):
+    """
+    A fixed bucket histogram.  counts[i] holds the observations no larger
+    than bounds[i]; the last count is the overflow bucket.
+    """
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """
+        :returns    value:  The upper bound of the bucket holding quantile q, None if empty
+        :type       value:  number
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def snapshot(self):
+        return {'count': self.count, 'sum': self.sum, 'max': self.max,
+                'p50': self.quantile(0.5), 'p99': self.quantile(0.99),
+                'buckets': list(zip(self.bounds + (float('inf'),), self.counts))}
+
+
+class ThroughputCounter(object):
+    """
+    Byte and frame totals of one socket.  Sources are callables returning the
+    cumulative (bytes, frames) of a transfer in progress; their final values
+    are folded into the totals when they are detached.
+
+    The counter keeps no rate baseline of its own, so any number of consumers
+    can take snapshots: each passes its previous snapshot to get the rates
+    over its own interval.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.frames = 0
+        self.sources = []
+        self.startTime = time.time()
+
+    def add(self, nbytes, frames=0):
+        with self.lock:
+            self.bytes += nbytes
+            self.frames += frames
+
+    def attach(self, source):
+        """
+        :param      source:  Returns the (bytes, frames) moved so far by a transfer
+        :type       source:  function
+        """
+        with self.lock:
+            self.sources.append(source)
+        return source
+
+    def detach(self, source):
+        with self.lock:
+            if source in self.sources:
+                self.sources.remove(source)
+                nbytes, frames = source()
+                self.bytes += nbytes
+                self.frames += frames
+
+    def totals(self):
+        with self.lock:
+            nbytes, frames = self.bytes, self.frames
+            for source in self.sources:
+                b, f = source()
+                nbytes += b
+                frames += f
+        return nbytes, frames
+
+    def snapshot(self, since=None):
+        """
+        :param      since:  A previous snapshot of this counter, None to average over
+                            the life of the counter
+        :type       since:  dictionary
+        :returns    stats:  Time, totals, and the rates since the given snapshot
+        :type       stats:  dictionary
+        """
+        nbytes, frames = self.totals()
+        now = time.time()
+        if since is None:
+            since = {'time': self.startTime, 'bytes': 0, 'frames': 0}
+        elapsed = now - since['time']
+        stats = {'time': now, 'bytes': nbytes, 'frames': frames,
+                 'bytesPerSec': 0.0, 'framesPerSec': 0.0}
+        if elapsed > 0:
+            stats['bytesPerSec'] = (nbytes - since['bytes']) / elapsed
+            stats['framesPerSec'] = (frames - since['frames']) / elapsed
+        return stats
+
+
+class ClientMetrics(object):
+    """
+    The metrics of one popoto instance.
+    """
+    def __init__(self, labels=None):
+        """
+        :param      labels:  Labels added to every exported series, e.g. the modem address
+        :type       labels:  dictionary
+        """
+        self.labels = labels or {}
+        self.lock = threading.Lock()
+        self.latency = {}
+        self.sockets = {'pcmlog': ThroughputCounter(), 'data': ThroughputCounter(),
+                        'pcmio': ThroughputCounter()}
+        self.queues = {}
+        self.errors = {}
+        self.exportThread = None
+        self.exporting = False
+
+    def observeReply(self, pending):
+        """
+        Records the round trip of a matched request, keyed by command name.
+        """
+        command = pending.command.split(' ', 1)[0]
+        histogram = self.latency.get(command)
+        if histogram is None:
+            with self.lock:
+                histogram = self.latency.setdefault(command, LatencyHistogram())
+        histogram.observe(pending.replyTime - pending.sentTime)
+
+    def countError(self, kind, n=1):
+        self.errors[kind] = self.errors.get(kind, 0) + n
+
+    def watchQueue(self, name, queue):
+        """
+        Reports the stats() of a BoundedQueue, e.g. the replyQ, in snapshots.
+        """
+        self.queues[name] = queue
+
+    def snapshot(self, since=None):
+        """
+        :param      since:    The caller's previous snapshot, the baseline of the socket
+                              rates; None for the averages since the metrics began
+        :type       since:    dictionary
+        :returns    metrics:  latency, sockets, queues and errors
+        :type       metrics:  dictionary
+        """
+        with self.lock:
+            latency = dict(self.latency)
+        previous = {} if since is None else since['sockets']
+        return {'time': time.time(),
+                'latency': dict((name, h.snapshot()) for name, h in latency.items()),
+                'sockets': dict((name, c.snapshot(previous.get(name)))
+                                for name, c in self.sockets.items()),
+                'queues': dict((name, q.stats()) for name, q in self.queues.items()),
+                'errors': dict(self.errors)}
+
+    def prometheusText(self, snapshot=None):
+        """
+        :returns    text:  The metrics in the Prometheus text exposition format
+        :type       text:  string
+        """
+        if snapshot is None:
+            snapshot = self.snapshot()
+        lines = []
+
+        def series(name, value, **labels):
+            labels.update(self.labels)
+            if labels:
+                name += '{' + ','.join('{}="{}"'.format(k, v) for k, v in sorted(labels.items())) + '}'
+            lines.append('{} {}'.format(name, value))
+
+        lines.append('# TYPE popoto_command_latency_seconds histogram')
+        for command, h in sorted(snapshot['latency'].items()):
+            cumulative = 0
+            for bound, n in h['buckets']:
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                series('popoto_command_latency_seconds_bucket', cumulative, command=command, le=le)
+            series('popoto_command_latency_seconds_sum', h['sum'], command=command)
+            series('popoto_command_latency_seconds_count', h['count'], command=command)
+        lines.append('# TYPE popoto_socket_bytes_total counter')
+        for name, s in sorted(snapshot['sockets'].items()):
+            series('popoto_socket_bytes_total', s['bytes'], socket=name)
+        lines.append('# TYPE popoto_socket_frames_total counter')
+        for name, s in sorted(snapshot['sockets'].items()):
+            series('popoto_socket_frames_total', s['frames'], socket=name)
+        lines.append('# TYPE popoto_socket_bytes_per_second gauge')
+        for name, s in sorted(snapshot['sockets'].items()):
+            series('popoto_socket_bytes_per_second', s['bytesPerSec'], socket=name)
+        lines.append('# TYPE popoto_queue_depth gauge')
+        for name, q in sorted(snapshot['queues'].items()):
+            series('popoto_queue_depth', q['depth'], queue=name)
+        lines.append('# TYPE popoto_queue_peak_depth gauge')
+        for name, q in sorted(snapshot['queues'].items()):
+            series('popoto_queue_peak_depth', q['peakDepth'], queue=name)
+        lines.append('# TYPE popoto_queue_bytes gauge')
+        for name, q in sorted(snapshot['queues'].items()):
+            if q.get('bytes') is not None:
+                series('popoto_queue_bytes', q['bytes'], queue=name)
+        lines.append('# TYPE popoto_queue_dropped_total counter')
+        for name, q in sorted(snapshot['queues'].items()):
+            series('popoto_queue_dropped_total', q['dropped'], queue=name)
+        lines.append('# TYPE popoto_errors_total counter')
+        for kind, n in sorted(snapshot['errors'].items()):
+            series('popoto_errors_total', n, kind=kind)
+        return '\n'.join(lines) + '\n'
+
+    def writePrometheus(self, path, snapshot=None):
+        """
+        Writes prometheusText() to path, replacing it atomically so a collector
+        never reads a partial file.
+        """
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as fp:
+            fp.write(self.prometheusText(snapshot))
+        os.rename(tmp, path)
+
+    def startExport(self, path, interval=15):
+        """
+        Writes the Prometheus text to path every interval seconds on a
+        background thread.
+        """
+        self.stopExport()
+        self.exporting = True
+        self.exportThread = threading.Thread(target=self.exportLoop, args=(path, interval),
+                                             name="MetricsExport")
+        self.exportThread.daemon = True
+        self.exportThread.start()
+
+    def exportLoop(self, path, interval):
+        nextWrite = time.time()
+        previous = None
+        while self.exporting:
+            if time.time() >= nextWrite:
+                # The exported rates are over the export interval
+                previous = self.snapshot(previous)
+                try:
+                    self.writePrometheus(path, previous)
+                except (IOError, OSError) as err:
+                    tracer.warning('Unable to write metrics {}: {}', path, err)
+                nextWrite += interval
+            time.sleep(min(0.5, interval))
+
+    def stopExport(self):
+        self.exporting = False
+        if self.exportThread is not None:
+            self.exportThread.join()
+            self.exportThread = None
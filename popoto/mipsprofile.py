@@ -0,0 +1,247 @@
+"""
+Continuous profiling of the DSP load on the modem.
+
+APP_CycleCount reports, per DSP module, the min, max and total cycle counts
+over count invocations.  MipsProfiler polls it in the background, converts
+the counts to MIPS at the CPU_MHZ clock and keeps a fixed length time series
+per module in array based ring buffers, so a profiler can run for days in
+constant memory.  Alongside each sample it records the client's own traffic
+(socket bytes/sec and commands/sec) so DSP load can be lined up with what
+the host was sending.
+
+Modules whose peak load reaches warnFraction of the budget are flagged.
+"""
+from __future__ import print_function
+import threading
+import time
+from array import array
+
+from .trace import tracer
+
+# The DSP clock in MHz; a module at CPU_MHZ MIPS uses the whole processor
+CPU_MHZ = 160
+
+
+def moduleMips(v):
+    """
+    :param      v:     The APP_CycleCount entry of one module
+    :type       v:     dictionary with min, max, total and count
+    :returns    mips:  (min, average, peak) MIPS
+    :type       mips:  tuple
+    """
+    scale = CPU_MHZ / 1e6
+    average = v['total'] / float(v['count']) if v['count'] else 0.0
+    return v['min'] * scale, average * scale, v['max'] * scale
+
+
+class MipsRing(object):
+    """
+    A ring buffer of (min, average, peak) MIPS samples, stored as float32.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.minMips = array('f', [0.0]) * size
+        self.avgMips = array('f', [0.0]) * size
+        self.peakMips = array('f', [0.0]) * size
+
+    def put(self, slot, mips):
+        self.minMips[slot], self.avgMips[slot], self.peakMips[slot] = mips
+
+
+class MipsProfiler(object):
+    """
+    MipsProfiler samples APP_CycleCount every interval seconds on a
+    background thread.
+    """
+    def __init__(self, modem, interval=1.0, history=3600, warnFraction=0.8, callback=None):
+        """
+        :param      modem:         The connected popoto instance
+        :type       modem:         popoto
+        :param      interval:      The seconds between samples
+        :type       interval:      number
+        :param      history:       The number of samples kept per module
+        :type       history:       integer
+        :param      warnFraction:  The fraction of CPU_MHZ at which a module is flagged
+        :type       warnFraction:  number
+        :param      callback:      Called as callback(timestamp, module, peakMips) when a
+                                   module is flagged
+        :type       callback:      function
+        """
+        self.modem = modem
+        self.interval = interval
+        self.history = history
+        self.warnMips = warnFraction * CPU_MHZ
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.times = array('d', [0.0]) * history
+        self.totalMips = array('f', [0.0]) * history
+        self.trafficBytes = array('f', [0.0]) * history
+        self.trafficCommands = array('f', [0.0]) * history
+        self.modules = {}
+        self.samples = 0
+        self.misses = 0
+        self.alerts = []
+        self.lastTraffic = None
+        self.is_running = False
+        self.thread = None
+
+    def start(self):
+        self.is_running = True
+        self.thread = threading.Thread(target=self.run, name="MipsProfiler")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.is_running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        nextPoll = time.time()
+        while self.is_running:
+            self.poll()
+            nextPoll += self.interval
+            delay = nextPoll - time.time()
+            if delay < 0:
+                # Polling fell behind; skip the missed samples rather than burst
+                nextPoll = time.time()
+                continue
+            time.sleep(delay)
+
+    def traffic(self, now):
+        """
+        :returns    rates:  The client's socket bytes/sec and commands/sec since the
+                            previous sample
+        :type       rates:  tuple
+        """
+        metrics = getattr(self.modem, 'metrics', None)
+        if metrics is None:
+            return 0.0, 0.0
+        nbytes = sum(c.totals()[0] for c in metrics.sockets.values())
+        commands = sum(h.count for h in list(metrics.latency.values()))
+        last, self.lastTraffic = self.lastTraffic, (now, nbytes, commands)
+        if last is None or now <= last[0]:
+            return 0.0, 0.0
+        elapsed = now - last[0]
+        return (nbytes - last[1]) / elapsed, (commands - last[2]) / elapsed
+
+    def poll(self):
+        """
+        Takes one sample.
+
+        :returns    counts:  The APP_CycleCount reply, None on timeout
+        :type       counts:  dictionary
+        """
+        counts = self.modem.getCycleCount(display=False)
+        now = time.time()
+        if counts is None:
+            self.misses += 1
+            return None
+        nbytes, commands = self.traffic(now)
+        flagged = []
+        with self.lock:
+            slot = self.samples % self.history
+            self.times[slot] = now
+            self.trafficBytes[slot] = nbytes
+            self.trafficCommands[slot] = commands
+            total = 0.0
+            for module, v in counts.items():
+                ring = self.modules.get(module)
+                if ring is None:
+                    ring = self.modules[module] = MipsRing(self.history)
+                mips = moduleMips(v)
+                ring.put(slot, mips)
+                total += mips[1]
+                if mips[2] >= self.warnMips:
+                    flagged.append(self.flag(now, module, mips[2]))
+            for module, ring in self.modules.items():
+                if module not in counts:
+                    ring.put(slot, (0.0, 0.0, 0.0))
+            self.totalMips[slot] = total
+            self.samples += 1
+        # Outside the lock, so the callback may call summary() or series()
+        for alert in flagged:
+            self.notify(*alert)
+        return counts
+
+    def flag(self, now, module, peakMips):
+        # Called with the lock held
+        alert = (now, module, peakMips)
+        self.alerts.append(alert)
+        if len(self.alerts) > self.history:
+            del self.alerts[0]
+        return alert
+
+    def notify(self, now, module, peakMips):
+        tracer.warning("{} peak {:.1f} MIPS of the {} MHz budget", module, peakMips, CPU_MHZ)
+        if self.callback is not None:
+            self.callback(now, module, peakMips)
+
+    def order(self):
+        # Ring slots from oldest to newest
+        count = min(self.samples, self.history)
+        first = self.samples - count
+        return [(first + i) % self.history for i in range(count)]
+
+    def series(self, module=None):
+        """
+        :param      module:  A module name, or None for the load summed over modules
+                             and the client traffic
+        :type       module:  string
+        :returns    series:  Lists oldest first: time with minMips, avgMips and peakMips
+                             for a module, or totalMips, trafficBytesPerSec and
+                             trafficCommandsPerSec
+        :type       series:  dictionary
+        """
+        with self.lock:
+            slots = self.order()
+            result = {'time': [self.times[i] for i in slots]}
+            if module is None:
+                result['totalMips'] = [self.totalMips[i] for i in slots]
+                result['trafficBytesPerSec'] = [self.trafficBytes[i] for i in slots]
+                result['trafficCommandsPerSec'] = [self.trafficCommands[i] for i in slots]
+            else:
+                ring = self.modules[module]
+                result['minMips'] = [ring.minMips[i] for i in slots]
+                result['avgMips'] = [ring.avgMips[i] for i in slots]
+                result['peakMips'] = [ring.peakMips[i] for i in slots]
+        return result
+
+    def summary(self):
+        """
+        :returns    summary:  Per module min, mean of the averages and max MIPS over
+                              the history, and the fraction of CPU_MHZ at the peak
+        :type       summary:  dictionary
+        """
+        with self.lock:
+            slots = self.order()
+            summary = {}
+            for module, ring in self.modules.items():
+                if not slots:
+                    continue
+                peak = max(ring.peakMips[i] for i in slots)
+                summary[module] = {'min': min(ring.minMips[i] for i in slots),
+                                   'avg': sum(ring.avgMips[i] for i in slots) / len(slots),
+                                   'max': peak,
+                                   'budget': peak / CPU_MHZ}
+        return summary
+
+    def export(self, filename):
+        """
+        Writes the history as CSV, one row per sample and module, with the client
+        traffic of the sample on every row.
+        """
+        with self.lock:
+            slots = self.order()
+            modules = sorted(self.modules.items())
+            with open(filename, 'w') as fp:
+                fp.write('time,module,minMips,avgMips,peakMips,totalMips,'
+                         'trafficBytesPerSec,trafficCommandsPerSec\n')
+                for i in slots:
+                    for module, ring in modules:
+                        fp.write('{:.3f},{},{:.3f},{:.3f},{:.3f},{:.3f},{:.1f},{:.2f}\n'.format(
+                            self.times[i], module, ring.minMips[i], ring.avgMips[i],
+                            ring.peakMips[i], self.totalMips[i], self.trafficBytes[i],
+                            self.trafficCommands[i]))
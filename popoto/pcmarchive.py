@@ -0,0 +1,240 @@
+"""
+Indexed archive of pcmlog recordings.
+
+An archive is three files sharing a base name:
+
+    name.pcm    the frames, whole pcmlog frames back to back, as recPcmLoop writes
+    name.idx    one fixed size record per chunk of chunkFrames frames: the
+                (unwrapped) counter and gain flag of its first frame, the wall
+                clock time the first frame arrived, its byte offset and its
+                frame count
+    name.json   metadata: sample rate, passband/baseband, modem address, the
+                parameter snapshot taken at the start, and the layout
+
+Because the frame data is left contiguous the reader can memory map it and
+return any range of frames as a NumPy view, while the small index finds the
+range for a time or a frame counter with a binary search instead of a scan.
+"""
+from __future__ import print_function
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+from .pcmformat import (PCMLOG_OFFSET, PCM_FRAME_BYTES, PCM_FRAME_SAMPLES,
+                        PCM_COUNTER_WORD, PCM_GAIN_WORD, floatsPerSecond)
+from .pcmparse import PcmFrames, frameWords
+
+ARCHIVE_VERSION = 1
+
+# One index record per chunk
+INDEX_DTYPE = np.dtype([('counter', '<u8'), ('gain', '<u4'), ('frames', '<u4'),
+                        ('time', '<f8'), ('offset', '<u8')])
+INDEX_RECORD = struct.Struct('<QIIdQ')
+HEADER = struct.Struct('<II')
+
+
+def archiveFiles(path):
+    """
+    :returns    files:  The (frames, index, metadata) filenames of an archive
+    :type       files:  tuple
+    """
+    base = os.path.splitext(path)[0]
+    return base + '.pcm', base + '.idx', base + '.json'
+
+
+class PcmArchiveWriter(object):
+    """
+    PcmArchiveWriter appends pcmlog data to an archive.  It is a sink for
+    PcmCapture, which hands it each buffer with the time it was filled.
+    """
+    def __init__(self, path, bb, chunkFrames=16, metadata=None):
+        """
+        :param      path:         The archive name; the extension is replaced
+        :type       path:         string
+        :param      bb:           passband or baseband selection
+        :type       bb:           number 0/1 passband/baseband
+        :param      chunkFrames:  The frames per index record
+        :type       chunkFrames:  integer
+        :param      metadata:     Extra metadata, e.g. the modem address and parameters
+        :type       metadata:     dictionary
+        """
+        self.dataFile, self.indexFile, self.metaFile = archiveFiles(path)
+        self.bb = bb
+        self.chunkFrames = chunkFrames
+        self.framePeriod = PCM_FRAME_SAMPLES / float(floatsPerSecond(bb))
+        self.metadata = dict(metadata or {})
+        self.metadata.update({'version': ARCHIVE_VERSION, 'bb': bb,
+                              'sampleRate': floatsPerSecond(bb) // (2 if bb else 1),
+                              'frameBytes': PCM_FRAME_BYTES, 'headerWords': PCMLOG_OFFSET,
+                              'chunkFrames': chunkFrames, 'startTime': time.time()})
+        self.data = open(self.dataFile, 'wb')
+        self.index = open(self.indexFile, 'wb')
+        self.frames = 0
+        self.chunkFill = 0
+        self.chunkStart = 0
+        self.lastCounter = None
+        self.wraps = 0
+        self.writeMetadata()
+
+    def write(self, data, endTime=None):
+        """
+        Appends whole frames.
+
+        :param      data:     The frames
+        :type       data:     bytes-like, a multiple of PCM_FRAME_BYTES long
+        :param      endTime:  The time the last frame arrived, now if None
+        :type       endTime:  number
+        """
+        if endTime is None:
+            endTime = time.time()
+        count = len(data) // PCM_FRAME_BYTES
+        frame = 0
+        while frame < count:
+            if self.chunkFill == 0:
+                counter, gain = HEADER.unpack_from(data, frame * PCM_FRAME_BYTES)
+                if self.lastCounter is not None and counter < self.lastCounter:
+                    self.wraps += 1
+                self.lastCounter = counter
+                take = min(self.chunkFrames, count - frame)
+                self.index.write(INDEX_RECORD.pack(
+                    (self.wraps << 32) + counter, gain, take,
+                    endTime - (count - frame - 1) * self.framePeriod,
+                    self.frames * PCM_FRAME_BYTES))
+                self.chunkStart = self.index.tell() - INDEX_RECORD.size
+            else:
+                take = min(self.chunkFrames - self.chunkFill, count - frame)
+                # Grow the frame count of the open chunk record
+                self.index.seek(self.chunkStart + 12)
+                self.index.write(struct.pack('<I', self.chunkFill + take))
+                self.index.seek(0, os.SEEK_END)
+            lastCounter = HEADER.unpack_from(data, (frame + take - 1) * PCM_FRAME_BYTES)[0]
+            if lastCounter < self.lastCounter:
+                self.wraps += 1
+            self.lastCounter = lastCounter
+            frame += take
+            self.frames += take
+            self.chunkFill = (self.chunkFill + take) % self.chunkFrames
+        self.data.write(memoryview(data)[:count * PCM_FRAME_BYTES])
+
+    def writeMetadata(self):
+        self.metadata['frames'] = self.frames
+        tmp = self.metaFile + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump(self.metadata, fp, indent=1, sort_keys=True)
+        os.rename(tmp, self.metaFile)
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+        self.metadata['endTime'] = time.time()
+        self.writeMetadata()
+
+
+class PcmArchive(object):
+    """
+    PcmArchive reads an archive through a memory mapping.  Ranges are
+    returned as PcmFrames whose samples are (frames, samples per frame) views
+    of the mapping, so nothing is copied until the arrays are used.
+    """
+    def __init__(self, path):
+        """
+        :param      path:  The archive name, with or without an extension
+        :type       path:  string
+        """
+        dataFile, indexFile, metaFile = archiveFiles(path)
+        with open(metaFile) as fp:
+            self.metadata = json.load(fp)
+        self.bb = self.metadata['bb']
+        self.index = np.fromfile(indexFile, dtype=INDEX_DTYPE)
+        size = os.path.getsize(dataFile)
+        self.data = np.memmap(dataFile, dtype=np.uint8, mode='r') if size else np.zeros(0, np.uint8)
+        self.words = frameWords(self.data)
+        self.frames = len(self.words)
+        self.framePeriod = PCM_FRAME_SAMPLES / float(floatsPerSecond(self.bb))
+        # The first frame number of each chunk
+        self.chunkFrame = (self.index['offset'] // PCM_FRAME_BYTES).astype(np.int64)
+
+    def duration(self):
+        return self.frames * self.framePeriod
+
+    def frameTimes(self, first=0, last=None):
+        """
+        :returns    times:  The arrival time of each frame, interpolated within chunks
+        :type       times:  numpy.ndarray
+        """
+        last = self.frames if last is None else last
+        frames = np.arange(first, last)
+        chunk = np.searchsorted(self.chunkFrame, frames, side='right') - 1
+        return self.index['time'][chunk] + (frames - self.chunkFrame[chunk]) * self.framePeriod
+
+    def frameAtTime(self, t):
+        """
+        :returns    frame:  The number of the first frame that arrived at or after t
+        :type       frame:  integer
+        """
+        chunk = max(0, int(np.searchsorted(self.index['time'], t, side='right')) - 1)
+        if chunk >= len(self.index):
+            return self.frames
+        offset = int(np.ceil((t - self.index['time'][chunk]) / self.framePeriod - 1e-9))
+        offset = max(0, min(offset, int(self.index['frames'][chunk])))
+        return min(self.frames, int(self.chunkFrame[chunk]) + offset)
+
+    def frameAtCounter(self, counter):
+        """
+        :returns    frame:  The number of the first frame whose unwrapped counter is at
+                            least counter
+        :type       frame:  integer
+        """
+        chunk = max(0, int(np.searchsorted(self.index['counter'], counter, side='right')) - 1)
+        if chunk >= len(self.index):
+            return self.frames
+        first = int(self.chunkFrame[chunk])
+        last = first + int(self.index['frames'][chunk])
+        base = int(self.index['counter'][chunk]) & ~0xffffffff
+        counters = self.words[first:last, PCM_COUNTER_WORD].astype(np.int64)
+        if not len(counters):
+            return min(first, self.frames)
+        # Frames after a wrap inside the chunk count from the next multiple of 2**32
+        counters += base + ((counters < counters[0]).astype(np.int64) << 32)
+        return first + int(np.searchsorted(counters, counter))
+
+    def frameRange(self, first, last):
+        """
+        :returns    frames:  The samples, counters and gains of frames first to last-1,
+                             as views of the mapping
+        :type       frames:  PcmFrames
+        """
+        words = self.words[first:last]
+        samples = words[:, PCMLOG_OFFSET:].view('<f4')
+        if self.bb:
+            samples = samples.view('<c8')
+        return PcmFrames(samples, words[:, PCM_COUNTER_WORD], words[:, PCM_GAIN_WORD])
+
+    def timeRange(self, start, end):
+        """
+        :param      start:   The wall clock start time in seconds since the epoch
+        :type       start:   number
+        :param      end:     The wall clock end time
+        :type       end:     number
+        :returns    frames:  The frames that arrived from start up to end, as views
+        :type       frames:  PcmFrames
+        """
+        return self.frameRange(self.frameAtTime(start), self.frameAtTime(end))
+
+    def offsetRange(self, start, end):
+        """
+        :returns    frames:  The frames from start to end seconds into the recording
+        :type       frames:  PcmFrames
+        """
+        first = int(start / self.framePeriod)
+        return self.frameRange(first, max(first, int(np.ceil(end / self.framePeriod))))
+
+    def counterRange(self, first, last):
+        """
+        :returns    frames:  The frames with unwrapped counters from first up to last
+        :type       frames:  PcmFrames
+        """
+        return self.frameRange(self.frameAtCounter(first), self.frameAtCounter(last))
@@ -0,0 +1,256 @@
+"""
+Long running capture of the pcmlog stream with a background writer.
+
+PcmCapture separates the socket from the disk.  The receive thread reads
+with recv_into into buffers taken from a preallocated pool and hands each
+full buffer to a writer thread, which writes it out and returns it to the
+pool.  A storage stall therefore only uses up pool buffers; the socket keeps
+being read for as long as a free buffer remains.
+
+Like StartRecording on the modem, the capture can be split into files of a
+fixed duration, named automatically from the output filename, the start
+time of the file and a sequence number.  Files always hold whole frames.
+Instead of files the buffers can go to a sink such as a PcmArchiveWriter.
+"""
+from __future__ import print_function
+import os
+import socket
+import threading
+import time
+
+from .pcmformat import PCM_FRAME_BYTES, PCM_FRAME_SAMPLES, floatsPerSecond, framesForDuration
+from .trace import tracer
+
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+
+class PcmCapture(object):
+    """
+    PcmCapture records whole pcmlog frames through a pool of buffers and a
+    writer thread.  Writer lag, the signal time waiting in the pool to be
+    written, is tracked along with the longest write.
+    """
+    def __init__(self, sock, outFile, duration=None, bb=0, rotateSeconds=None,
+                 buffers=32, bufferFrames=64, onDone=None, sink=None):
+        """
+        :param      sock:           The connected pcmlog socket
+        :type       sock:           socket
+        :param      outFile:        The output filename; with rotation, the pattern
+                                    base_YYYYmmdd-HHMMSS_NNNN.ext is used
+        :type       outFile:        string
+        :param      duration:       The seconds to record, None until stop()
+        :type       duration:       number
+        :param      bb:             passband or baseband selection
+        :type       bb:             number 0/1 passband/baseband
+        :param      rotateSeconds:  Start a new file after this many seconds of signal
+        :type       rotateSeconds:  number
+        :param      buffers:        The number of buffers in the pool
+        :type       buffers:        integer
+        :param      bufferFrames:   The frames per buffer
+        :type       bufferFrames:   integer
+        :param      onDone:         Called with no arguments when the capture ends
+        :type       onDone:         function
+        :param      sink:           Receives sink.write(data, endTime) for each buffer
+                                    instead of outFile, and sink.close() at the end
+        :type       sink:           PcmArchiveWriter
+        """
+        self.sock = sock
+        self.outFile = outFile
+        self.bb = bb
+        self.bytesPerSec = floatsPerSecond(bb) * PCM_FRAME_BYTES / float(PCM_FRAME_SAMPLES)
+        self.bytesRequested = None
+        if duration is not None:
+            self.bytesRequested = framesForDuration(duration, bb) * PCM_FRAME_BYTES
+        self.rotateBytes = None
+        if rotateSeconds:
+            self.rotateBytes = max(1, framesForDuration(rotateSeconds, bb)) * PCM_FRAME_BYTES
+        self.bufSize = bufferFrames * PCM_FRAME_BYTES
+        self.pool = [bytearray(self.bufSize) for i in range(buffers)]
+        self.free = Queue.Queue()
+        for buf in self.pool:
+            self.free.put(buf)
+        self.filled = Queue.Queue()
+        self.onDone = onDone
+        self.sink = sink
+
+        self.files = []
+        self.fp = None
+        self.fileBytes = 0
+        self.bytesReceived = 0
+        self.bytesWritten = 0
+        self.frames = 0
+        self.elapsed = 0
+        self.poolStalls = 0
+        self.stallTime = 0.0
+        self.maxLag = 0.0
+        self.maxWrite = 0.0
+        self.writeError = None
+        self.is_running = True
+        self.thread = None
+        self.writer = None
+
+    def start(self):
+        """
+        Runs the capture on a background thread.
+        """
+        self.thread = threading.Thread(target=self.run, name="PcmCapture")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Ends the capture and waits until everything received has been written.
+        """
+        self.is_running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """
+        Records until the duration has been captured, the peer closes the
+        socket or stop() is called.
+
+        :returns    frames:  The number of whole frames written
+        :type       frames:  integer
+        """
+        self.writer = threading.Thread(target=self.writeLoop, name="PcmCaptureWriter")
+        self.writer.start()
+        recv_into = self.sock.recv_into
+        start = time.time()
+        try:
+            buf = None
+            while self.is_running and self.writeError is None:
+                if buf is None:
+                    buf = self.takeBuffer()
+                    if buf is None:
+                        continue
+                    view = memoryview(buf)
+                    fill = 0
+                    size = self.bufSize
+                    if self.bytesRequested is not None:
+                        size = min(size, self.bytesRequested - self.bytesReceived)
+                try:
+                    count = recv_into(view[fill:size])
+                except socket.timeout:
+                    continue
+                if count == 0:
+                    break
+                fill += count
+                self.bytesReceived += count
+                if fill == size:
+                    view.release()
+                    self.filled.put((buf, fill, time.time()))
+                    buf = None
+                    if self.bytesReceived == self.bytesRequested:
+                        break
+            if buf is not None:
+                view.release()
+                # Only whole frames are written
+                fill -= fill % PCM_FRAME_BYTES
+                self.filled.put((buf, fill, time.time()))
+        finally:
+            self.elapsed = time.time() - start
+            self.filled.put(None)
+            self.writer.join()
+            self.is_running = False
+            if self.onDone is not None:
+                self.onDone()
+        return self.frames
+
+    def takeBuffer(self):
+        try:
+            return self.free.get(False)
+        except Queue.Empty:
+            pass
+        # The writer is behind by the whole pool
+        self.poolStalls += 1
+        stalled = time.time()
+        try:
+            return self.free.get(True, 0.5)
+        except Queue.Empty:
+            return None
+        finally:
+            self.stallTime += time.time() - stalled
+
+    def writeLoop(self):
+        try:
+            while True:
+                item = self.filled.get()
+                if item is None:
+                    break
+                buf, fill, handedOver = item
+                # Lag is the signal still waiting behind this buffer plus its age
+                lag = time.time() - handedOver + self.filled.qsize() * self.bufSize / self.bytesPerSec
+                self.maxLag = max(self.maxLag, lag)
+                began = time.time()
+                if self.sink is None:
+                    self.write(memoryview(buf)[:fill])
+                else:
+                    self.sink.write(memoryview(buf)[:fill], handedOver)
+                    self.bytesWritten += fill
+                    self.frames = self.bytesWritten // PCM_FRAME_BYTES
+                self.maxWrite = max(self.maxWrite, time.time() - began)
+                self.free.put(buf)
+        except (IOError, OSError) as err:
+            self.writeError = err
+            tracer.error("PCM capture write failed: {}", err)
+            # Keep draining so the receive thread is never left waiting
+            while self.filled.get() is not None:
+                pass
+        finally:
+            self.closeFile()
+            if self.sink is not None:
+                self.sink.close()
+
+    def write(self, data):
+        offset = 0
+        while offset < len(data):
+            if self.fp is None:
+                self.openFile()
+            count = len(data) - offset
+            if self.rotateBytes is not None:
+                count = min(count, self.rotateBytes - self.fileBytes)
+            self.fp.write(data[offset:offset + count])
+            offset += count
+            self.fileBytes += count
+            self.bytesWritten += count
+            self.frames = self.bytesWritten // PCM_FRAME_BYTES
+            if self.rotateBytes is not None and self.fileBytes >= self.rotateBytes:
+                self.closeFile()
+
+    def fileName(self):
+        if self.rotateBytes is None:
+            return self.outFile
+        base, ext = os.path.splitext(self.outFile)
+        return '{}_{}_{:04d}{}'.format(base, time.strftime('%Y%m%d-%H%M%S'),
+                                       len(self.files), ext or '.pcm')
+
+    def openFile(self):
+        name = self.fileName()
+        self.fp = open(name, 'wb')
+        self.fileBytes = 0
+        self.files.append(name)
+        tracer.debug("Recording to {}", name)
+
+    def closeFile(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+    def stats(self):
+        """
+        :returns    stats:  Bytes received and written, the writer lag now and at worst
+                            in seconds of signal, the longest write, pool stalls and files
+        :type       stats:  dictionary
+        """
+        pending = self.bytesReceived - self.bytesWritten
+        return {'bytesReceived': self.bytesReceived, 'bytesWritten': self.bytesWritten,
+                'lagSeconds': pending / self.bytesPerSec, 'maxLagSeconds': self.maxLag,
+                'maxWriteSeconds': self.maxWrite, 'poolStalls': self.poolStalls,
+                'stallSeconds': self.stallTime, 'buffersFree': self.free.qsize(),
+                'files': list(self.files)}
@@ -0,0 +1,45 @@
+"""
+Layout of the PCM frames carried on the Popoto pcmlog port.
+
+Every frame is PCM_FRAME_WORDS 32 bit words: PCMLOG_OFFSET header words
+followed by PCM_FRAME_SAMPLES IEEE float samples.  Passband frames hold real
+samples at 102400 samples/s; baseband frames hold interleaved I/Q pairs at
+10240 complex samples/s.
+"""
+PCMLOG_OFFSET = 2
+PCM_FRAME_WORDS = 642
+PCM_WORD_BYTES = 4
+PCM_FRAME_BYTES = PCM_FRAME_WORDS * PCM_WORD_BYTES
+PCM_FRAME_SAMPLES = PCM_FRAME_WORDS - PCMLOG_OFFSET
+
+# Header words: the frame counter (pcmCount) and the HiGain_LowGain flag 0=lo,1=hi
+PCM_COUNTER_WORD = 0
+PCM_GAIN_WORD = 1
+
+PASSBAND_RATE = 102400
+BASEBAND_RATE = 10240
+
+
+def floatsPerSecond(bb):
+    """
+    :param      bb:     passband or baseband selection
+    :type       bb:     number 0/1 passband/baseband
+    :returns    rate:   The number of float words per second of signal
+    :type       rate:   integer
+    """
+    if bb:
+        return BASEBAND_RATE * 2
+    return PASSBAND_RATE
+
+
+def framesForDuration(duration, bb):
+    """
+    :param      duration:  The duration in seconds
+    :type       duration:  number
+    :param      bb:        passband or baseband selection
+    :type       bb:        number 0/1 passband/baseband
+    :returns    frames:    The number of whole frames that cover duration
+    :type       frames:    integer
+    """
+    floats = int(round(duration * floatsPerSecond(bb)))
+    return (floats + PCM_FRAME_SAMPLES - 1) // PCM_FRAME_SAMPLES
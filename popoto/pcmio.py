@@ -0,0 +1,371 @@
+"""
+Full duplex real time PCM on the Popoto pcmio port.
+
+PcmDuplex streams transmit samples out and receive samples in at the same
+time, in pcmlog frames (PCMLOG_OFFSET header words and PCM_FRAME_SAMPLES
+float samples) in both directions.  The application and the socket meet in
+two single producer, single consumer SampleRings:
+
+    write() -> txRing -> transmit thread -> socket
+    socket -> receive thread -> rxRing -> read()
+
+Each ring index is advanced by one thread only, so neither side takes a lock
+and a slow application never blocks the socket threads: the transmit thread
+pads with silence when txRing runs dry and the receive thread drops samples
+when rxRing is full (an rx overrun).  Writing starts a signal, and flush()
+marks where it ends.  Any frame that runs short or empty before the end of
+the signal is a tx underrun; the zero padded last frame of a flushed signal
+and the silence after it are not.
+
+The transmit thread paces frames to the sample rate, at most lead seconds
+ahead, so the buffering delay is bounded by lead plus what the application
+keeps queued in the rings.  Every transmit frame carries its frame counter.
+With loopback set, the far end is taken to echo the frames back, and the
+round trip time of each frame from socket to socket is recorded when its
+counter comes back.  The received counters of a modem are its own, so the
+round trip is only measured on a loopback.
+"""
+from __future__ import print_function
+import socket
+import threading
+import time
+
+import numpy as np
+
+from .metrics import LatencyHistogram
+from .pcmformat import (PCMLOG_OFFSET, PCM_FRAME_WORDS, PCM_FRAME_BYTES, PCM_FRAME_SAMPLES,
+                        PCM_COUNTER_WORD, floatsPerSecond)
+
+# Upper bounds in seconds of the round trip histogram buckets
+ROUND_TRIP_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+# The number of transmit frames whose send times are kept for matching
+SEND_HISTORY = 4096
+
+
+class SampleRing(object):
+    """
+    A single producer, single consumer ring of samples.  The producer only
+    advances written and the consumer only advances consumed; both are
+    monotonic counts, so each side reads the other's index without a lock.
+    """
+    def __init__(self, capacity, dtype):
+        self.buf = np.zeros(capacity, dtype)
+        self.capacity = capacity
+        self.written = 0
+        self.consumed = 0
+
+    def available(self):
+        return self.written - self.consumed
+
+    def space(self):
+        return self.capacity - (self.written - self.consumed)
+
+    def write(self, samples):
+        """
+        Producer side.  Copies as many samples as fit.
+
+        :returns    count:  The number of samples written
+        :type       count:  integer
+        """
+        count = min(len(samples), self.space())
+        start = self.written % self.capacity
+        first = min(count, self.capacity - start)
+        self.buf[start:start + first] = samples[:first]
+        self.buf[:count - first] = samples[first:count]
+        self.written += count
+        return count
+
+    def readInto(self, out):
+        """
+        Consumer side.  Copies up to len(out) samples into out.
+
+        :returns    count:  The number of samples read
+        :type       count:  integer
+        """
+        count = min(len(out), self.available())
+        start = self.consumed % self.capacity
+        first = min(count, self.capacity - start)
+        out[:first] = self.buf[start:start + first]
+        out[first:count] = self.buf[:count - first]
+        self.consumed += count
+        return count
+
+    def discard(self):
+        """
+        Consumer side.  Drops every sample available.
+        """
+        self.consumed = self.written
+
+
+class PcmDuplex(object):
+    """
+    PcmDuplex runs the transmit and receive threads of one pcmio connection.
+    Samples are float32 for passband and complex64 for baseband.
+
+    usage:
+        duplex = modem.pcmDuplex(bb=1)
+        while probing:
+            duplex.write(probe)
+            duplex.flush()
+            response = duplex.read(len(probe))
+        duplex.close()
+    """
+    def __init__(self, sock, bb, ringSeconds=1.0, lead=0.05, loopback=False, onClose=None):
+        """
+        :param      sock:         The connected pcmio socket
+        :type       sock:         socket
+        :param      bb:           passband or baseband selection
+        :type       bb:           number 0/1 passband/baseband
+        :param      ringSeconds:  The seconds of signal each ring holds
+        :type       ringSeconds:  number
+        :param      lead:         The most seconds of signal sent ahead of real time
+        :type       lead:         number
+        :param      loopback:     The far end echoes the transmitted frames; measure
+                                  their round trip
+        :type       loopback:     boolean
+        :param      onClose:      Called once after the threads have stopped
+        :type       onClose:      function
+        """
+        self.sock = sock
+        self.bb = bb
+        self.dtype = np.complex64 if bb else np.float32
+        # Samples of dtype per second and per frame
+        self.rate = floatsPerSecond(bb) // (2 if bb else 1)
+        self.frameSamples = PCM_FRAME_SAMPLES // (2 if bb else 1)
+        self.framePeriod = self.frameSamples / float(self.rate)
+        self.lead = lead
+        self.loopback = loopback
+        capacity = max(1, int(ringSeconds / self.framePeriod)) * self.frameSamples
+        self.txRing = SampleRing(capacity, self.dtype)
+        self.rxRing = SampleRing(capacity, self.dtype)
+        # The txRing.written count at the end of the last flushed signal, set by
+        # the application in flush() and only read by the transmit thread
+        self.txEnd = 0
+        self.txSpace = threading.Event()
+        self.rxReady = threading.Event()
+        self.onClose = onClose
+
+        self.sendTimes = np.zeros(SEND_HISTORY)
+        self.sendCounters = np.full(SEND_HISTORY, -1, np.int64)
+        self.roundTrip = LatencyHistogram(ROUND_TRIP_BUCKETS)
+        self.lastRoundTrip = None
+        self.txFrames = 0
+        self.rxFrames = 0
+        self.txUnderruns = 0
+        self.txLate = 0
+        self.rxOverruns = 0
+        self.rxDropped = 0
+        self.rxLost = 0
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.is_running = True
+        self.threads = []
+
+    def start(self):
+        for target, name in ((self.txLoop, "PcmDuplexTx"), (self.rxLoop, "PcmDuplexRx")):
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def close(self):
+        self.is_running = False
+        self.txSpace.set()
+        self.rxReady.set()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self.threads = []
+        if self.onClose is not None:
+            self.onClose()
+            self.onClose = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def write(self, samples, timeout=None):
+        """
+        Queues samples for transmission, waiting for ring space as needed.
+
+        :param      samples:  float32 (passband) or complex64 (baseband) samples
+        :type       samples:  numpy.ndarray
+        :param      timeout:  The seconds to wait for space, None to wait forever,
+                              0 to queue only what fits now
+        :type       timeout:  number
+        :returns    count:    The number of samples queued
+        :type       count:    integer
+        """
+        samples = np.asarray(samples, self.dtype)
+        count = self.txRing.write(samples)
+        deadline = None if timeout is None else time.time() + timeout
+        while count < len(samples) and self.is_running:
+            self.txSpace.clear()
+            if self.txRing.space() == 0:
+                wait = None if deadline is None else deadline - time.time()
+                if wait is not None and wait <= 0:
+                    break
+                self.txSpace.wait(wait)
+            count += self.txRing.write(samples[count:])
+        return count
+
+    def flush(self, timeout=None):
+        """
+        Marks the end of the signal written so far and waits until it has been
+        sent.  A later write() starts a new signal.
+
+        :param      timeout:  The seconds to wait, None to wait forever
+        :type       timeout:  number
+        :returns    sent:     True if the whole signal was sent
+        :type       sent:     boolean
+        """
+        self.txEnd = end = self.txRing.written
+        deadline = None if timeout is None else time.time() + timeout
+        while self.txRing.consumed < end and self.is_running:
+            self.txSpace.clear()
+            if self.txRing.consumed >= end:
+                break
+            wait = None if deadline is None else deadline - time.time()
+            if wait is not None and wait <= 0:
+                break
+            self.txSpace.wait(wait)
+        return self.txRing.consumed >= end
+
+    def read(self, count, timeout=None):
+        """
+        Returns the next count received samples.
+
+        :param      count:    The number of samples
+        :type       count:    integer
+        :param      timeout:  The seconds to wait, None to wait forever
+        :type       timeout:  number
+        :returns    samples:  The samples; fewer than count on timeout or close
+        :type       samples:  numpy.ndarray
+        """
+        out = np.empty(count, self.dtype)
+        got = self.rxRing.readInto(out)
+        deadline = None if timeout is None else time.time() + timeout
+        while got < count and self.is_running:
+            self.rxReady.clear()
+            if self.rxRing.available() == 0:
+                wait = None if deadline is None else deadline - time.time()
+                if wait is not None and wait <= 0:
+                    break
+                self.rxReady.wait(wait)
+            got += self.rxRing.readInto(out[got:])
+        return out[:got]
+
+    def txLoop(self):
+        frame = np.zeros(PCM_FRAME_WORDS, np.float32)
+        header = frame.view(np.uint32)
+        samples = frame[PCMLOG_OFFSET:].view(self.dtype)
+        data = memoryview(frame.view(np.uint8))
+        start = time.time()
+        counter = 0
+        try:
+            while self.is_running:
+                due = start + counter * self.framePeriod
+                now = time.time()
+                if now < due - self.lead:
+                    time.sleep(due - self.lead - now)
+                elif now > due + self.framePeriod:
+                    # Fell behind real time; the modem has played silence meanwhile
+                    self.txLate += 1
+                    start += now - due
+                count = self.txRing.readInto(samples)
+                self.txSpace.set()
+                if count < self.frameSamples:
+                    samples[count:] = 0
+                    if self.txRing.consumed > self.txEnd:
+                        # Ran dry before the end of the signal
+                        self.txUnderruns += 1
+                header[PCM_COUNTER_WORD] = counter & 0xffffffff
+                slot = counter % SEND_HISTORY
+                self.sendCounters[slot] = counter & 0xffffffff
+                self.sendTimes[slot] = time.time()
+                self.sendFrame(data)
+                counter += 1
+                self.txFrames = counter
+        except socket.error:
+            self.is_running = False
+        self.rxReady.set()
+
+    def sendFrame(self, data):
+        offset = 0
+        while offset < len(data) and self.is_running:
+            try:
+                offset += self.sock.send(data[offset:])
+            except socket.timeout:
+                continue
+        self.bytesSent += offset
+
+    def rxLoop(self):
+        frame = np.zeros(PCM_FRAME_WORDS, np.float32)
+        header = frame.view(np.uint32)
+        samples = frame[PCMLOG_OFFSET:].view(self.dtype)
+        view = memoryview(frame.view(np.uint8))
+        lastCounter = None
+        try:
+            while self.is_running:
+                fill = 0
+                while fill < PCM_FRAME_BYTES and self.is_running:
+                    try:
+                        count = self.sock.recv_into(view[fill:])
+                    except socket.timeout:
+                        continue
+                    if count == 0:
+                        self.is_running = False
+                        break
+                    fill += count
+                    self.bytesReceived += count
+                if fill < PCM_FRAME_BYTES:
+                    break
+                now = time.time()
+                counter = int(header[PCM_COUNTER_WORD])
+                slot = counter % SEND_HISTORY
+                if self.loopback and self.sendCounters[slot] == counter:
+                    self.lastRoundTrip = now - float(self.sendTimes[slot])
+                    self.roundTrip.observe(self.lastRoundTrip)
+                if lastCounter is not None and counter != (lastCounter + 1) & 0xffffffff:
+                    self.rxLost += 1
+                lastCounter = counter
+                written = self.rxRing.write(samples)
+                if written < self.frameSamples:
+                    self.rxOverruns += 1
+                    self.rxDropped += self.frameSamples - written
+                self.rxFrames += 1
+                self.rxReady.set()
+        except socket.error:
+            self.is_running = False
+        self.txSpace.set()
+
+    def bufferingDelay(self):
+        """
+        :returns    seconds:  The signal queued in both rings plus the transmit lead
+        :type       seconds:  number
+        """
+        return (self.txRing.available() + self.rxRing.available()) / float(self.rate) + self.lead
+
+    def stats(self):
+        """
+        :returns    stats:  Frames each way, tx underruns and late frames, rx overruns,
+                            dropped samples and counter gaps, the ring fill in seconds,
+                            the buffering delay, and on a loopback the socket to socket
+                            round trip histogram with its most recent value (None
+                            otherwise)
+        :type       stats:  dictionary
+        """
+        loopback = self.loopback
+        return {'txFrames': self.txFrames, 'rxFrames': self.rxFrames,
+                'txUnderruns': self.txUnderruns, 'txLate': self.txLate,
+                'rxOverruns': self.rxOverruns, 'rxDropped': self.rxDropped,
+                'rxLost': self.rxLost,
+                'txBuffered': self.txRing.available() / float(self.rate),
+                'rxBuffered': self.rxRing.available() / float(self.rate),
+                'bufferingDelay': self.bufferingDelay(),
+                'lastRoundTrip': self.lastRoundTrip if loopback else None,
+                'roundTrip': self.roundTrip.snapshot() if loopback else None}
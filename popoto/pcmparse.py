@@ -0,0 +1,89 @@
+"""
+Vectorized parsing of pcmlog frames.
+
+A buffer of whole frames is viewed as a (frames, PCM_FRAME_WORDS) array of
+32 bit words.  The header columns give the per frame counters and gain
+flags, and the remaining columns are reinterpreted as float32 (passband) or
+complex64 (baseband) samples, all without a Python level loop per frame.
+"""
+from __future__ import print_function
+from collections import namedtuple
+
+import numpy as np
+
+from .pcmformat import (PCMLOG_OFFSET, PCM_FRAME_WORDS, PCM_FRAME_BYTES,
+                        PCM_COUNTER_WORD, PCM_GAIN_WORD)
+
+PcmFrames = namedtuple('PcmFrames', 'samples counters gains')
+
+
+def frameWords(buf):
+    """
+    Views the whole frames of a buffer as 32 bit words.  A trailing partial
+    frame is ignored.
+
+    :param      buf:    Raw pcmlog data
+    :type       buf:    bytes, bytearray, memoryview, mmap or numpy array
+    :returns    words:  A (frames, PCM_FRAME_WORDS) uint32 view of buf
+    :type       words:  numpy.ndarray
+    """
+    if isinstance(buf, np.ndarray):
+        buf = buf.reshape(-1).view(np.uint8)
+    frames = len(buf) // PCM_FRAME_BYTES
+    words = np.frombuffer(buf, dtype='<u4', count=frames * PCM_FRAME_WORDS)
+    return words.reshape(frames, PCM_FRAME_WORDS)
+
+
+def parseFrames(buf, bb, flat=True):
+    """
+    Splits raw pcmlog frames into samples, frame counters and gain flags.
+
+    :param      buf:     Raw pcmlog data made of whole frames
+    :type       buf:     bytes, bytearray, memoryview, mmap or numpy array
+    :param      bb:      passband or baseband selection
+    :type       bb:      number 0/1 passband/baseband
+    :param      flat:    Return the samples as one contiguous vector.  When False the
+                         samples are a (frames, samples per frame) view of buf.
+    :type       flat:    boolean
+    :returns    frames:  samples as float32 (passband) or complex64 (baseband),
+                         counters (pcmCount) and gains (0=lo,1=hi), one per frame
+    :type       frames:  PcmFrames
+    """
+    words = frameWords(buf)
+    samples = words[:, PCMLOG_OFFSET:].view('<f4')
+    if bb:
+        samples = samples.view('<c8')
+    if flat:
+        samples = samples.reshape(-1)
+    return PcmFrames(samples, words[:, PCM_COUNTER_WORD], words[:, PCM_GAIN_WORD])
+
+
+def parseFile(filename, bb, flat=True):
+    """
+    Parses a recording made by recPcmLoop.  The file is memory mapped, so with
+    flat=False nothing is read until the arrays are used.
+
+    :param      filename:  The recording with path
+    :type       filename:  string
+    :param      bb:        passband or baseband selection
+    :type       bb:        number 0/1 passband/baseband
+    :param      flat:      Return the samples as one contiguous vector
+    :type       flat:      boolean
+    :returns    frames:    samples, counters and gains
+    :type       frames:    PcmFrames
+    """
+    data = np.memmap(filename, dtype=np.uint8, mode='r')
+    return parseFrames(data, bb, flat)
+
+
+def droppedFrames(counters):
+    """
+    :param      counters:  The frame counters returned by parseFrames
+    :type       counters:  numpy.ndarray
+    :returns    dropped:   The number of frames missing between consecutive counters
+    :type       dropped:   integer
+    """
+    if len(counters) < 2:
+        return 0
+    steps = np.diff(counters.astype(np.int64)) - 1
+    return int(steps[steps > 0].sum())
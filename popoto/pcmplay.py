@@ -0,0 +1,218 @@
+"""
+Rate paced playback of PCM through the Popoto pcmlog port.
+
+Popoto plays the frames it receives at the real sample rate, so the host
+only has to keep its queue fed.  PcmPlayer sends frames no further ahead of
+the playback position than a bounded lead, handles partial sends, counts
+underruns (chunks that were sent after they were due) and returns when the
+last sample has been played out.
+
+Sources are files of pcmlog frames, which are memory mapped and sent without
+copying, NumPy sample arrays, or iterables of sample blocks; samples are
+framed with PCMLOG_OFFSET header words on the fly.
+"""
+from __future__ import print_function
+import mmap
+import os
+import socket
+import time
+
+from .pcmformat import (PCMLOG_OFFSET, PCM_FRAME_WORDS, PCM_FRAME_BYTES,
+                        PCM_FRAME_SAMPLES, PCM_WORD_BYTES, floatsPerSecond)
+
+
+def fileFrames(filename, chunkFrames):
+    """
+    Generator over a file of pcmlog frames as memoryviews of a memory mapping.
+    """
+    size = os.path.getsize(filename)
+    if size == 0:
+        return
+    with open(filename, 'rb') as fpin:
+        mm = mmap.mmap(fpin.fileno(), size, access=mmap.ACCESS_READ)
+        view = memoryview(mm)
+        try:
+            for chunk in chunkViews(view, chunkFrames):
+                yield chunk
+        finally:
+            view.release()
+            mm.close()
+
+
+def chunkViews(view, chunkFrames):
+    """
+    Generator over consecutive chunkFrames frame slices of a byte view.  Each
+    slice is released when the next one is requested.
+    """
+    step = chunkFrames * PCM_FRAME_BYTES
+    for offset in range(0, len(view), step):
+        chunk = view[offset:offset + step]
+        try:
+            yield chunk
+        finally:
+            chunk.release()
+
+
+def sampleFloats(samples):
+    """
+    :returns    floats:  samples as a contiguous float32 vector, complex samples as
+                         interleaved I/Q
+    :type       floats:  numpy.ndarray
+    """
+    import numpy as np
+
+    samples = np.asarray(samples)
+    dtype = np.complex64 if np.iscomplexobj(samples) else np.float32
+    return np.ascontiguousarray(samples, dtype).view(np.float32).reshape(-1)
+
+
+def frameSamples(samples, firstFrame=0):
+    """
+    Packs samples into pcmlog frames.  The last frame is zero padded.
+
+    :param      samples:     float32 (passband) or complex64 (baseband) samples
+    :type       samples:     numpy.ndarray
+    :param      firstFrame:  The frame counter of the first frame
+    :type       firstFrame:  integer
+    :returns    frames:      The framed data as bytes
+    :type       frames:      memoryview
+    """
+    import numpy as np
+
+    floats = sampleFloats(samples)
+    nframes = (len(floats) + PCM_FRAME_SAMPLES - 1) // PCM_FRAME_SAMPLES
+    frames = np.zeros((nframes, PCM_FRAME_WORDS), np.float32)
+    # The sample columns are not contiguous, so pad to whole frames and assign as rows
+    padded = np.zeros(nframes * PCM_FRAME_SAMPLES, np.float32)
+    padded[:len(floats)] = floats
+    frames[:, PCMLOG_OFFSET:] = padded.reshape(nframes, PCM_FRAME_SAMPLES)
+    frames.view(np.uint32)[:, 0] = np.arange(firstFrame, firstFrame + nframes, dtype=np.uint32)
+    return memoryview(frames.reshape(-1).view(np.uint8))
+
+
+def arrayFrames(samples, chunkFrames):
+    """
+    Generator over a sample array framed for playback.
+    """
+    return chunkViews(frameSamples(samples), chunkFrames)
+
+
+def blockFrames(blocks, chunkFrames):
+    """
+    Generator over an iterable of sample blocks framed for playback.  Samples
+    that do not fill a frame are carried over to the next block.
+    """
+    import numpy as np
+
+    pending = np.empty(0, np.float32)
+    frameCount = 0
+    for block in blocks:
+        floats = sampleFloats(block)
+        if len(pending):
+            floats = np.concatenate((pending, floats))
+        whole = len(floats) - len(floats) % PCM_FRAME_SAMPLES
+        pending = floats[whole:]
+        if whole:
+            for chunk in chunkViews(frameSamples(floats[:whole], frameCount), chunkFrames):
+                yield chunk
+            frameCount += whole // PCM_FRAME_SAMPLES
+    if len(pending):
+        for chunk in chunkViews(frameSamples(pending, frameCount), chunkFrames):
+            yield chunk
+
+
+def playSource(source, chunkFrames):
+    """
+    Selects the frame generator for a filename, sample array or iterable of blocks.
+    """
+    if isinstance(source, str):
+        return fileFrames(source, chunkFrames)
+    if hasattr(source, 'dtype') and hasattr(source, 'shape'):
+        return arrayFrames(source, chunkFrames)
+    return blockFrames(source, chunkFrames)
+
+
+class PcmPlayer(object):
+    """
+    PcmPlayer paces pcmlog frames to the playback sample rate.
+
+    Chunk k is due at the playback position of its first sample.  It is sent
+    no earlier than lead seconds before it is due; a chunk sent after it was
+    due is an underrun, and the playback clock is moved back by the lateness
+    since the modem has played silence meanwhile.
+    """
+    def __init__(self, sock, bb, lead=0.2, chunkFrames=8):
+        """
+        :param      sock:         The connected pcmlog socket
+        :type       sock:         socket
+        :param      bb:           passband or baseband selection
+        :type       bb:           number 0/1 passband/baseband
+        :param      lead:         The most seconds of signal sent ahead of playback
+        :type       lead:         number
+        :param      chunkFrames:  The number of frames per send
+        :type       chunkFrames:  integer
+        """
+        self.sock = sock
+        self.rate = float(floatsPerSecond(bb))
+        self.lead = lead
+        self.chunkFrames = chunkFrames
+        self.samplesSent = 0
+        self.bytesSent = 0
+        self.underruns = 0
+        self.underrunTime = 0
+        self.stalls = 0
+        self.duration = 0
+        self.is_running = True
+
+    def sendChunk(self, chunk):
+        # send() may accept part of the chunk; carry on from where it stopped
+        offset = 0
+        while offset < len(chunk) and self.is_running:
+            try:
+                offset += self.sock.send(chunk[offset:])
+            except socket.timeout:
+                self.stalls += 1
+        self.bytesSent += offset
+
+    def play(self, source):
+        """
+        Plays a source and returns once its last sample has been played out.
+
+        :param      source:  A filename of pcmlog frames, a float32 (passband) or
+                             complex64 (baseband) sample array, or an iterable of such
+                             sample blocks
+        :type       source:  string, numpy.ndarray or iterable
+        :returns    samples: The number of float samples played
+        :type       samples: integer
+        """
+        start = time.time()
+        for chunk in playSource(source, self.chunkFrames):
+            if not self.is_running:
+                break
+            due = start + self.samplesSent / self.rate
+            now = time.time()
+            if now < due - self.lead:
+                time.sleep(due - self.lead - now)
+            elif now > due and self.samplesSent > 0:
+                self.underruns += 1
+                self.underrunTime += now - due
+                start += now - due
+            self.sendChunk(chunk)
+            frames, rest = divmod(len(chunk), PCM_FRAME_BYTES)
+            self.samplesSent += frames * PCM_FRAME_SAMPLES
+            if rest > PCMLOG_OFFSET * PCM_WORD_BYTES:
+                self.samplesSent += rest // PCM_WORD_BYTES - PCMLOG_OFFSET
+
+        # Wait for the last sample to be played out
+        end = start + self.samplesSent / self.rate
+        remaining = end - time.time()
+        if remaining > 0 and self.is_running:
+            time.sleep(remaining)
+        self.duration = self.samplesSent / self.rate
+        return self.samplesSent
+
+    def stop(self):
+        """
+        Ends a playback in progress from another thread.
+        """
+        self.is_running = False
@@ -0,0 +1,96 @@
+"""
+High throughput recording of the Popoto pcmlog stream.
+
+The output file is preallocated for the requested duration and memory
+mapped, and the socket is read with recv_into straight into the mapping.
+The receive loop therefore allocates no buffers and copies every byte only
+once, from the kernel into the page cache.
+"""
+from __future__ import print_function
+import mmap
+import socket
+import time
+
+from .pcmformat import PCM_FRAME_BYTES, PCM_FRAME_SAMPLES, framesForDuration
+
+
+class PcmRecorder(object):
+    """
+    PcmRecorder captures whole pcmlog frames, header words included, into a
+    memory mapped file.  After run() the frame, sample and byte counts are
+    exact; a recording cut short is truncated to the last whole frame.
+    """
+    def __init__(self, sock, outFile, duration, bb):
+        """
+        :param      sock:      The connected pcmlog socket
+        :type       sock:      socket
+        :param      outFile:   The output filename with path
+        :type       outFile:   string
+        :param      duration:  The duration of recording in seconds
+        :type       duration:  number
+        :param      bb:        passband or baseband selection
+        :type       bb:        number 0/1 passband/baseband
+        """
+        self.sock = sock
+        self.outFile = outFile
+        self.bb = bb
+        self.framesRequested = framesForDuration(duration, bb)
+        self.bytesRequested = self.framesRequested * PCM_FRAME_BYTES
+        self.bytesReceived = 0
+        self.frames = 0
+        self.samples = 0
+        self.elapsed = 0
+        self.is_running = True
+
+    def run(self):
+        """
+        Records until the requested duration has been captured, the peer closes
+        the socket or stop() is called.
+
+        :returns    frames:  The number of whole frames recorded
+        :type       frames:  integer
+        """
+        if self.bytesRequested == 0:
+            return 0
+        fpout = open(self.outFile, 'w+b')
+        try:
+            fpout.truncate(self.bytesRequested)
+            mm = mmap.mmap(fpout.fileno(), self.bytesRequested)
+            view = memoryview(mm)
+            offset = 0
+            end = self.bytesRequested
+            recv_into = self.sock.recv_into
+            start = time.time()
+            try:
+                while offset < end and self.is_running:
+                    try:
+                        count = recv_into(view[offset:])
+                    except socket.timeout:
+                        continue
+                    if count == 0:
+                        break
+                    offset += count
+                    self.bytesReceived = offset
+            finally:
+                self.elapsed = time.time() - start
+                view.release()
+                mm.flush()
+                mm.close()
+
+            self.bytesReceived = offset
+            self.frames = offset // PCM_FRAME_BYTES
+            self.samples = self.frames * PCM_FRAME_SAMPLES
+            if self.bb:
+                # Baseband samples are I/Q pairs
+                self.samples //= 2
+            if offset < end:
+                fpout.truncate(self.frames * PCM_FRAME_BYTES)
+        finally:
+            fpout.close()
+        return self.frames
+
+    def stop(self):
+        """
+        Ends a recording in progress from another thread.
+        """
+        self.is_running = False
@@ -0,0 +1,276 @@
+"""
+Fan-out of the live pcmlog stream to local processes through shared memory.
+
+Only one reader can own the pcmlog socket.  PcmPublisher owns it and reads
+with recv_into straight into the slots of a ring buffer held in a
+multiprocessing.shared_memory block.  Any number of processes attach a
+PcmSubscriber by the block name and read slots in place, without copies and
+without the publisher ever waiting for them.
+
+Every slot carries the sequence number of the frames it holds.  A subscriber
+that falls more than a ring behind finds its next slot overwritten and gets
+a PcmOverrun telling it how many slots it lost; it then continues from the
+oldest slot still held.  Requires Python 3.8 or later.
+
+Shared memory layout:
+
+    header      magic, version, slotBytes, slotCount, bb, published count
+    sequence    one u64 per slot: sequence number + 1, 0 while never written,
+                WRITING while the publisher fills it
+    slots       slotCount slots of slotFrames whole pcmlog frames
+"""
+from __future__ import print_function
+import os
+import socket
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+from .pcmformat import PCM_FRAME_BYTES, PCM_FRAME_SAMPLES, floatsPerSecond
+from .trace import tracer
+
+MAGIC = b'POPOTOPC'
+SHARE_VERSION = 1
+HEADER = struct.Struct('<8sIIII')
+HEAD = struct.Struct('<Q')
+HEAD_OFFSET = HEADER.size
+SEQ_OFFSET = HEAD_OFFSET + HEAD.size
+WRITING = 0xffffffffffffffff
+
+
+class PcmOverrun(Exception):
+    """
+    Raised by PcmSubscriber.read when the publisher has overwritten slots the
+    subscriber had not read yet.
+    """
+    def __init__(self, lost):
+        Exception.__init__(self, 'PCM subscriber overrun, {} slots lost'.format(lost))
+        self.lost = lost
+
+
+def dataOffset(slotCount):
+    # Slots start on a 64 byte boundary after the sequence array
+    return (SEQ_OFFSET + 8 * slotCount + 63) & ~63
+
+
+class PcmPublisher(object):
+    """
+    PcmPublisher reads the pcmlog socket on a background thread into a shared
+    memory ring.
+    """
+    def __init__(self, sock, bb, name=None, slots=1024, slotFrames=8, onClose=None):
+        """
+        :param      sock:        The connected pcmlog socket
+        :type       sock:        socket
+        :param      bb:          passband or baseband selection
+        :type       bb:          number 0/1 passband/baseband
+        :param      name:        The shared memory name, generated if None
+        :type       name:        string
+        :param      slots:       The number of slots in the ring
+        :type       slots:       integer
+        :param      slotFrames:  The frames per slot
+        :type       slotFrames:  integer
+        :param      onClose:     Called with no arguments when the publisher is closed
+        :type       onClose:     function
+        """
+        self.sock = sock
+        self.bb = bb
+        self.slotCount = slots
+        self.slotBytes = slotFrames * PCM_FRAME_BYTES
+        self.dataOffset = dataOffset(slots)
+        self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                              size=self.dataOffset + slots * self.slotBytes)
+        self.name = self.shm.name
+        buf = self.shm.buf
+        HEADER.pack_into(buf, 0, MAGIC, SHARE_VERSION, self.slotBytes, slots, bb)
+        HEAD.pack_into(buf, HEAD_OFFSET, 0)
+        buf[SEQ_OFFSET:SEQ_OFFSET + 8 * slots] = bytes(8 * slots)
+        self.onClose = onClose
+        self.published = 0
+        self.bytesReceived = 0
+        self.is_running = False
+        self.thread = None
+
+    def start(self):
+        self.is_running = True
+        self.thread = threading.Thread(target=self.run, name="PcmPublisher")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def run(self):
+        buf = self.shm.buf
+        recv_into = self.sock.recv_into
+        try:
+            while self.is_running:
+                slot = self.published % self.slotCount
+                seqAt = SEQ_OFFSET + 8 * slot
+                HEAD.pack_into(buf, seqAt, WRITING)
+                start = self.dataOffset + slot * self.slotBytes
+                view = buf[start:start + self.slotBytes]
+                fill = 0
+                try:
+                    while fill < self.slotBytes and self.is_running:
+                        try:
+                            count = recv_into(view[fill:])
+                        except socket.timeout:
+                            continue
+                        if count == 0:
+                            self.is_running = False
+                            break
+                        fill += count
+                        self.bytesReceived += count
+                finally:
+                    view.release()
+                if fill < self.slotBytes:
+                    break
+                HEAD.pack_into(buf, seqAt, self.published + 1)
+                self.published += 1
+                HEAD.pack_into(buf, HEAD_OFFSET, self.published)
+        except socket.error as s_err:
+            tracer.warning("PCM publisher socket error: {}", s_err)
+        self.is_running = False
+
+    def close(self):
+        """
+        Stops publishing and removes the shared memory block.  Subscribers that
+        are still attached keep their mapping until they close.
+        """
+        self.is_running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.onClose is not None:
+            self.onClose()
+            self.onClose = None
+        if self.shm is not None:
+            self.shm.close()
+            # A subscriber sharing this process's resource tracker has unregistered
+            # the block; register it again so unlink's unregister finds it
+            if os.name == 'posix':
+                resource_tracker.register(self.shm._name, 'shared_memory')
+            self.shm.unlink()
+            self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+class PcmSubscriber(object):
+    """
+    PcmSubscriber reads a PcmPublisher ring from any local process.
+    """
+    def __init__(self, name, fromOldest=False):
+        """
+        :param      name:        The shared memory name of the publisher
+        :type       name:        string
+        :param      fromOldest:  Start with the oldest slot held rather than the next
+                                 one published
+        :type       fromOldest:  boolean
+        """
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # Before Python 3.13 attaching registers the block with this process's
+            # resource tracker, which would unlink it when the process exits
+            if os.name == 'posix':
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+        buf = self.shm.buf
+        magic, version, self.slotBytes, self.slotCount, self.bb = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or version != SHARE_VERSION:
+            self.shm.close()
+            raise ValueError('{} is not a Popoto PCM ring'.format(name))
+        self.dataOffset = dataOffset(self.slotCount)
+        self.slotPeriod = (self.slotBytes // PCM_FRAME_BYTES) * PCM_FRAME_SAMPLES / float(floatsPerSecond(self.bb))
+        head = self.head()
+        self.nextSeq = max(0, head - self.slotCount + 1) if fromOldest else head
+        self.overruns = 0
+        self.lost = 0
+
+    def head(self):
+        """
+        :returns    count:  The number of slots published so far
+        :type       count:  integer
+        """
+        return HEAD.unpack_from(self.shm.buf, HEAD_OFFSET)[0]
+
+    def slotSeq(self, slot):
+        return HEAD.unpack_from(self.shm.buf, SEQ_OFFSET + 8 * slot)[0]
+
+    def available(self):
+        return self.head() - self.nextSeq
+
+    def read(self, timeout=None):
+        """
+        Returns the next slot as a view of the shared memory.  The view stays valid
+        until the publisher laps it; stillValid(seq) tells whether it has.  Views
+        must be released before close().
+
+        :param      timeout:  The seconds to wait for a slot, None to wait forever
+        :type       timeout:  number
+        :returns    slot:     (seq, view) of the next slot, None on timeout
+        :type       slot:     tuple of integer and memoryview
+        :raises     PcmOverrun: If slots were overwritten before they were read
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            head = self.head()
+            if self.nextSeq < head:
+                break
+            if deadline is not None and time.time() >= deadline:
+                return None
+            time.sleep(self.slotPeriod / 4)
+        # The slot at head is being refilled, so a ring holds slotCount - 1 readable slots
+        oldest = head - self.slotCount + 1
+        if self.nextSeq < oldest:
+            self.overrun(oldest)
+        seq = self.nextSeq
+        slot = seq % self.slotCount
+        if self.slotSeq(slot) != seq + 1:
+            self.overrun(seq + 1)
+        self.nextSeq += 1
+        start = self.dataOffset + slot * self.slotBytes
+        return seq, self.shm.buf[start:start + self.slotBytes]
+
+    def overrun(self, resumeSeq):
+        lost = resumeSeq - self.nextSeq
+        self.nextSeq = resumeSeq
+        self.overruns += 1
+        self.lost += lost
+        raise PcmOverrun(lost)
+
+    def readFrames(self, timeout=None):
+        """
+        Like read, but returns the slot parsed into NumPy views.
+
+        :returns    frames:  (seq, PcmFrames) of the next slot, None on timeout
+        :type       frames:  tuple
+        """
+        from .pcmparse import parseFrames
+
+        slot = self.read(timeout)
+        if slot is None:
+            return None
+        seq, view = slot
+        return seq, parseFrames(view, self.bb, flat=False)
+
+    def stillValid(self, seq):
+        """
+        :returns    valid:  True if the slot read as seq has not been overwritten
+        :type       valid:  boolean
+        """
+        return self.slotSeq(seq % self.slotCount) == seq + 1
+
+    def close(self):
+        self.shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
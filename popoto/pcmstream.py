@@ -0,0 +1,185 @@
+"""
+Live streaming of pcmlog samples as NumPy blocks.
+
+A reader thread pulls pcmlog frames from the socket, parses every batch of
+whole frames in one vectorized call and packs the samples into fixed size
+blocks.  Finished blocks go through a BoundedQueue, so memory and latency are
+bounded by the queue capacity and an explicit overflow policy decides what
+happens when the consumer falls behind.
+"""
+from __future__ import print_function
+import socket
+import threading
+
+import numpy as np
+
+from .boundedqueue import BoundedQueue, DROP_OLDEST
+from .pcmformat import PCM_FRAME_BYTES
+from .pcmparse import parseFrames, droppedFrames
+
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+
+class PcmStream(object):
+    """
+    PcmStream is an iterator over fixed size sample blocks read live from a
+    pcmlog socket.  Blocks are float32 for passband and complex64 for baseband.
+
+    usage:
+        stream = modem.pcmStream(4096)
+        for block in stream:
+            detect(block)
+    """
+    def __init__(self, sock, bb, blockSize, maxBlocks=64, overflow=DROP_OLDEST,
+                 readFrames=32, onClose=None):
+        """
+        :param      sock:        The connected pcmlog socket
+        :type       sock:        socket
+        :param      bb:          passband or baseband selection
+        :type       bb:          number 0/1 passband/baseband
+        :param      blockSize:   The number of samples per yielded block
+        :type       blockSize:   integer
+        :param      maxBlocks:   The number of finished blocks buffered for the consumer
+        :type       maxBlocks:   integer
+        :param      overflow:    DROP_OLDEST, DROP_NEWEST or BLOCK when the buffer is full
+        :type       overflow:    string
+        :param      readFrames:  The receive buffer size in frames
+        :type       readFrames:  integer
+        :param      onClose:     Called once after the stream is closed
+        :type       onClose:     function
+        """
+        self.sock = sock
+        self.bb = bb
+        self.blockSize = blockSize
+        self.dtype = np.complex64 if bb else np.float32
+        self.queue = BoundedQueue(maxBlocks, overflow)
+        self.buf = bytearray(readFrames * PCM_FRAME_BYTES)
+        self.onClose = onClose
+        self.frames = 0
+        self.samples = 0
+        self.lostFrames = 0
+        self.lastCounter = None
+        self.is_running = False
+        self.thread = None
+
+    def start(self):
+        self.is_running = True
+        self.thread = threading.Thread(target=self.run, name="PcmStream")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def run(self):
+        view = memoryview(self.buf)
+        fill = 0
+        block = np.empty(self.blockSize, self.dtype)
+        blockFill = 0
+        while self.is_running:
+            try:
+                count = self.sock.recv_into(view[fill:])
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+            if count == 0:
+                break
+            fill += count
+            whole = fill - fill % PCM_FRAME_BYTES
+            if whole == 0:
+                continue
+
+            frames = parseFrames(view[:whole], self.bb)
+            self.countFrames(frames.counters)
+            samples = frames.samples
+            self.samples += len(samples)
+            used = 0
+            while used < len(samples):
+                take = min(self.blockSize - blockFill, len(samples) - used)
+                block[blockFill:blockFill + take] = samples[used:used + take]
+                blockFill += take
+                used += take
+                if blockFill == self.blockSize:
+                    if self.is_running:
+                        self.queue.put(block)
+                    block = np.empty(self.blockSize, self.dtype)
+                    blockFill = 0
+
+            # Keep the partial frame for the next read
+            fill -= whole
+            if fill:
+                self.buf[0:fill] = self.buf[whole:whole + fill]
+        self.is_running = False
+
+    def countFrames(self, counters):
+        self.frames += len(counters)
+        if self.lastCounter is not None:
+            gap = int(counters[0]) - self.lastCounter - 1
+            if gap > 0:
+                self.lostFrames += gap
+        self.lostFrames += droppedFrames(counters)
+        self.lastCounter = int(counters[-1])
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            try:
+                return self.queue.get(True, 0.5)
+            except Queue.Empty:
+                if not self.is_running and self.queue.empty():
+                    raise StopIteration
+
+    next = __next__
+
+    def read(self, timeout=None):
+        """
+        Returns the next block.
+
+        :param      timeout:  The timeout in seconds, None to wait forever
+        :type       timeout:  number
+        :returns    block:    The next block, None on timeout or end of stream
+        :type       block:    numpy.ndarray
+        """
+        try:
+            return self.queue.get(True, timeout)
+        except Queue.Empty:
+            return None
+
+    def stats(self):
+        """
+        :returns    stats:  frames and samples received, frames lost on the modem side and the
+                            block queue counters (dropped blocks, peak depth)
+        :type       stats:  dictionary
+        """
+        stats = self.queue.stats()
+        stats['frames'] = self.frames
+        stats['samples'] = self.samples
+        stats['lostFrames'] = self.lostFrames
+        return stats
+
+    def close(self):
+        """
+        Stops the reader thread and closes the socket.
+        """
+        if self.sock is None:
+            return
+        self.is_running = False
+        # Release a reader blocked on a full queue
+        self.queue.clear()
+        if self.thread is not None:
+            self.thread.join()
+        self.sock.close()
+        self.sock = None
+        if self.onClose is not None:
+            self.onClose()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
@@ -2,12 +2,16 @@
 from __future__ import print_function
 from socket import socket, AF_INET, SOCK_STREAM, IPPROTO_TCP, TCP_NODELAY,   SHUT_RDWR
 from socket import error as socket_error
+from socket import timeout as socket_timeout
 import sys
 import time
 import threading
 import cmd
 import json
-import Queue
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
 import struct
 
 import logging
@@ -15,7 +19,22 @@ import os
 import os.path
 import functools
 
-PCMLOG_OFFSET=2
+from .framing import CommandReader, formatCommand
+from .correlation import ReplyCorrelator, REPLY_KEYS, waitForReplies
+from .schemacache import SchemaCache
+from .batch import SetValueBatch
+from .pcmformat import PCMLOG_OFFSET
+from .pcmrecord import PcmRecorder
+from .pcmcapture import PcmCapture
+from .pcmplay import PcmPlayer
+from .dataport import DataUploader, DataReceiver
+from .dispatch import EventDispatcher
+from .boundedqueue import BoundedQueue
+from .trace import tracer, TRACE
+from .metrics import ClientMetrics
+from .pcmformat import PCM_FRAME_BYTES
+from .mipsprofile import MipsProfiler, moduleMips
+from .txqueue import TransmitScheduler
 
 class popoto:
     '''  
@@ -29,23 +48,53 @@ class popoto:
 
     In order to do this, the class launches a processing thread that looks for replies 
     decodes the JSON and adds the resulting python object into the reply queue. 
+    Replies to commands issued through request() (getValueI, getValueF, getVersion,
+    getRtc, getParameter) are matched to the waiting call instead, so several
+    commands can be in flight at once.  Messages of a topic that has subscribers
+    (see subscribe()) are routed to them rather than to the reply queue.
 
     The Popoto class requires an IP address and port number to communicate with the Popoto Modem.
     This Port number corresponds to the base port of the modem application.
 
+    The control element schema read at connect time is cached on disk per modem and
+    GetVersion string, so reconnecting to a known modem needs no parameter walk.
+
 
     '''
-    def __init__(self, ip='localhost', basePort=17000): 
-        logging.info("Popoto Init Called")        
+    def __init__(self, ip='localhost', basePort=17000, connect=True, schemaCache=True, paramWindow=1,
+                 replyQSize=1024, replyOverflow='drop_oldest'):
+        """
+        :param      ip:           The IP address of the modem
+        :type       ip:           string
+        :param      basePort:     The base port of the modem application
+        :type       basePort:     integer
+        :param      connect:      Connect and load the parameters now.  When False the
+                                  connection is made by connect() or by the first command.
+        :type       connect:      boolean
+        :param      schemaCache:  True for the default on-disk schema cache, False to always
+                                  enumerate, or a SchemaCache instance
+        :type       schemaCache:  boolean or SchemaCache
+        :param      paramWindow:  Number of GetParameters requests kept in flight while
+                                  enumerating; 1 walks the element list serially.  A
+                                  larger window relies on the modem answering requests
+                                  past the end of the chain with an 'invalid index' Info
+        :type       paramWindow:  integer
+        :param      replyQSize:     The capacity of the replyQ; 0 for unbounded
+        :type       replyQSize:     integer
+        :param      replyOverflow:  'drop_oldest', 'drop_newest' or 'block' when the replyQ
+                                    is full.  'block' holds the command thread for at most
+                                    replyBlockTimeout seconds before dropping the message.
+        :type       replyOverflow:  string
+        """
+        tracer.info("Popoto Init Called")
         self.pcmioport  = basePort+3
         self.pcmlogport = basePort+2
         self.dataport   = basePort+1
         self.cmdport    = basePort
         self.quiet = 0
-        logging.info("Opening Command Socket")
-        self.cmdsocket=socket(AF_INET, SOCK_STREAM)
-        self.cmdsocket.connect((ip, basePort))
-        self.cmdsocket.settimeout(20)
+        # Unused; diagnostics are controlled with trace.setTraceLevel
+        self.verbose = 0
+        self.cmdsocket = None
 
         self.SampFreq = 102400        
         self.pcmlogsocket = 0
@@ -54,16 +103,71 @@ class popoto:
         self.is_running = True
         self.fp = None;
         self.fileLock = threading.Lock()
-        logging.info("Starting Command Thread")
-        self.rxThread = threading.Thread(target=self.RxCmdLoop, name="CmdRxLoop")
-        self.rxThread.start();
-        self.replyQ = Queue.Queue()
+        self.replyQ = BoundedQueue(replyQSize, replyOverflow)
+        self.replyBlockTimeout = 1.0
+        self.correlator = ReplyCorrelator()
+        self.dispatcher = EventDispatcher()
+        self.metrics = ClientMetrics({'modem': '{}:{}'.format(ip, basePort)})
+        self.correlator.observer = self.metrics.observeReply
+        self.metrics.watchQueue('replyQ', self.replyQ)
+        self.errorcount = 0
+        self.sendLock = threading.Lock()
+        self.connectLock = threading.Lock()
         self.datasocket = None
-        logging.info("Starting pcmThread")
+        self.dataReceiver = None
+        self.dataRxSource = None
         self.intParams = {}
         self.floatParams = {}
-	self.verbose = 2    
-        self.getAllParameters()
+        self.version = None
+        if schemaCache is True:
+            schemaCache = SchemaCache()
+        self.schemaCache = schemaCache or None
+        self.paramWindow = paramWindow
+        if connect:
+            self.connect()
+
+    def connect(self):
+        """
+        Opens the command socket, starts the command thread and loads the
+        control element schema, from the schema cache when the modem version
+        matches.  Calling connect on a connected instance does nothing.
+        """
+        with self.connectLock:
+            if self.cmdsocket is not None:
+                return
+            tracer.info("Opening Command Socket")
+            cmdsocket=socket(AF_INET, SOCK_STREAM)
+            cmdsocket.connect((self.ip, self.cmdport))
+            cmdsocket.settimeout(20)
+            self.cmdsocket = cmdsocket
+            tracer.info("Starting Command Thread")
+            self.rxThread = threading.Thread(target=self.RxCmdLoop, name="CmdRxLoop")
+            self.rxThread.start();
+        self.loadParameters()
+
+    def loadParameters(self):
+        """
+        Fills intParams and floatParams, from the schema cache if the modem
+        reports the version the cache entry was stored under, otherwise by
+        enumerating the elements and refreshing the cache.  The cache is only
+        refreshed by an enumeration that reached the end of the chain.
+        """
+        if self.schemaCache is None:
+            self.getAllParameters(self.paramWindow)
+            return
+        self.version = self.getVersion()
+        if self.version is not None:
+            cached = self.schemaCache.load(self.ip, self.cmdport, self.version)
+            if cached is not None:
+                self.intParams, self.floatParams = cached
+                tracer.info("Loaded parameter schema from cache")
+                return
+        complete = self.getAllParameters(self.paramWindow)
+        if not complete:
+            tracer.warning("Parameter enumeration incomplete; schema not cached")
+        elif self.version is not None:
+            self.schemaCache.store(self.ip, self.cmdport, self.version,
+                                   self.intParams, self.floatParams)
     
     def send(self, message):
         """
@@ -73,22 +177,153 @@ class popoto:
         :param      message:  The message contains a Popoto command with optional arguments
         :type       message:  string
         """
-        args =message.split(' ',1)
+        if self.cmdsocket is None:
+            self.connect()
 
-        # Break up the command and optional arguements around the space
-        if len(args) > 1:
-            command = args[0]
-            arguments = args[1]
-        else:
-            command = message
-            arguments = "Unused Arguments"
+        # Send the message to the command socket
+        with self.sendLock:
+            self.cmdsocket.sendall(self.formatCommand(message))
 
-        # Build the JSON message
-        message = "{ \"Command\": \"" + command + "\", \"Arguments\": \""+arguments + "\"}"
+    def request(self, message, key=None, infoMatch=False):
+        """
+        Sends a command and returns a handle on its reply.  The reply is matched
+        by key, which defaults to the reply key of the command, and is not put
+        in the replyQ.  Several requests may be in flight at once.
+
+        :param      message:    The message contains a Popoto command with optional arguments
+        :type       message:    string
+        :param      key:        The top level reply key (or Info text) that identifies the reply
+        :type       key:        string
+        :param      infoMatch:  Match key against the 'Info' text of a reply
+        :type       infoMatch:  boolean
+        :returns    pending:    A handle whose result() blocks for the reply
+        :type       pending:    PendingReply
+        """
+        if self.cmdsocket is None:
+            self.connect()
+        if key is None:
+            command = message.split(' ', 1)[0]
+            key = REPLY_KEYS.get(command, command)
+        with self.sendLock:
+            pending = self.correlator.expect(message, key, infoMatch)
+            try:
+                self.cmdsocket.sendall(self.formatCommand(message))
+            except:
+                self.correlator.cancel(pending)
+                raise
+        return pending
 
-        # Send the message to the command socket
-        self.cmdsocket.sendall(message + '\n')
+    def requestMany(self, commands):
+        """
+        Sends several commands in a single write to the command socket.  Commands
+        with a key are registered for an acknowledgement whose 'Info' text names
+        the key, as Popoto acknowledges SetValue.
+
+        :param      commands:     The commands in send order
+        :type       commands:     list of (message, key) tuples, key None for no reply
+        :returns    pendingList:  The handles of the commands with a key
+        :type       pendingList:  list of PendingReply
+        """
+        if self.cmdsocket is None:
+            self.connect()
+        pendingList = []
+        with self.sendLock:
+            for message, key in commands:
+                if key is not None:
+                    pendingList.append(self.correlator.expect(message, key, True))
+            try:
+                self.cmdsocket.sendall(b''.join([self.formatCommand(message)
+                                                 for message, key in commands]))
+            except:
+                for pending in pendingList:
+                    self.correlator.cancel(pending)
+                raise
+        return pendingList
+
+    def batch(self, timeout=3):
+        """
+        Starts a SetValue transaction.  The SetValue commands added to the batch are
+        written in one send and their acknowledgements are awaited together.
+
+        :param      timeout:  The acknowledgement timeout in seconds
+        :type       timeout:  number
+        :returns    batch:    The batch to add commands to
+        :type       batch:    SetValueBatch
+        """
+        return SetValueBatch(self, timeout)
+
+    def formatCommand(self, message):
+        """
+        Builds the JSON command line for a Popoto command with optional arguments
+
+        :param      message:  The message contains a Popoto command with optional arguments
+        :type       message:  string
+        :returns    line:     The newline terminated JSON command
+        :type       line:     bytes
+        """
+        return formatCommand(message)
    
+    def subscribe(self, topic, callback=None, maxsize=64, overflow='drop_oldest', byType=False,
+                  consume=True, blockTimeout=0.1):
+        """
+        Subscribes to the modem messages carrying a top level key such as 'Info' or
+        'Application.0', or with byType to those with a message type prefix.
+        Subscribed messages no longer reach the replyQ.
+
+        :param      topic:     The key or message type, '*' for every message
+        :type       topic:     string
+        :param      callback:  Called as callback(msgType, reply) on the command thread;
+                               None to queue the messages on the subscription
+        :type       callback:  function
+        :param      maxsize:   The capacity of the subscription queue
+        :type       maxsize:   integer
+        :param      overflow:  'drop_oldest', 'drop_newest' or 'block' when the queue is full.
+                               'block' holds up the command thread, and so every reply,
+                               for up to blockTimeout seconds before dropping the message.
+        :type       overflow:  string
+        :param      byType:    Match topic against the message type prefix
+        :type       byType:    boolean
+        :param      consume:   False to observe the messages and still have them reach
+                               the replyQ
+        :type       consume:   boolean
+        :param      blockTimeout:  The most seconds a full 'block' queue waits for the reader
+        :type       blockTimeout:  number
+        :returns    sub:       The subscription; read() it, and unsubscribe() when done
+        :type       sub:       Subscription
+        """
+        return self.dispatcher.subscribe(topic, callback, maxsize, overflow, byType, consume,
+                                         blockTimeout)
+
+    def getMetrics(self, since=None):
+        """
+        Returns a snapshot of the client metrics: per command round trip latency
+        histograms, pcmlog, data and pcmio socket byte and frame counts with their
+        rates, replyQ depth and drops, and error counts.  Pass the previous
+        snapshot to get the rates since then; each caller keeps its own.
+
+        :param      since:    A snapshot returned earlier, None for the average rates
+                              since the modem object was created
+        :type       since:    dictionary
+        :returns    metrics:  The snapshot
+        :type       metrics:  dictionary
+        """
+        return self.metrics.snapshot(since)
+
+    def writeMetrics(self, path, interval=None):
+        """
+        Writes the metrics to path in the Prometheus text format, once, or every
+        interval seconds from a background thread.
+
+        :param      path:      The output file, e.g. in a node_exporter textfile directory
+        :type       path:      string
+        :param      interval:  The seconds between writes, None for a single write
+        :type       interval:  number
+        """
+        if interval is None:
+            self.metrics.writePrometheus(path)
+        else:
+            self.metrics.startExport(path, interval)
+
     def drainReplyQ(self):
         """
         This function reads and dumps any data that currently resides in the
@@ -98,6 +333,15 @@ class popoto:
         while self.replyQ.empty() == False:
             print(self.replyQ.get())
     
+    def replyStats(self):
+        """
+        :returns    stats:  The replyQ depth, peakDepth, putCount and dropped counters,
+                            and the approximate bytes of the replies held, bytes and
+                            peakBytes
+        :type       stats:  dictionary
+        """
+        return self.replyQ.stats()
+
     def waitForReply(self, Timeout):
         """
         waitForReply is a method that blocks on the replyQ until either a reply has been
@@ -115,53 +359,140 @@ class popoto:
         """
         self.send('Event_StartRx')
 
-    def calibrateTransmit(self):
+    def calibrateTransmit(self, timeout=3):
         """
         calibrateTransmit send performs a calibration cycle on a new transducer
         to allow transmit power to be specified in watts.  It does this by sending
         a known amplitude to the transducer while measuring voltage and current across 
         the transducer.  The resulting measured power is used to adjust scaling parameters
         in Popoto such that future pings can be specified in watts.
+
+        :param      timeout:  The seconds to wait for the acknowledgement
+        :type       timeout:  number
+        :returns    result:   The completed acknowledgement of the power setting; ok()
+                              tells whether it was accepted
+        :type       result:   BatchResult
         """
-        self.setValueF('TxPowerWatts', 1)
-        self.send('Event_startTxCal')
+        return self.batch().setValueF('TxPowerWatts', 1).command('Event_startTxCal').commit(timeout)
 
-    def transmitJSON(self, JSmessage):
+    def transmitJSON(self, JSmessage, validate=True):
         """
         The transmitJSON method sends an arbitrary user JSON message for transmission out the 
-        acoustic modem. 
+        acoustic modem.  Many small messages are better sent through transmitScheduler(),
+        which paces them to the channel and packs them into fewer payloads.
         
         :param      JSmessage:  The Users JSON message
         :type       JSmessage:  string
+        :param      validate:   Check that JSmessage is valid JSON before sending
+        :type       validate:   boolean
+        :returns    sent:       True if the message was handed to the modem
+        :type       sent:       boolean
         """
-        
+        # Verify the user JSON message integrity; the wrapper around it is fixed
+        if validate:
+            try:
+                json.loads(JSmessage)
+            except ValueError:
+                tracer.warning("Invalid JSON message: {}", JSmessage)
+                return False
+
         # Format the user JSON message into a TransmitJSON message for Popoto   
-        message = "{ \"Command\": \"TransmitJSON\", \"Arguments\": " +JSmessage+" }"
-        
-        # Verify the JSON message integrity and send along to Popoto
+        message = '{ "Command": "TransmitJSON", "Arguments": ' + JSmessage + ' }\n'
+        tracer.debug("Sending {}", message)
         try:
-            testJson = json.loads(message)
-            print("Sending " + message)
-            self.cmdsocket.sendall(message + '\n')
-        except:
-            print("Invalid JSON message: ", JSmessage)
+            if self.cmdsocket is None:
+                self.connect()
+            with self.sendLock:
+                self.cmdsocket.sendall(message.encode('utf-8'))
+        except socket_error as s_err:
+            self.metrics.countError('cmd_socket')
+            tracer.error("ERROR SENDING ON COMMAND SOCKET: {}", s_err)
+            return False
+        return True
+
+    def transmitScheduler(self, maxPayload=256, coalesceWindow=0.05, bitRate=None):
+        """
+        transmitScheduler starts a transmit queue for high rate message producers.
+        Messages submitted to it are sent highest priority first, one payload at a
+        time, each payload when the modem reports the previous transmission
+        complete.  Small messages are coalesced into JSON array payloads of up to
+        maxPayload bytes.  Every message gets a ticket with its submit, send and
+        delivery times; stats() reports queueing delays and the effective bit rate.
+
+        :param      maxPayload:      The largest coalesced payload in bytes
+        :type       maxPayload:      integer
+        :param      coalesceWindow:  The seconds a payload waits for more messages
+        :type       coalesceWindow:  number
+        :param      bitRate:         The initial effective bit rate estimate, None to learn it
+        :type       bitRate:         number
+        :returns    scheduler:       The running scheduler; close() it when done
+        :type       scheduler:       TransmitScheduler
+        """
+        scheduler = TransmitScheduler(self, maxPayload, coalesceWindow, bitRate)
+        self.metrics.watchQueue('txQueue', scheduler)
+        return scheduler.start()
 
-    def getVersion(self):
+    def getVersion(self, timeout=3):
         """
         Retrieve the software version of Popoto
+
+        :param      timeout:  The timeout in seconds
+        :type       timeout:  number
+        :returns    version:  The version reply, None on timeout
+        :type       version:  string
         """
-        self.send('GetVersion')
+        return self.waitForValue(self.request('GetVersion'), timeout)
 
-    def sendRange(self, power=.1):
+    def sendRange(self, power=.1, timeout=3):
         """
-        Send a command to Popoto to initiate a ranging cycle to another modem
+        Send a command to Popoto to initiate a ranging cycle to another modem.
+        For series of pings use rangingCampaign().
         
-        :param      power:  The power in watts
-        :type       power:  number
+        :param      power:    The power in watts
+        :type       power:    number
+        :param      timeout:  The seconds to wait for the acknowledgements
+        :type       timeout:  number
+        :returns    result:   The completed acknowledgements of the ranging settings;
+                              ok() tells whether they were accepted
+        :type       result:   BatchResult
         """
-        self.setValueF('TxPowerWatts', power)
-        self.setValueI('CarrierTxMode', 0)
-        self.send('Event_sendRanging')
+        b = self.batch()
+        b.setValueF('TxPowerWatts', power)
+        b.setValueI('CarrierTxMode', 0)
+        b.command('Event_sendRanging')
+        return b.commit(timeout)
+
+    def rangingCampaign(self, count, interval=0.0, powers=(0.1,), timeout=10, wait=True):
+        """
+        rangingCampaign pings count times at each power level in turn, matching
+        each Range reply to its ping.  SetValues are only sent when a ping needs a
+        different setting, and a ping follows the previous reply without a round
+        trip through the script, so the ping rate is set by the modem.  The results
+        are NumPy columns (power, sentTime, replyTime, range, soundSpeed) with
+        summary statistics from summary().
+
+        :param      count:     The pings at each power level
+        :type       count:     integer
+        :param      interval:  The least seconds between pings, 0 for as fast as possible
+        :type       interval:  number
+        :param      powers:    The power levels in watts
+        :type       powers:    list of numbers
+        :param      timeout:   The seconds to wait for each Range reply
+        :type       timeout:   number
+        :param      wait:      Block until the campaign ends; when False it runs in the
+                               background until it ends or stop() is called
+        :type       wait:      boolean
+        :returns    campaign:  The campaign, with its results in campaign.results
+        :type       campaign:  RangingCampaign
+        """
+        from .ranging import RangingCampaign
+
+        campaign = RangingCampaign(self, count, interval, powers, timeout)
+        if wait:
+            campaign.run()
+        else:
+            campaign.start()
+        return campaign
     
     def recordStartTarget(self,filename, duration):
         """
@@ -195,8 +526,8 @@ class popoto:
                                 higher transmit power.
         :type       scale:     number
         """
-	   print ("Playing {} at Scale {}".format(filename, scale))    
-	   self.send('StartPlaying {} {}'.format(filename, scale))
+        tracer.info("Playing {} at Scale {}", filename, scale)
+        self.send('StartPlaying {} {}'.format(filename, scale))
     
     def playStopTarget(self):
         """
@@ -226,27 +557,96 @@ class popoto:
         """
         self.send('SetValue {} float {} 0'.format(Element, value))        
 
-    def getValueI(self, Element):
+    def getValueI(self, Element, timeout=3):
         """
         Gets an integer value of a Popoto integer variable
         
         :param      Element:  The name of the variable to be retreived
         :type       Element:  string
-        :returns    value:    The value
+        :param      timeout:  The timeout in seconds
+        :type       timeout:  number
+        :returns    value:    The value, None on timeout
         :type       value:    integer
         """
-        self.send('GetValue {} int  0'.format(Element))        
+        return self.waitForValue(self.requestValueI(Element), timeout)
 
-    def getValueF(self, Element):
+    def getValueF(self, Element, timeout=3):
         """
         Gets the 32bit floating value of a Popoto float variable
         
         :param      Element:  The name of the variable to be retreived
         :type       Element:  string
-        :returns    value:    The value
+        :param      timeout:  The timeout in seconds
+        :type       timeout:  number
+        :returns    value:    The value, None on timeout
         :type       value:    float
         """
-        self.send('GetValue {} float  0'.format(Element))        
+        return self.waitForValue(self.requestValueF(Element), timeout)
+
+    def requestValueI(self, Element):
+        """
+        Requests an integer value without waiting for it.
+
+        :param      Element:  The name of the variable to be retreived
+        :type       Element:  string
+        :returns    pending:  A handle whose result() blocks for the reply
+        :type       pending:  PendingReply
+        """
+        return self.request('GetValue {} int  0'.format(Element), Element)
+
+    def requestValueF(self, Element):
+        """
+        Requests a 32bit float value without waiting for it.
+
+        :param      Element:  The name of the variable to be retreived
+        :type       Element:  string
+        :returns    pending:  A handle whose result() blocks for the reply
+        :type       pending:  PendingReply
+        """
+        return self.request('GetValue {} float  0'.format(Element), Element)
+
+    def getValues(self, Elements, timeout=3):
+        """
+        Gets several Popoto variables with all the GetValue requests in flight at
+        once.  The format of each element is taken from the parameter list.
+
+        :param      Elements:  The names of the variables to be retreived
+        :type       Elements:  list of strings
+        :param      timeout:   The overall timeout in seconds
+        :type       timeout:   number
+        :returns    values:    Element name to value, None where a reply timed out
+        :type       values:    dictionary
+        """
+        pendingList = []
+        for Element in Elements:
+            if Element in self.floatParams:
+                pendingList.append(self.requestValueF(Element))
+            else:
+                pendingList.append(self.requestValueI(Element))
+        waitForReplies(pendingList, timeout)
+        values = {}
+        for Element, pending in zip(Elements, pendingList):
+            values[Element] = self.waitForValue(pending, 0)
+        return values
+
+    def waitForValue(self, pending, timeout):
+        """
+        Waits for a request and extracts the value carried under its reply key.
+        A request that times out is withdrawn so that a late reply is not taken
+        as the answer to a later request.
+
+        :param      pending:  The handle returned by request
+        :type       pending:  PendingReply
+        :param      timeout:  The timeout in seconds
+        :type       timeout:  number
+        :returns    value:    The value, None on timeout
+        """
+        reply = pending.result(timeout)
+        if reply is None:
+            self.correlator.cancel(pending)
+            self.metrics.countError('timeout')
+            return None
+        return reply.get(pending.key)
 
     
     def tearDownPopoto(self):
@@ -277,7 +677,7 @@ class popoto:
                                 format YYYY.MM.DD-HH:MM;SS
         :type       clockstr:   string
         """
-        self.send('GetRTC')
+        return self.waitForValue(self.request('GetRTC'), 3)
 
     def __del__(self):
         # Destructor
@@ -287,76 +687,59 @@ class popoto:
         self.is_running =0
 
 
-    def playPcmLoop(self, inFile, bb):
+    def playPcmLoop(self, inFile, bb, lead=0.2):
         """
         playPcmLoop 
-        Play passband/baseband PCM for duration seconds.  
-        :param      inFile:  In file
-        :type       inFile:  string
+        Play passband/baseband PCM paced to the real sample rate.  No more than lead
+        seconds of signal are queued ahead of the modem, and the call returns when
+        the last sample has been played.
+        :param      inFile:  In file of pcmlog frames, or a float32 (passband) /
+                             complex64 (baseband) sample array, or an iterable of
+                             sample blocks
+        :type       inFile:  string, numpy.ndarray or iterable
         :param      bb:      selects passband or baseband data
         :type       bb:      number 0/1 for pass/base
+        :param      lead:    The most seconds of signal sent ahead of playback
+        :type       lead:    number
+        :returns    player:  The player, holding the sample, duration and underrun counts
+        :type       player:  PcmPlayer
         """
+        if isinstance(inFile, str) and not os.access(inFile, os.R_OK):
+            tracer.warning("Unable to Open {} for Reading", inFile)
+            return
+
         self.pcmlogsocket=socket(AF_INET, SOCK_STREAM)
         self.pcmlogsocket.connect((self.ip, self.pcmlogport))
         self.pcmlogsocket.settimeout(1)
-        if(self.pcmlogsocket == None):
-            print("Unable to open PCM Log Socket")
-            return
+
         # Set mode to either passband-0 or baseband-1
         self.setValueI('PlayMode', bb)
         
         # Start the play
         self.send('StartNetPlay 0 0')
-       
-        # Open the file for playing
-        fpin  = open(inFile, 'r')
-        if(fpin == None):
-            print("Unable to Open {} for Reading")
-            return
-        s_time = time.time()
-        sampleCounter = 0 
-        if(bb):
-            SampPerSec = 10240 *2
-        else:
-            SampPerSec = 102400
-
-        Done = 0
-        while Done == 0:
-            # Read socket of pcm data
-            fdata = fpin.read(642*4)
-
-            if(len(fdata) < 642*4):
-                print('Done Reading File')
-                Done = 1
-           
-            StartSample = sampleCounter
-            while(sampleCounter == StartSample):
-                try:
-                    self.pcmlogsocket.send(fdata) # Send data over socket
-                    sampleCounter += (len(fdata)-8)
-                except:
-                    print('Waiting For Network')
-        
-        duration = sampleCounter / (4*SampPerSec);  #  Bytes to Floats->seconds
-        print('Duration {}'.format(duration))
 
-        while(time.time() < s_time+duration):
-            time.sleep(1)            
-        
-        # Terminate play
-        self.send('Event_playPcmQueueEmpty')
-    
-        print("Exiting PCM Loop")
-        self.pcmlogsocket.close()
-        fpin.close()
+        player = PcmPlayer(self.pcmlogsocket, bb, lead)
+        source = self.metrics.sockets['pcmlog'].attach(
+            lambda: (player.bytesSent, player.bytesSent // PCM_FRAME_BYTES))
+        try:
+            player.play(inFile)
+            tracer.debug('Duration {}', player.duration)
+        finally:
+            self.metrics.sockets['pcmlog'].detach(source)
+            # Terminate play
+            self.send('Event_playPcmQueueEmpty')
+            tracer.debug("Exiting PCM Loop")
+            self.pcmlogsocket.close()
+        return player
 
 
     def recPcmLoop(self, outFile, duration, bb):
         """
         recPcmLoop records passband/baseband pcm for duration seconds.  
-        This function also returns a vector of timestamps in pcmCount and a vector of 
-        HiGain_LowGain flags 0=lo,1=hi which indicate which A/D
-        channel was selected on a frame basis
+        The recording holds whole pcmlog frames, PCMLOG_OFFSET header words included,
+        so the per frame timestamps (pcmCount) and HiGain_LowGain flags 0=lo,1=hi,
+        which indicate which A/D channel was selected on a frame basis, are kept
+        alongside the samples.
         
         Code sets baseband mode as selected on input, but changes back to pass
         band mode on exit.  Base band recording and normal modem function are
@@ -368,6 +751,8 @@ class popoto:
         :type       duration:  number
         :param      bb:        passband or baseband selection
         :type       bb:        number 0/1 passband/baseband
+        :returns    recorder:  The recorder, holding the exact frame and sample counts
+        :type       recorder:  PcmRecorder
         """
         
         # Open and configure streaming port 
@@ -377,59 +762,307 @@ class popoto:
 
         # Set mode to either passband-0 or baseband-1
         self.setValueI('RecordMode', bb)
-        if(bb == 1):
-            duration = duration * 10240 *2   # Baseband rate 10240 Cplx samples /sec
-        else:
-            duration = duration *102400
 
-    
-        if(self.pcmlogsocket == None):
-            print("Unable to open PCM Log Socket")
+        recorder = PcmRecorder(self.pcmlogsocket, outFile, duration, bb)
+        source = self.metrics.sockets['pcmlog'].attach(
+            lambda: (recorder.bytesReceived, recorder.bytesReceived // PCM_FRAME_BYTES))
+        try:
+            recorder.run()
+        finally:
+            self.metrics.sockets['pcmlog'].detach(source)
+            self.recByteCount = recorder.bytesReceived
+            tracer.debug("Exiting PCM Loop")
+            self.pcmlogsocket.close()
             self.setValueI('RecordMode', 0)
-            return
+        return recorder
+
+    def recPcmCapture(self, outFile, duration=None, bb=0, rotateSeconds=None, wait=True,
+                      buffers=32, sink=None):
+        """
+        recPcmCapture records passband/baseband pcm for long unattended captures.
+        Unlike recPcmLoop the socket is read on one thread and the file written on
+        another, through a pool of buffers, so a storage stall does not hold up the
+        stream.  Like recordStartTarget the capture can be split into files of
+        rotateSeconds each, named from outFile with the start time and a sequence
+        number.  RecordMode is set back to passband when the capture ends.
+
+        :param      outFile:        The output filename with path
+        :type       outFile:        string
+        :param      duration:       The duration of recording in seconds, None until stop()
+        :type       duration:       number
+        :param      bb:             passband or baseband selection
+        :type       bb:             number 0/1 passband/baseband
+        :param      rotateSeconds:  The seconds of signal per file, None for a single file
+        :type       rotateSeconds:  number
+        :param      wait:           Block until the capture ends; when False the capture
+                                    runs in the background until stop()
+        :type       wait:           boolean
+        :param      buffers:        The number of 64 frame buffers that absorb write stalls
+        :type       buffers:        integer
+        :param      sink:           Write to this sink, e.g. a PcmArchiveWriter, not outFile
+        :type       sink:           PcmArchiveWriter
+        :returns    capture:        The capture, with stats() for writer lag and the files
+        :type       capture:        PcmCapture
+        """
+        pcmsocket = socket(AF_INET, SOCK_STREAM)
+        pcmsocket.connect((self.ip, self.pcmlogport))
+        pcmsocket.settimeout(1)
+        self.pcmlogsocket = pcmsocket
 
-        # Open the recording file
-        fpout = open(outFile,'w')
-        if(fpout == None):
-            print("Unable to Open {} for Writing")
+        # Set mode to either passband-0 or baseband-1
+        self.setValueI('RecordMode', bb)
+
+        def onDone():
+            self.metrics.sockets['pcmlog'].detach(source)
+            self.recByteCount = capture.bytesReceived
+            pcmsocket.close()
             self.setValueI('RecordMode', 0)
-            return      
-              
-        self.recByteCount = 0
-        Done = 0
-        while Done == 0:
-            # Read socket
-            try:
-                fromRx=self.pcmlogsocket.recv(642*4); # Read the socket
-                if fpout != None:
-                    fpout.write(fromRx)     # write the data
-                self.recByteCount = self.recByteCount + len(fromRx)-2;
-                if (self.recByteCount >= duration*4):
-                    Done=1
-                FrameCounter = FrameCounter +1
-                if FrameCounter > 80:
-                    print('.')
-                    FrameCounter = 0
-            except:
-                continue
 
+        capture = PcmCapture(pcmsocket, outFile, duration, bb, rotateSeconds, buffers,
+                             onDone=onDone, sink=sink)
+        source = self.metrics.sockets['pcmlog'].attach(
+            lambda: (capture.bytesReceived, capture.bytesReceived // PCM_FRAME_BYTES))
+        if wait:
+            capture.run()
+        else:
+            capture.start()
+        return capture
+
+    def recPcmArchive(self, path, duration=None, bb=0, chunkFrames=16, wait=True, snapshot=True):
+        """
+        recPcmArchive records passband/baseband pcm into an indexed archive: the
+        frames, an index of frame counter, arrival time, gain flag and offset per
+        chunk of frames, and metadata with the sample rate, mode, modem address and
+        a snapshot of the modem parameters.  Open it with popoto.pcmarchive.PcmArchive
+        for random access by time or frame counter.
+
+        :param      path:         The archive name; .pcm, .idx and .json files are written
+        :type       path:         string
+        :param      duration:     The duration of recording in seconds, None until stop()
+        :type       duration:     number
+        :param      bb:           passband or baseband selection
+        :type       bb:           number 0/1 passband/baseband
+        :param      chunkFrames:  The frames per index entry
+        :type       chunkFrames:  integer
+        :param      wait:         Block until the recording ends
+        :type       wait:         boolean
+        :param      snapshot:     Read every parameter value into the metadata first
+        :type       snapshot:     boolean
+        :returns    capture:      The capture
+        :type       capture:      PcmCapture
+        """
+        from .pcmarchive import PcmArchiveWriter
+
+        metadata = {'modem': self.ip, 'basePort': self.cmdport, 'modemVersion': self.version}
+        if snapshot:
+            # APP_CycleCount answers under 'Application.0', not its own name
+            names = [name for name in sorted(self.intParams) + sorted(self.floatParams)
+                     if name != 'APP_CycleCount']
+            metadata['parameters'] = self.getValues(names, 1)
+        writer = PcmArchiveWriter(path, bb, chunkFrames, metadata)
+        return self.recPcmCapture(writer.dataFile, duration, bb, wait=wait, sink=writer)
+
+    def pcmStream(self, blockSize, bb=0, maxBlocks=64, overflow='drop_oldest'):
+        """
+        pcmStream streams live passband/baseband pcm from the pcmlog port as fixed
+        size NumPy blocks, without going through a file.  Iterate over the returned
+        stream to consume the blocks and close it to end the stream; RecordMode is
+        set back to passband on close.
+
+        :param      blockSize:  The number of samples per block
+        :type       blockSize:  integer
+        :param      bb:         passband or baseband selection
+        :type       bb:         number 0/1 passband/baseband
+        :param      maxBlocks:  The number of blocks buffered for a slow consumer
+        :type       maxBlocks:  integer
+        :param      overflow:   'drop_oldest', 'drop_newest' or 'block' (back pressure on
+                                the socket) when the buffer is full
+        :type       overflow:   string
+        :returns    stream:     Iterable of float32 (passband) or complex64 (baseband) blocks
+        :type       stream:     PcmStream
+        """
+        from .pcmstream import PcmStream
+
+        self.pcmlogsocket=socket(AF_INET, SOCK_STREAM)
+        self.pcmlogsocket.connect((self.ip, self.pcmlogport))
+        self.pcmlogsocket.settimeout(1)
+
+        # Set mode to either passband-0 or baseband-1
+        self.setValueI('RecordMode', bb)
+
+        def onClose():
+            self.metrics.sockets['pcmlog'].detach(source)
+            self.setValueI('RecordMode', 0)
 
+        stream = PcmStream(self.pcmlogsocket, bb, blockSize, maxBlocks, overflow, onClose=onClose)
+        source = self.metrics.sockets['pcmlog'].attach(
+            lambda: (stream.frames * PCM_FRAME_BYTES, stream.frames))
+        return stream.start()
 
-        print("Exiting PCM Loop")
-        self.pcmlogsocket.close()
-        fpout.close()
-        self.setValueI('RecordMode', 0)
-      
-    def streamUpload(self, filename, power):
+    def pcmPublish(self, name=None, bb=0, slots=1024, slotFrames=8):
+        """
+        pcmPublish publishes live passband/baseband pcm from the pcmlog port into a
+        shared memory ring, so any number of local processes can read the stream
+        with popoto.pcmshare.PcmSubscriber(name).  Subscribers read in place and
+        never hold up the socket; one that falls a ring behind gets a PcmOverrun.
+        Close the publisher to end the stream; RecordMode is set back to passband
+        on close.  Requires Python 3.8 or later.
+
+        :param      name:        The shared memory name, generated if None
+        :type       name:        string
+        :param      bb:          passband or baseband selection
+        :type       bb:          number 0/1 passband/baseband
+        :param      slots:       The number of slots in the ring
+        :type       slots:       integer
+        :param      slotFrames:  The frames per slot
+        :type       slotFrames:  integer
+        :returns    publisher:   The running publisher; its name attaches subscribers
+        :type       publisher:   PcmPublisher
+        """
+        from .pcmshare import PcmPublisher
+
+        self.pcmlogsocket=socket(AF_INET, SOCK_STREAM)
+        self.pcmlogsocket.connect((self.ip, self.pcmlogport))
+        self.pcmlogsocket.settimeout(1)
+
+        # Set mode to either passband-0 or baseband-1
+        self.setValueI('RecordMode', bb)
+
+        pcmsocket = self.pcmlogsocket
+
+        def onClose():
+            self.metrics.sockets['pcmlog'].detach(source)
+            pcmsocket.close()
+            self.setValueI('RecordMode', 0)
+
+        publisher = PcmPublisher(pcmsocket, bb, name, slots, slotFrames, onClose=onClose)
+        source = self.metrics.sockets['pcmlog'].attach(
+            lambda: (publisher.bytesReceived, publisher.bytesReceived // PCM_FRAME_BYTES))
+        return publisher.start()
+
+    def pcmDuplex(self, bb=0, ringSeconds=1.0, lead=0.05, loopback=False):
+        """
+        pcmDuplex opens the pcmio port for full duplex real time passband/baseband
+        pcm: samples written to the returned duplex are transmitted while received
+        samples are read from it.  Both directions go through lock free rings
+        serviced by their own threads, the transmit side paced to the sample rate
+        at most lead seconds ahead, so host side DSP can run in the loop with a
+        bounded buffering delay.  stats() reports the buffering delay, underruns
+        and overruns, and with loopback the round trip of frames from socket to
+        socket.  flush() the duplex at the end of each signal, so the silence that
+        follows is not counted as underruns.  Close the duplex to end it;
+        PlayMode and RecordMode are set back to passband on close.
+
+        :param      bb:           passband or baseband selection
+        :type       bb:           number 0/1 passband/baseband
+        :param      ringSeconds:  The seconds of signal each ring holds
+        :type       ringSeconds:  number
+        :param      lead:         The most seconds of signal sent ahead of real time
+        :type       lead:         number
+        :param      loopback:     The pcmio port echoes the transmitted frames, as on a
+                                  loopback test setup; measure their round trip
+        :type       loopback:     boolean
+        :returns    duplex:       The running duplex stream
+        :type       duplex:       PcmDuplex
+        :raises     IOError:      If the modem rejects the PCM mode
+        """
+        from .pcmio import PcmDuplex
+
+        pcmiosocket = socket(AF_INET, SOCK_STREAM)
+        pcmiosocket.connect((self.ip, self.pcmioport))
+        pcmiosocket.settimeout(1)
+        pcmiosocket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+
+        # Set mode to either passband-0 or baseband-1 in both directions
+        b = self.batch()
+        b.setValueI('PlayMode', bb)
+        b.setValueI('RecordMode', bb)
+        if not b.commit().ok():
+            pcmiosocket.close()
+            raise IOError('Setting the PCM mode failed for {}'.format(b.result.failed))
+
+        def onClose():
+            self.metrics.sockets['pcmio'].detach(source)
+            pcmiosocket.close()
+            b = self.batch()
+            b.setValueI('PlayMode', 0)
+            b.setValueI('RecordMode', 0)
+            if not b.commit().ok():
+                tracer.warning("Restoring passband PCM failed for {}", b.result.failed)
+
+        duplex = PcmDuplex(pcmiosocket, bb, ringSeconds, lead, loopback, onClose=onClose)
+        source = self.metrics.sockets['pcmio'].attach(
+            lambda: (duplex.bytesSent + duplex.bytesReceived, duplex.txFrames + duplex.rxFrames))
+        return duplex.start()
+
+    def streamUpload(self, filename, power, offset=0, chunkBytes=256, progress=None):
         """
         streamUpload Upload a file for acoustic transmission
+
+        The file is streamed in chunks of ConsolePacketBytes, so large payloads are
+        never held in memory.  If the upload is interrupted, the returned uploader's
+        position is the offset to resume from.
         
-        :param      filename:  The filename to be sent with path
-        :type       filename:  string
-        :param      power:     The desired power in watts
-        :type       power:     number
+        :param      filename:    The filename to be sent with path
+        :type       filename:    string
+        :param      power:       The desired power in watts
+        :type       power:       number
+        :param      offset:      The file offset to start (or resume) the upload from
+        :type       offset:      integer
+        :param      chunkBytes:  The ConsolePacketBytes setting and bytes per send
+        :type       chunkBytes:  integer
+        :param      progress:    Called as progress(sent, total, bytesPerSec) about once a second
+        :type       progress:    function
+        :returns    uploader:    The uploader, holding bytes sent, position and bytesPerSec
+        :type       uploader:    DataUploader
+        :raises     ValueError:  If offset is outside the file
         """
 
+        if os.path.isfile(filename) and os.access(filename, os.R_OK):
+            size = os.path.getsize(filename)
+            if offset < 0 or offset > size:
+                raise ValueError('Offset {} is outside {} of {} bytes'.format(offset, filename, size))
+            nbytes = size - offset
+            tracer.debug("File is {} bytes", nbytes)
+        else:
+            tracer.warning("Either the file is missing or not readable")
+            return
+
+        self.openDataSocket()
+
+        # All good with the file lets configure the modem in one transaction
+        b = self.batch()
+        b.setValueI('TCPecho',0)
+        b.setValueI('ConsolePacketBytes', chunkBytes)
+        b.setValueI('ConsoleTimeoutMS', 500)
+        b.setValueI('StreamingTxLen', nbytes)
+        b.setValueI('PayloadMode', 1)
+        b.setValueF('TxPowerWatts', power)
+        result = b.commit()
+        if not result.ok():
+            tracer.warning("Upload setup failed for {}", result.failed)
+            return
+
+        uploader = DataUploader(self.datasocket, chunkBytes, progress)
+        source = self.metrics.sockets['data'].attach(
+            lambda: (uploader.sent, uploader.sent // chunkBytes))
+        try:
+            uploader.upload(filename, offset, nbytes)
+        except socket_error as s_err:
+            self.metrics.countError('data_socket')
+            tracer.error("ERROR SENDING ON  DATA SOCKET at offset {}: {}", uploader.position, s_err)
+            return uploader
+        finally:
+            self.metrics.sockets['data'].detach(source)
+
+        tracer.info("Upload Complete: sent {} bytes at {:.0f} bytes/sec", uploader.sent, uploader.bytesPerSec)
+        return uploader
+
+    def openDataSocket(self):
+        """
+        Opens the data socket, shared by uploads and the data receiver, if it is
+        not open yet.
+        """
         if(self.datasocket == None):            
             self.datasocket=socket(AF_INET, SOCK_STREAM)
 
@@ -437,56 +1070,43 @@ class popoto:
             self.datasocket.settimeout(10)
             self.datasocket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
 
-            if(self.datasocket == None):
-                print("Unable to open data Socket")
-                return
-           
-        if os.path.isfile(filename) and os.access(filename, os.R_OK):
-            print("File exists and is readable")
-            nbytes = os.path.getsize(filename)
-            print("File is %d bytes" % nbytes )  
-        else:
-            print ("Either the file is missing or not readable")
-            return
-
-        # All good with the file lets upload
-        done = 0
-        while(done == 0):
-            try:
-                self.replyQ.get(False)
-            except:
-                done =1
-   
-        self.setValueI('TCPecho',0)
-        self.setValueI('ConsolePacketBytes', 256)
-        self.setValueI('ConsoleTimeoutMS', 500)
-        self.setValueI('StreamingTxLen', nbytes)
-        self.setValueI('PayloadMode', 1)
-     	self.setValueF('TxPowerWatts', power)
-   
-        done = 0
-        while(done == 0):
-            time.sleep(.1)
-            resp = self.replyQ.get()
-            print("Got a response")
-            print(resp)
-            if('PayloadMode' in resp['Info']):
-                done = 1
-   
-
-# Read each character and send it to the socket
-        sent=0
-        with open(filename) as f:
-            fileChars = f.read(nbytes)
-       
-            try:
-                count=self.datasocket.send(fileChars);
-            except:
-                print("ERROR SENDING ON  DATA SOCKET")
-            
-        print("Upload Complete")
-        print("Sent out %d",count)
-        f.close();
+    def startDataRx(self, callback=None, maxPayloads=64, overflow='drop_oldest',
+                    payloadGap=0.5, outDir=None):
+        """
+        startDataRx starts a background reader on the data socket that delivers
+        received acoustic payloads, with per packet arrival times, to a callback or
+        to the receiver's queue (read it with dataReceiver.read()).
+
+        :param      callback:     Called with each DataPayload on the receive thread
+        :type       callback:     function
+        :param      maxPayloads:  The capacity of the payload queue when no callback is given
+        :type       maxPayloads:  integer
+        :param      overflow:     'drop_oldest', 'drop_newest' or 'block' when the queue is full
+        :type       overflow:     string
+        :param      payloadGap:   The idle seconds on the data socket that end a payload
+        :type       payloadGap:   number
+        :param      outDir:       If set, each payload is also written to a file there
+        :type       outDir:       string
+        :returns    receiver:     The running receiver
+        :type       receiver:     DataReceiver
+        """
+        self.stopDataRx()
+        self.openDataSocket()
+        receiver = DataReceiver(self.datasocket, callback, maxPayloads, overflow,
+                                payloadGap, outDir=outDir)
+        self.dataRxSource = self.metrics.sockets['data'].attach(
+            lambda: (receiver.bytesReceived, receiver.payloads))
+        self.dataReceiver = receiver
+        return receiver.start()
+
+    def stopDataRx(self):
+        """
+        Stops the data socket reader started by startDataRx.
+        """
+        if self.dataReceiver is not None:
+            self.dataReceiver.stop()
+            self.metrics.sockets['data'].detach(self.dataRxSource)
+            self.dataReceiver = None
 
     def getParametersList(self):
         """
@@ -494,79 +1114,142 @@ class popoto:
         """
         return self.paramsList
 
-    def getParameter(self, idx):
+    def getParameter(self, idx, timeout=3):
         """
         Gets a Popoto control element info string by element index.
         
-        :param      idx:  The index is the reference number of the element
-        :type       idx:  number
+        :param      idx:      The index is the reference number of the element
+        :type       idx:      number
+        :param      timeout:  The timeout in seconds
+        :type       timeout:  number
+        :returns    reply:    The Element reply, None on timeout
+        :type       reply:    dictionary
+        """
+        pending = self.requestParameter(idx)
+        reply = pending.result(timeout)
+        if reply is None:
+            self.correlator.cancel(pending)
+        return reply
+
+    def requestParameter(self, idx):
+        """
+        Requests a Popoto control element info string without waiting for it.
+
+        :param      idx:      The index is the reference number of the element
+        :type       idx:      number
+        :returns    pending:  A handle whose result() blocks for the reply
+        :type       pending:  PendingReply
         """
-        self.send('GetParameters {}'.format(idx))        
+        return self.request('GetParameters {}'.format(idx))
  
-    def getAllParameters(self):
+    def getAllParameters(self, window=1):
         """
         Gets all Popoto control element info strings for all elements.
+
+        The elements form a chain linked by nextidx.  With a window larger than 1
+        the requests for the indices that follow are sent before their predecessors
+        have answered, so a run of consecutive elements costs one round trip per
+        window instead of one per element.  Requests sent past the end of the chain
+        are answered with an 'invalid index' Info, which is matched to them like an
+        Element reply, and replies to requests sent beyond a jump are discarded.
+
+        :param      window:    The number of GetParameters requests kept in flight
+        :type       window:    integer
+        :returns    complete:  True if the walk reached the element with nextidx -1
+        :type       complete:  boolean
         """
+        inflight = {}
+        nextSpec = 0
         idx = 0;
+        complete = False
         try:
             while idx >= 0:
-                self.getParameter(idx)
-                reply = self.replyQ.get(True, 3)    
-                if reply:    
-                    if "Element" in reply:
-                        El = reply['Element']
-                        if 'nextidx' in El:
-                            idx = int(El['nextidx'])
-                        if  int(El['nextidx'])  > 0:
-                            if (El['Format'] == 'int'):
-                                self.intParams[El['Name']] = El
-                            else:
-                                self.floatParams[El['Name']] = El
+                # Keep the window of requests following idx full
+                if idx not in inflight:
+                    inflight[idx] = self.requestParameter(idx)
+                nextSpec = max(nextSpec, idx + 1)
+                while nextSpec < idx + window:
+                    if nextSpec not in inflight:
+                        inflight[nextSpec] = self.requestParameter(nextSpec)
+                    nextSpec += 1
+
+                pending = inflight.pop(idx)
+                reply = pending.result(3)
+                if reply is None:
+                    self.correlator.cancel(pending)
+                    tracer.warning("GetParameter Timeout")
+                    break
+                El = reply.get('Element')
+                if El is None:
+                    tracer.warning("GetParameters {} failed: {}", idx, reply.get('Info'))
+                    break
+                idx = int(El.get('nextidx', -1))
+                if idx > 0:
+                    if (El['Format'] == 'int'):
+                        self.intParams[El['Name']] = El
+                    else:
+                        self.floatParams[El['Name']] = El
                     if El['Channel'] == 0:
-                        print('{}:{}:{}'.format(El['Name'], El['Format'], El['description']))
-                    #print(reply)
-                else:
-                    print("GetParameter Timeout")
-
-                    idx = -1
-        except Exception, a:
-            print(a)
-            return
+                        tracer.debug('{}:{}:{}', El['Name'], El['Format'], El['description'])
+            # A timeout or an error reply leaves idx at the element not read
+            complete = idx < 0
+        except Exception as a:
+            tracer.error("Parameter enumeration failed: {}", a)
+        finally:
+            # Every speculative request is answered, with an Element or an invalid
+            # index Info, in the round trip that answered the last one, so they
+            # are normally all done already.  Withdraw any that are not.
+            stale = list(inflight.values())
+            waitForReplies(stale, 0.5)
+            for pending in stale:
+                self.correlator.cancel(pending)
+        return complete
 # -------------------------------------------------------------------
 # Popoto Internal NON Public API commands are listed below this point
 # -------------------------------------------------------------------
     def RxCmdLoop(self):
-        errorcount = 0
-        rxString = ''
+        reader = CommandReader(self.cmdsocket)
         self.cmdsocket.settimeout(1)
         while(self.is_running ==True):
             try:
-                data = self.cmdsocket.recv(1)
-                if(len(data) >= 1):
-
-                    if ord(data)  != 13:
-                        rxString = rxString+str(data);
-                     
-                    else:
-                        
-                        idx = rxString.find("{")
-                        msgType = rxString[0:idx]
-                        msgType = msgType.strip();
-
-                        jsonData = rxString[idx:len(rxString)]
-                        try:
-                            reply = json.loads(jsonData)
-                            self.replyQ.put(reply)
-                        except:
-                            print("Unparseable JSON message " + jsonData)
-                        if(self.verbose > 1):
-                print("\033[1m"+str(jsonData)+"\033[0m")
-                        logging.info(str(jsonData))
-                        rxString = ''
-            
+                if reader.fill() == 0:
+                    # Peer closed the command socket
+                    break
+            except socket_timeout:
+                continue
             except socket_error  as s_err:
-                errorcount = errorcount +1 
-        print("exiting RxCmd")
+                self.errorcount += 1
+                self.metrics.countError('cmd_socket')
+                continue
+
+            # One level check per read, not per message
+            traceOn = tracer.enabled(TRACE)
+            for msgType, jsonData in reader.frames():
+                try:
+                    reply = json.loads(jsonData)
+                except ValueError:
+                    tracer.warning("Unparseable JSON message {}", jsonData)
+                    continue
+                self.handleReply(msgType, reply)
+                if traceOn:
+                    tracer.trace(TRACE, "{} {}", msgType, jsonData)
+        tracer.debug("exiting RxCmd")
+
+    def handleReply(self, msgType, reply):
+        """
+        Routes one decoded message from the command socket.
+
+        :param      msgType:  The message type prefix that preceded the JSON text
+        :type       msgType:  string
+        :param      reply:    The decoded JSON message
+        :type       reply:    dictionary
+        """
+        if self.correlator.match(msgType, reply):
+            return
+        if not self.dispatcher.dispatch(msgType, reply):
+            # A blocked command thread cannot match replies, so a full queue
+            # holds it only briefly before the message is dropped
+            self.replyQ.put(reply, True, self.replyBlockTimeout)
 
     def exit(self):
         print ("Stub for exit routine")
@@ -580,27 +1263,52 @@ class popoto:
     def setTimeout(self, timeout):
         self.cmdsocket.settimeout(timeout)
 
-    def getCycleCount(self):
-        while self.replyQ.empty() == False:
-            self.replyQ.get()
-
-        self.getValueI('APP_CycleCount')
-        reply = self.replyQ.get(True, 3)    
-        if reply:    
-            if "Application.0" in reply:
-                self.dispmips(reply)
-
-        else:
-            print("Get CycleCount Timeout")
-
+    def getCycleCount(self, display=True, timeout=3):
+        """
+        Reads the per module DSP cycle counts.
+
+        :param      display:  Print the MIPS table
+        :type       display:  boolean
+        :param      timeout:  The timeout in seconds
+        :type       timeout:  number
+        :returns    counts:   min, max, total and count cycles by module, None on timeout
+        :type       counts:   dictionary
+        """
+        counts = self.waitForValue(self.request('GetValue APP_CycleCount int  0', 'Application.0'),
+                                   timeout)
+        if counts is None:
+            tracer.warning("Get CycleCount Timeout")
+        elif display:
+            self.dispMips(counts)
+        return counts
+
+    def mipsProfiler(self, interval=1.0, history=3600, warnFraction=0.8, callback=None):
+        """
+        Starts a background profiler of the DSP load.  See MipsProfiler for the
+        series, summary and export of the samples; stop() it when done.
+
+        :param      interval:      The seconds between APP_CycleCount samples
+        :type       interval:      number
+        :param      history:       The number of samples kept per module
+        :type       history:       integer
+        :param      warnFraction:  The fraction of the 160 MHz budget at which a module
+                                   is flagged
+        :type       warnFraction:  number
+        :param      callback:      Called as callback(timestamp, module, peakMips) when a
+                                   module is flagged
+        :type       callback:      function
+        :returns    profiler:      The running profiler
+        :type       profiler:      MipsProfiler
+        """
+        return MipsProfiler(self, interval, history, warnFraction, callback).start()
 
     def dispMips(self, mips):
-        v = {};
         print('Name                            |       min  |        max |     total  |      count |    average |  peak mips | avg mips')
         for module in mips:
             v = mips[module]
             name = module 
-            print('{:<32}|{:12}|{:12}|{:12.1e}|{:12}|{:12.1f}|{:12.1f}|{:12.1f}'.format(name,v['min'],v['max'],v['total'], v['count'], v['total']/v['count'], v['max']*160/1e6, (160/1e6)*v['total']/v['count'] ))
+            minMips, avgMips, peakMips = moduleMips(v)
+            print('{:<32}|{:12}|{:12}|{:12.1e}|{:12}|{:12.1f}|{:12.1f}|{:12.1f}'.format(name,v['min'],v['max'],v['total'], v['count'], v['total']/max(v['count'], 1), peakMips, avgMips))
 
 
 
@@ -0,0 +1,287 @@
+"""
+Ranging campaigns: long series of pings with the results kept in columns.
+
+sendRange configures the transmitter and fires one ping, and its result
+turns up later in the replyQ among everything else.  RangingCampaign runs a
+whole schedule, count pings at each of a list of power levels, on a
+background thread:
+
+    The TxPowerWatts and CarrierTxMode settings are read once at the start
+    and a SetValue is only sent when a ping needs a different value, so a
+    run at one power level costs one command per ping.
+
+    The SetValues and Event_sendRanging of a ping go out in one write.  The
+    acknowledgements are checked once the ping's Range reply is in, by which
+    time they have normally arrived; those still missing at the ping's
+    timeout are withdrawn and counted as failed, and a failed setting is
+    sent again with the next ping.
+
+    The modem ranges one ping at a time, so each Range reply belongs to the
+    ping in flight.  The replies are taken by a subscription, not the replyQ,
+    and the next ping is sent as soon as the reply arrives, or interval
+    seconds after the previous ping if that is later.
+
+The results are NumPy columns, one row per ping, with NaN ranges for pings
+that got no reply within timeout.
+"""
+from __future__ import print_function
+import threading
+import time
+
+import numpy as np
+
+from .trace import tracer
+
+RANGE_KEY = 'Range'
+
+
+class RangingResults(object):
+    """
+    The columns of a campaign, one row per scheduled ping:
+
+        power       the TxPowerWatts of the ping
+        sentTime    the time the ping was sent, NaN if it was not
+        replyTime   the time the Range reply arrived, NaN if none did
+        range       the reported range in meters, NaN if no reply
+        soundSpeed  the reported sound speed in m/s, NaN if no reply
+    """
+    def __init__(self, powers):
+        count = len(powers)
+        self.power = np.asarray(powers, dtype=np.float64)
+        self.sentTime = np.full(count, np.nan)
+        self.replyTime = np.full(count, np.nan)
+        self.range = np.full(count, np.nan)
+        self.soundSpeed = np.full(count, np.nan, dtype=np.float32)
+        self.pings = 0
+
+    def __len__(self):
+        return self.pings
+
+    def roundTrip(self):
+        """
+        :returns    seconds:  The seconds from each ping to its reply, NaN if none
+        :type       seconds:  numpy.ndarray
+        """
+        return self.replyTime[:self.pings] - self.sentTime[:self.pings]
+
+    def columns(self):
+        """
+        :returns    columns:  The columns of the pings sent so far, by name
+        :type       columns:  dictionary of numpy.ndarray
+        """
+        n = self.pings
+        return {'power': self.power[:n], 'sentTime': self.sentTime[:n],
+                'replyTime': self.replyTime[:n], 'range': self.range[:n],
+                'soundSpeed': self.soundSpeed[:n], 'roundTrip': self.roundTrip()}
+
+    def summary(self):
+        """
+        :returns    summary:  Over all pings and per power level: pings, replies, the
+                              reply rate, and the mean, standard deviation, median, min
+                              and max range; overall also the mean round trip and the
+                              achieved ping rate
+        :type       summary:  dictionary
+        """
+        n = self.pings
+        summary = rangeStats(self.range[:n])
+        roundTrip = self.roundTrip()
+        answered = ~np.isnan(roundTrip)
+        summary['meanRoundTrip'] = float(roundTrip[answered].mean()) if answered.any() else None
+        sent = self.sentTime[:n]
+        summary['pingsPerSec'] = (n - 1) / float(sent[-1] - sent[0]) if n > 1 and sent[-1] > sent[0] else None
+        summary['byPower'] = {}
+        for power in np.unique(self.power[:n]):
+            summary['byPower'][float(power)] = rangeStats(self.range[:n][self.power[:n] == power])
+        return summary
+
+    def save(self, filename):
+        """
+        Writes the columns to a NumPy .npz file.
+        """
+        np.savez(filename, **self.columns())
+
+
+def rangeStats(ranges):
+    valid = ranges[~np.isnan(ranges)]
+    stats = {'pings': len(ranges), 'replies': len(valid),
+             'replyRate': len(valid) / float(len(ranges)) if len(ranges) else None}
+    if len(valid):
+        stats.update({'mean': float(valid.mean()), 'std': float(valid.std()),
+                      'median': float(np.median(valid)), 'min': float(valid.min()),
+                      'max': float(valid.max())})
+    return stats
+
+
+class RangingCampaign(object):
+    """
+    RangingCampaign pings through one modem on a background thread.
+    Nothing else should range or change TxPowerWatts or CarrierTxMode while
+    it runs, as it tracks their values itself.
+    """
+    def __init__(self, modem, count, interval=0.0, powers=(0.1,), timeout=10.0, carrierTxMode=0):
+        """
+        :param      modem:          The connected popoto instance
+        :type       modem:          popoto
+        :param      count:          The pings at each power level
+        :type       count:          integer
+        :param      interval:       The least seconds between pings; 0 pings as fast as the
+                                    replies come back
+        :type       interval:       number
+        :param      powers:         The power levels in watts, run in order
+        :type       powers:         list of numbers
+        :param      timeout:        The seconds to wait for a Range reply before moving on
+        :type       timeout:        number
+        :param      carrierTxMode:  The CarrierTxMode used for ranging
+        :type       carrierTxMode:  integer
+        """
+        self.modem = modem
+        self.interval = interval
+        self.timeout = timeout
+        self.carrierTxMode = carrierTxMode
+        self.results = RangingResults(np.repeat(np.asarray(powers, dtype=np.float64), count))
+        self.cond = threading.Condition()
+        self.inFlight = None
+        self.settings = {}
+        self.setValues = 0
+        self.skippedSetValues = 0
+        self.timeouts = 0
+        self.strayReplies = 0
+        self.failedSetValues = []
+        self.is_running = True
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="RangingCampaign")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Ends the campaign after the ping in flight.
+        """
+        with self.cond:
+            self.is_running = False
+            self.cond.notify()
+        self.join()
+
+    def join(self, timeout=None):
+        """
+        Waits for the campaign to end.
+
+        :returns    done:  True if the campaign has ended
+        :type       done:  boolean
+        """
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                return False
+            self.thread = None
+        return True
+
+    def run(self):
+        """
+        Runs the schedule.
+
+        :returns    results:  The results
+        :type       results:  RangingResults
+        """
+        subscription = self.modem.subscribe(RANGE_KEY, self.onRange)
+        try:
+            self.settings = self.modem.getValues(['TxPowerWatts', 'CarrierTxMode'], self.timeout)
+            nextPing = time.time()
+            for i in range(len(self.results.power)):
+                with self.cond:
+                    delay = nextPing - time.time()
+                    while self.is_running and delay > 0:
+                        self.cond.wait(delay)
+                        delay = nextPing - time.time()
+                    if not self.is_running:
+                        break
+                sent, acks = self.ping(i)
+                nextPing = sent + self.interval
+                deadline = sent + self.timeout
+                with self.cond:
+                    while self.inFlight == i and time.time() < deadline:
+                        self.cond.wait(deadline - time.time())
+                    if self.inFlight == i:
+                        self.inFlight = None
+                        self.timeouts += 1
+                        tracer.debug("Ranging ping {} got no reply", i)
+                self.checkAcks(acks, deadline)
+        finally:
+            subscription.unsubscribe()
+            self.is_running = False
+        return self.results
+
+    def ping(self, i):
+        power = float(self.results.power[i])
+        b = self.modem.batch()
+        self.setIfChanged(b.setValueF, 'TxPowerWatts', power)
+        self.setIfChanged(b.setValueI, 'CarrierTxMode', self.carrierTxMode)
+        b.command('Event_sendRanging')
+        with self.cond:
+            self.inFlight = i
+            sent = self.results.sentTime[i] = time.time()
+            self.results.pings = i + 1
+        return sent, b.flush()
+
+    def setIfChanged(self, setter, Element, value):
+        current = self.settings.get(Element)
+        # The modem holds floats in single precision
+        if current is not None and abs(current - value) <= 1e-6 * max(1.0, abs(value)):
+            self.skippedSetValues += 1
+            return
+        setter(Element, value)
+        self.settings[Element] = value
+        self.setValues += 1
+
+    def onRange(self, msgType, reply):
+        now = time.time()
+        with self.cond:
+            i = self.inFlight
+            if i is None:
+                # A late reply to a ping that already timed out
+                self.strayReplies += 1
+                return
+            self.inFlight = None
+            results = self.results
+            results.replyTime[i] = now
+            try:
+                results.range[i] = float(reply[RANGE_KEY])
+                results.soundSpeed[i] = float(reply.get('SoundSpeed', np.nan))
+            except (TypeError, ValueError):
+                tracer.warning("Unparseable ranging reply {}", reply)
+            self.cond.notify()
+
+    def checkAcks(self, result, deadline):
+        if not result.pendingList:
+            return
+        # Waits at most until the ping's deadline; the wait withdraws missing acks
+        result.wait(max(0.0, deadline - time.time()))
+        if result.failed:
+            self.failedSetValues.extend(result.failed)
+            tracer.warning("Ranging SetValues not acknowledged: {}", result.failed)
+            # The modem may not hold the value; the next ping sends it again
+            for Element in result.failed:
+                self.settings.pop(Element, None)
+
+    def stats(self):
+        """
+        :returns    stats:  Pings sent, timeouts, late replies, SetValues sent and
+                            skipped, and failed SetValues
+        :type       stats:  dictionary
+        """
+        return {'pings': self.results.pings, 'timeouts': self.timeouts,
+                'strayReplies': self.strayReplies, 'setValues': self.setValues,
+                'skippedSetValues': self.skippedSetValues,
+                'failedSetValues': list(self.failedSetValues)}
+
+    def summary(self):
+        """
+        :returns    summary:  RangingResults.summary() with the campaign stats
+        :type       summary:  dictionary
+        """
+        summary = self.results.summary()
+        summary.update(self.stats())
+        return summary
@@ -0,0 +1,86 @@
+"""
+On-disk cache of the Popoto control element schema.
+
+Enumerating the element list with GetParameters costs one round trip per
+element.  The schema only changes with the modem software, so it is cached
+per modem and reused as long as the modem reports the same GetVersion string.
+"""
+from __future__ import print_function
+import json
+import os
+import os.path
+import re
+
+from .trace import tracer
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.popoto', 'schema')
+
+
+class SchemaCache(object):
+    """
+    SchemaCache stores intParams/floatParams as one JSON file per modem
+    address, tagged with the version string they were read under.
+    """
+    def __init__(self, cacheDir=DEFAULT_CACHE_DIR):
+        """
+        :param      cacheDir:  The directory that holds the cache files
+        :type       cacheDir:  string
+        """
+        self.cacheDir = cacheDir
+
+    def path(self, ip, basePort):
+        """
+        :returns    path:  The cache file for the modem at ip:basePort
+        :type       path:  string
+        """
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', '{}_{}'.format(ip, basePort))
+        return os.path.join(self.cacheDir, name + '.json')
+
+    def load(self, ip, basePort, version):
+        """
+        Loads the cached schema if it was stored under the same version.
+
+        :param      ip:        The modem IP address
+        :type       ip:        string
+        :param      basePort:  The modem base port
+        :type       basePort:  integer
+        :param      version:   The GetVersion string reported by the modem
+        :type       version:   string
+        :returns    schema:    (intParams, floatParams), None on a cache miss
+        :type       schema:    tuple of dictionaries
+        """
+        try:
+            with open(self.path(ip, basePort)) as fp:
+                entry = json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+        if entry.get('version') != version:
+            return None
+        return entry['intParams'], entry['floatParams']
+
+    def store(self, ip, basePort, version, intParams, floatParams):
+        """
+        Writes the schema for a modem, replacing any older entry.
+        """
+        path = self.path(ip, basePort)
+        entry = {'version': version, 'intParams': intParams, 'floatParams': floatParams}
+        try:
+            if not os.path.isdir(self.cacheDir):
+                os.makedirs(self.cacheDir)
+            tmpPath = path + '.tmp'
+            with open(tmpPath, 'w') as fp:
+                json.dump(entry, fp)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmpPath, path)
+        except (IOError, OSError) as err:
+            tracer.warning('Unable to write schema cache {}: {}', path, err)
+
+    def invalidate(self, ip, basePort):
+        """
+        Removes the cached schema of a modem.
+        """
+        try:
+            os.remove(self.path(ip, basePort))
+        except OSError:
+            pass
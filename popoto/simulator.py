@@ -0,0 +1,503 @@
+"""
+A local simulator of the Popoto modem application.
+
+PopotoSimulator listens on basePort through basePort+3 and answers the way a
+modem does, so scripts, benchmarks and CI can exercise the API without
+hardware:
+
+    basePort    command port: CR terminated JSON replies and status for
+                GetParameters (nextidx chain), GetValue/SetValue, GetVersion,
+                GetRTC/SetRTC, TransmitJSON, Event_sendRanging and friends
+    basePort+1  data port: accepts uploads and forwards injected payloads
+    basePort+2  pcmlog port: streams synthetic 642 word frames at the passband
+                or baseband rate once RecordMode is set, or consumes frames at
+                that rate after StartNetPlay
+    basePort+3  pcmio port: a loopback channel that echoes what it receives
+
+usage:
+    sim = PopotoSimulator(basePort=0).start()
+    modem = popoto('127.0.0.1', sim.basePort, schemaCache=False)
+    ...
+    sim.stop()
+"""
+from __future__ import print_function
+import json
+import math
+import random
+import socket
+import struct
+import threading
+import time
+from array import array
+
+from .pcmformat import (PCMLOG_OFFSET, PCM_FRAME_BYTES, PCM_FRAME_SAMPLES, PCM_WORD_BYTES,
+                        floatsPerSecond)
+from .trace import tracer
+from .txqueue import TX_COMPLETE
+
+# The elements every simulated modem has, as (Name, Format, initial value)
+BASE_ELEMENTS = [
+    ('TxPowerWatts',       'float', 1.0),
+    ('CarrierTxMode',      'int',   0),
+    ('PayloadMode',        'int',   0),
+    ('RecordMode',         'int',   0),
+    ('PlayMode',           'int',   0),
+    ('TCPecho',            'int',   0),
+    ('ConsolePacketBytes', 'int',   256),
+    ('ConsoleTimeoutMS',   'int',   500),
+    ('StreamingTxLen',     'int',   0),
+    ('APP_CycleCount',     'int',   0),
+    ('RangeMeters',        'float', 1000.0),
+    ('SoundSpeed',         'float', 1500.0),
+]
+
+# The DSP modules reported by APP_CycleCount
+MIPS_MODULES = ('Modulator', 'Demodulator', 'Detector', 'AGC', 'DataLink', 'PcmLog')
+
+
+def findBasePort(ip='127.0.0.1'):
+    """
+    :returns    basePort:  A port such that basePort..basePort+3 are free
+    :type       basePort:  integer
+    """
+    for attempt in range(50):
+        probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        probe.bind((ip, 0))
+        basePort = probe.getsockname()[1]
+        probe.close()
+        if basePort + 3 > 65535:
+            continue
+        free = True
+        for port in range(basePort, basePort + 4):
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                s.bind((ip, port))
+            except socket.error:
+                free = False
+            finally:
+                s.close()
+        if free:
+            return basePort
+    raise RuntimeError('No free port range for the simulator')
+
+
+class PopotoSimulator(object):
+    """
+    PopotoSimulator serves any number of clients on each port, one thread
+    per connection.
+    """
+    def __init__(self, basePort=17000, ip='127.0.0.1', extraElements=200,
+                 version='PopotoSim 1.0', rateScale=1.0, replyDelay=0,
+                 txBitRate=5120):
+        """
+        :param      basePort:       The command port, 0 to pick a free range
+        :type       basePort:       integer
+        :param      ip:             The address to listen on
+        :type       ip:             string
+        :param      extraElements:  Filler elements added to the schema, to make
+                                    enumeration cost like a real modem's
+        :type       extraElements:  integer
+        :param      version:        The GetVersion string
+        :type       version:        string
+        :param      rateScale:      PCM rate multiplier; 1 is real time, 0 unpaced
+        :type       rateScale:      number
+        :param      replyDelay:     Seconds added before every command reply
+        :type       replyDelay:     number
+        :param      txBitRate:      The simulated acoustic bit rate that sets how long
+                                    a transmission takes
+        :type       txBitRate:      number
+        """
+        self.basePort = basePort
+        self.ip = ip
+        self.version = version
+        self.rateScale = rateScale
+        self.replyDelay = replyDelay
+        self.txBitRate = txBitRate
+        self.elements = []
+        self.values = {}
+        for name, fmt, value in BASE_ELEMENTS:
+            self.addElement(name, fmt, value)
+        for i in range(extraElements):
+            self.addElement('SimParam{:03d}'.format(i), 'int' if i % 2 else 'float', 0)
+        # The modem ends the chain with an element whose nextidx is -1
+        self.addElement('EndOfList', 'int', 0)
+
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.cmdClients = []
+        self.dataClients = []
+        self.pcmClients = []
+        # Set by a RecordMode that found no idle pcmlog client to start
+        self.recordArmed = False
+        self.is_running = False
+        self.playing = False
+        self.commands = 0
+        self.uploadBytes = 0
+        self.playedBytes = 0
+        self.recordedBytes = 0
+        self.transmissions = 0
+
+    def addElement(self, name, fmt, value, description=None, channel=0):
+        self.elements.append({'Name': name, 'Format': fmt, 'Channel': channel,
+                              'description': description or name})
+        self.values[name] = value
+
+    def start(self):
+        """
+        Opens the four listening ports and starts serving.
+
+        :returns    sim:  self, with basePort set to the actual command port
+        :type       sim:  PopotoSimulator
+        """
+        if not self.basePort:
+            self.basePort = findBasePort(self.ip)
+        self.is_running = True
+        handlers = (self.cmdClient, self.dataClient, self.pcmClient, self.pcmioClient)
+        for offset, handler in enumerate(handlers):
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind((self.ip, self.basePort + offset))
+            listener.listen(8)
+            listener.settimeout(0.2)
+            self.listeners.append(listener)
+            self.spawn(self.acceptLoop, listener, handler)
+        return self
+
+    def stop(self):
+        self.is_running = False
+        for listener in self.listeners:
+            listener.close()
+        self.listeners = []
+        with self.lock:
+            conns = ([c.conn for c in self.cmdClients] + list(self.dataClients) +
+                     [c.conn for c in self.pcmClients])
+        for conn in conns:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, excType, excValue, traceback):
+        self.stop()
+
+    def spawn(self, target, *args):
+        thread = threading.Thread(target=target, args=args, name='PopotoSim')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def acceptLoop(self, listener, handler):
+        while self.is_running:
+            try:
+                conn, addr = listener.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+            conn.settimeout(None)
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.spawn(self.serve, conn, handler)
+
+    def serve(self, conn, handler):
+        try:
+            handler(conn)
+        except socket.error as s_err:
+            tracer.debug("Simulator connection closed: {}", s_err)
+        finally:
+            conn.close()
+
+    # ---------------------------------------------------------------
+    # Command port
+    # ---------------------------------------------------------------
+    def cmdClient(self, conn):
+        client = CmdClient(conn)
+        with self.lock:
+            self.cmdClients.append(client)
+        try:
+            pending = b''
+            while self.is_running:
+                data = conn.recv(65536)
+                if not data:
+                    break
+                pending += data
+                lines = pending.split(b'\n')
+                pending = lines.pop()
+                out = []
+                for line in lines:
+                    if line.strip():
+                        out.extend(self.command(client, line))
+                if out:
+                    if self.replyDelay:
+                        time.sleep(self.replyDelay)
+                    client.send(out)
+        finally:
+            with self.lock:
+                self.cmdClients.remove(client)
+
+    def command(self, client, line):
+        """
+        :returns    replies:  The (msgType, message) replies to one command line
+        :type       replies:  list
+        """
+        self.commands += 1
+        try:
+            msg = json.loads(line.decode('utf-8'))
+            command = msg['Command']
+            arguments = msg.get('Arguments', '')
+        except (ValueError, KeyError):
+            return [('Info', {'Info': 'Invalid command'})]
+        args = arguments.split() if hasattr(arguments, 'split') else []
+
+        if command == 'GetParameters':
+            idx = int(args[0]) if args else 0
+            if not 0 <= idx < len(self.elements):
+                return [('Info', {'Info': 'GetParameters invalid index {}'.format(idx)})]
+            El = dict(self.elements[idx])
+            El['nextidx'] = idx + 1 if idx + 1 < len(self.elements) else -1
+            return [('Element', {'Element': El})]
+        if command == 'GetValue':
+            name = args[0] if args else ''
+            if name == 'APP_CycleCount':
+                return [('Application', {'Application.0': self.cycleCounts()})]
+            if name not in self.values:
+                return [('Info', {'Info': 'GetValue invalid element {}'.format(name)})]
+            return [('Response', {name: self.values[name]})]
+        if command == 'SetValue':
+            if len(args) < 3 or args[0] not in self.values:
+                return [('Info', {'Info': 'SetValue invalid element {}'.format(
+                    args[0] if args else '')})]
+            name, fmt, value = args[0], args[1], args[2]
+            try:
+                self.values[name] = int(value) if fmt == 'int' else float(value)
+            except ValueError:
+                return [('Info', {'Info': 'SetValue {} invalid value {}'.format(name, value)})]
+            if name == 'RecordMode':
+                with self.lock:
+                    idle = [pcm for pcm in self.pcmClients if not pcm.record]
+                    for pcm in idle:
+                        pcm.record = True
+                    # The client may connect before its accept is handled
+                    self.recordArmed = not idle
+            return [('Info', {'Info': 'SetValue {} = {}'.format(name, value)})]
+        if command == 'GetVersion':
+            return [('Info', {'Version': self.version})]
+        if command == 'GetRTC':
+            return [('Info', {'RTC': time.strftime('%Y.%m.%d-%H:%M:%S')})]
+        if command == 'SetRTC':
+            return [('Info', {'Info': 'SetRTC {}'.format(arguments)})]
+        if command == 'TransmitJSON':
+            self.transmit(client, len(json.dumps(arguments)))
+            return [('Info', {'Info': 'TransmitJSON queued'})]
+        if command in ('Event_sendRanging', 'Event_sendRange'):
+            self.transmit(client, 32, {'Range': self.values['RangeMeters'],
+                                       'SoundSpeed': self.values['SoundSpeed']})
+            return [('Info', {'Info': 'Ranging'})]
+        if command == 'Event_StartRx':
+            return [('Info', {'Info': 'Receive Mode'})]
+        if command == 'StartNetPlay':
+            self.playing = True
+            return [('Info', {'Info': 'StartNetPlay'})]
+        if command == 'Event_playPcmQueueEmpty':
+            self.playing = False
+            return [('Info', {'Info': 'Play Complete'})]
+        if command.startswith('Event_') or command in ('StartRecording', 'StopRecording',
+                                                        'StartPlaying', 'StopPlaying'):
+            return [('Info', {'Info': command})]
+        return [('Info', {'Info': 'Unknown command {}'.format(command)})]
+
+    def transmit(self, client, nbytes, result=None):
+        """
+        Reports TX_COMPLETE, and then result if given, once nbytes have been
+        sent at txBitRate.
+        """
+        self.transmissions += 1
+        delay = nbytes * 8.0 / self.txBitRate
+        out = [('Info', {'Info': TX_COMPLETE})]
+        if result is not None:
+            out.append(('Info', result))
+        timer = threading.Timer(delay, self.sendQuietly, (client, out))
+        timer.daemon = True
+        timer.start()
+
+    def sendQuietly(self, client, out):
+        try:
+            client.send(out)
+        except socket.error:
+            pass
+
+    def broadcast(self, msgType, message):
+        """
+        Sends an unsolicited status message to every command client.
+        """
+        with self.lock:
+            clients = list(self.cmdClients)
+        for client in clients:
+            self.sendQuietly(client, [(msgType, message)])
+
+    def cycleCounts(self):
+        # Busier DSP while PCM is flowing, so load follows traffic
+        load = 1.0 + 0.5 * bool(self.playing) + 0.5 * bool(self.recordedBytes)
+        counts = {}
+        for i, module in enumerate(MIPS_MODULES):
+            base = (i + 1) * 40000 * load
+            count = random.randint(100, 200)
+            low = int(base * 0.5)
+            high = int(base * random.uniform(1.0, 1.6))
+            counts[module] = {'min': low, 'max': high, 'count': count,
+                              'total': int(count * (low + high) / 2)}
+        return counts
+
+    # ---------------------------------------------------------------
+    # Data port
+    # ---------------------------------------------------------------
+    def dataClient(self, conn):
+        with self.lock:
+            self.dataClients.append(conn)
+        buf = bytearray(65536)
+        received = 0
+        try:
+            while self.is_running:
+                count = conn.recv_into(buf)
+                if not count:
+                    break
+                self.uploadBytes += count
+                received += count
+                expected = self.values['StreamingTxLen']
+                if expected and received >= expected:
+                    received -= expected
+                    self.broadcast('Info', {'Info': TX_COMPLETE})
+        finally:
+            with self.lock:
+                self.dataClients.remove(conn)
+
+    def injectPayload(self, data):
+        """
+        Delivers data to every data port client, as a received acoustic payload.
+        """
+        with self.lock:
+            clients = list(self.dataClients)
+        for conn in clients:
+            try:
+                conn.sendall(data)
+            except socket.error:
+                pass
+
+    # ---------------------------------------------------------------
+    # PCM ports
+    # ---------------------------------------------------------------
+    def pcmClient(self, conn):
+        client = PcmClient(conn)
+        with self.lock:
+            client.record = self.recordArmed
+            self.recordArmed = False
+            self.pcmClients.append(client)
+        try:
+            while self.is_running:
+                if self.playing:
+                    self.consumePcm(client)
+                elif client.record:
+                    self.streamPcm(client)
+                else:
+                    time.sleep(0.005)
+        finally:
+            with self.lock:
+                self.pcmClients.remove(client)
+
+    def framePeriod(self, bb):
+        if not self.rateScale:
+            return 0
+        return PCM_FRAME_SAMPLES / float(floatsPerSecond(bb)) / self.rateScale
+
+    def streamPcm(self, client):
+        bb = self.values['RecordMode']
+        frame = syntheticFrame(bb)
+        period = self.framePeriod(bb)
+        start = time.time()
+        sent = 0
+        while self.is_running and not self.playing and bb == self.values['RecordMode']:
+            due = start + sent * period
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            struct.pack_into('<II', frame, 0, client.counter & 0xffffffff, 1)
+            client.conn.sendall(frame)
+            client.counter += 1
+            sent += 1
+            self.recordedBytes += PCM_FRAME_BYTES
+
+    def consumePcm(self, client):
+        bb = self.values['PlayMode']
+        period = self.framePeriod(bb)
+        buf = bytearray(8 * PCM_FRAME_BYTES)
+        client.conn.settimeout(0.1)
+        start = time.time()
+        played = 0
+        while self.is_running and self.playing:
+            try:
+                count = client.conn.recv_into(buf)
+            except socket.timeout:
+                continue
+            if not count:
+                raise socket.error('pcmlog client closed')
+            played += count
+            self.playedBytes += count
+            # Accept frames no faster than they would be played out
+            due = start + (played // PCM_FRAME_BYTES) * period
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+    def pcmioClient(self, conn):
+        buf = bytearray(65536)
+        view = memoryview(buf)
+        while self.is_running:
+            count = conn.recv_into(buf)
+            if not count:
+                break
+            conn.sendall(view[:count])
+
+
+class CmdClient(object):
+    """
+    A command port connection; replies and status are written under a lock
+    so they never interleave.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.lock = threading.Lock()
+
+    def send(self, out):
+        data = ''.join('{} {}\r'.format(msgType, json.dumps(message))
+                       for msgType, message in out)
+        with self.lock:
+            self.conn.sendall(data.encode('utf-8'))
+
+
+class PcmClient(object):
+    """
+    A pcmlog port connection.  It starts streaming once RecordMode is set
+    while it is open, or if RecordMode was set just before its accept was
+    handled.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.record = False
+        self.counter = 0
+
+
+def syntheticFrame(bb, tone=0.05):
+    """
+    :returns    frame:  One pcmlog frame of a test tone, header words zeroed
+    :type       frame:  bytearray
+    """
+    samples = array('f', [0.0] * PCM_FRAME_SAMPLES)
+    for i in range(PCM_FRAME_SAMPLES):
+        samples[i] = 0.5 * math.sin(2 * math.pi * tone * i)
+    try:
+        raw = samples.tobytes()
+    except AttributeError:
+        raw = samples.tostring()
+    return bytearray(PCMLOG_OFFSET * PCM_WORD_BYTES) + bytearray(raw)
@@ -0,0 +1,188 @@
+"""
+Level gated diagnostics for the Popoto API.
+
+All modules of the package report through the 'popoto' logger via the
+module level tracer.  A call whose level is disabled costs one level check;
+the message is only formatted, with str.format, when a handler actually
+emits it.  The busiest paths use the TRACE level, below DEBUG, and test
+enabled() once per batch of messages rather than once per message.
+
+startAsyncLogging() moves the handlers onto a background thread behind a
+bounded queue, so diagnostics never hold up the threads reading the modem
+sockets; when the queue is full records are dropped and counted.
+
+usage:
+    from popoto import trace
+    trace.setTraceLevel(trace.TRACE)
+    sink = trace.startAsyncLogging([logging.FileHandler('popoto.log')])
+    ...
+    trace.stopAsyncLogging(sink)
+"""
+from __future__ import print_function
+import logging
+import threading
+
+from .boundedqueue import BoundedQueue, DROP_NEWEST
+
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+# Every message on the command socket is traced at this level
+TRACE = 5
+logging.addLevelName(TRACE, 'TRACE')
+
+
+class LazyFormat(object):
+    """
+    A message whose str.format is deferred until it is rendered.
+    """
+    __slots__ = ('fmt', 'args')
+
+    def __init__(self, fmt, args):
+        self.fmt = fmt
+        self.args = args
+
+    def __str__(self):
+        if not self.args:
+            return self.fmt
+        return self.fmt.format(*self.args)
+
+
+class Tracer(object):
+    """
+    Tracer wraps a logger with str.format style calls whose formatting is
+    deferred.
+    """
+    def __init__(self, name='popoto'):
+        """
+        :param      name:  The logger name
+        :type       name:  string
+        """
+        self.logger = logging.getLogger(name)
+
+    def enabled(self, level):
+        """
+        :returns    enabled:  True if a message at level would be handled
+        :type       enabled:  boolean
+        """
+        return self.logger.isEnabledFor(level)
+
+    def trace(self, level, fmt, *args):
+        """
+        Logs fmt.format(*args) at level.  Nothing is formatted if the level is off.
+        """
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, LazyFormat(fmt, args))
+
+    def debug(self, fmt, *args):
+        self.trace(logging.DEBUG, fmt, *args)
+
+    def info(self, fmt, *args):
+        self.trace(logging.INFO, fmt, *args)
+
+    def warning(self, fmt, *args):
+        self.trace(logging.WARNING, fmt, *args)
+
+    def error(self, fmt, *args):
+        self.trace(logging.ERROR, fmt, *args)
+
+
+tracer = Tracer()
+
+
+def setTraceLevel(level):
+    """
+    Sets the level of the 'popoto' logger, e.g. TRACE to see every message
+    received from the modem, or logging.WARNING for problems only.
+    """
+    tracer.logger.setLevel(level)
+
+
+class AsyncLogSink(logging.Handler):
+    """
+    AsyncLogSink is a logging handler that queues records and passes them to
+    the real handlers on its own thread.  Records are queued unformatted and
+    the producer never waits; a full queue drops the new record.
+    """
+    def __init__(self, handlers, maxsize=10000):
+        """
+        :param      handlers:  The handlers that write the records
+        :type       handlers:  list of logging.Handler
+        :param      maxsize:   The capacity of the record queue
+        :type       maxsize:   integer
+        """
+        logging.Handler.__init__(self)
+        self.handlers = list(handlers)
+        self.queue = BoundedQueue(maxsize, DROP_NEWEST)
+        self.is_running = True
+        self.thread = threading.Thread(target=self.run, name="LogSink")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def emit(self, record):
+        self.queue.put(record, False)
+
+    def run(self):
+        while self.is_running or not self.queue.empty():
+            try:
+                record = self.queue.get(True, 0.2)
+            except Queue.Empty:
+                continue
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def stats(self):
+        """
+        :returns    stats:  The record queue depth, peakDepth, putCount and dropped counters
+        :type       stats:  dictionary
+        """
+        return self.queue.stats()
+
+    def close(self):
+        """
+        Writes out the queued records and stops the sink thread.
+        """
+        self.is_running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for handler in self.handlers:
+            handler.flush()
+        logging.Handler.close(self)
+
+
+def startAsyncLogging(handlers=None, maxsize=10000, level=None):
+    """
+    Routes the 'popoto' logger through an AsyncLogSink.  The logger stops
+    propagating to the root logger, whose handlers would otherwise run on the
+    calling thread.
+
+    :param      handlers:  The handlers to write to, a stderr StreamHandler if None
+    :type       handlers:  list of logging.Handler
+    :param      maxsize:   The capacity of the record queue
+    :type       maxsize:   integer
+    :param      level:     If set, the new level of the 'popoto' logger
+    :type       level:     integer
+    :returns    sink:      The sink; pass it to stopAsyncLogging
+    :type       sink:      AsyncLogSink
+    """
+    if handlers is None:
+        handlers = [logging.StreamHandler()]
+    sink = AsyncLogSink(handlers, maxsize)
+    if level is not None:
+        setTraceLevel(level)
+    tracer.logger.addHandler(sink)
+    tracer.logger.propagate = False
+    return sink
+
+
+def stopAsyncLogging(sink):
+    """
+    Detaches the sink, flushes its queued records and restores propagation.
+    """
+    tracer.logger.removeHandler(sink)
+    tracer.logger.propagate = True
+    sink.close()
@@ -0,0 +1,385 @@
+"""
+A transmit scheduler for acoustic messages.
+
+The acoustic channel carries a few hundred bytes a second, far less than
+producers on the host can emit, and the modem transmits one payload at a
+time.  TransmitScheduler queues messages by priority and keeps exactly one
+transmission outstanding: the next payload goes out when the modem reports
+the previous one complete with an Info TX_COMPLETE message.  The channel
+therefore sets the pace, and the queue, not the modem, absorbs the bursts.
+
+Small JSON messages that are coalescible are packed into one payload, a
+JSON array of the messages, of at most maxPayload bytes.  A payload waits up
+to coalesceWindow seconds from its oldest message for companions, unless it
+is already full.  Receivers of coalesced payloads must accept an array.
+
+Each message gets a TxTicket holding its submit, send and completion times.
+The scheduler keeps queueing delay histograms per priority and an estimate
+of the effective acoustic bit rate from the send to completion times, which
+also sets how long to wait for a TX_COMPLETE that never comes.
+"""
+from __future__ import print_function
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+
+from .metrics import LatencyHistogram
+from .trace import tracer
+
+# The Info text the modem sends when a transmission has left the modem
+TX_COMPLETE = 'TxComplete'
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Upper bounds in seconds of the queueing delay histogram buckets
+QUEUE_DELAY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+QUEUED = 'queued'
+SENT = 'sent'
+DELIVERED = 'delivered'
+TIMEOUT = 'timeout'
+FAILED = 'failed'
+EXPIRED = 'expired'
+
+
+class TxTicket(object):
+    """
+    The delivery record of one submitted message or file.  submitted, sent
+    and completed are time.time() stamps; sent and completed stay None until
+    they happen.
+    """
+    def __init__(self, payload, priority, coalesce, ttl, filename=None, power=None):
+        self.payload = payload
+        self.size = os.path.getsize(filename) if filename else len(payload)
+        self.priority = priority
+        self.coalesce = coalesce
+        self.filename = filename
+        self.power = power
+        self.submitted = time.time()
+        self.expires = None if ttl is None else self.submitted + ttl
+        self.sent = None
+        self.completed = None
+        self.state = QUEUED
+        self.batchSize = 0
+        self.done = threading.Event()
+
+    def queueDelay(self):
+        """
+        :returns    delay:  The seconds from submit to send, None if not sent
+        :type       delay:  number
+        """
+        return None if self.sent is None else self.sent - self.submitted
+
+    def txTime(self):
+        """
+        :returns    seconds:  The seconds from send to TX_COMPLETE, None if not delivered
+        :type       seconds:  number
+        """
+        return None if self.completed is None else self.completed - self.sent
+
+    def wait(self, timeout=None):
+        """
+        Waits until the message is delivered, timed out, failed or expired.
+
+        :returns    state:  The final state, None on timeout
+        :type       state:  string
+        """
+        if not self.done.wait(timeout):
+            return None
+        return self.state
+
+    def finish(self, state, when=None):
+        self.state = state
+        self.completed = when
+        self.done.set()
+
+
+class TransmitScheduler(object):
+    """
+    TransmitScheduler sends queued messages through one modem, one payload
+    at a time, paced by the modem's TX_COMPLETE events.
+    """
+    def __init__(self, modem, maxPayload=256, coalesceWindow=0.05, bitRate=None,
+                 txTimeoutFactor=3.0, minTxTimeout=2.0):
+        """
+        :param      modem:            The connected popoto instance
+        :type       modem:            popoto
+        :param      maxPayload:       The largest coalesced payload in bytes
+        :type       maxPayload:       integer
+        :param      coalesceWindow:   The seconds a payload waits for more messages
+        :type       coalesceWindow:   number
+        :param      bitRate:          The initial effective bit rate estimate; None learns it
+                                      from the first transmissions
+        :type       bitRate:          number
+        :param      txTimeoutFactor:  The multiple of the expected transmit time after which
+                                      a missing TX_COMPLETE frees the channel
+        :type       txTimeoutFactor:  number
+        :param      minTxTimeout:     The shortest wait for TX_COMPLETE in seconds
+        :type       minTxTimeout:     number
+        """
+        self.modem = modem
+        self.maxPayload = maxPayload
+        self.coalesceWindow = coalesceWindow
+        self.bitRate = bitRate
+        self.txTimeoutFactor = txTimeoutFactor
+        self.minTxTimeout = minTxTimeout
+        self.cond = threading.Condition()
+        self.heap = []
+        self.order = itertools.count()
+        self.inFlight = None
+        self.deadline = None
+        self.queuedBytes = 0
+        self.ttlQueued = 0
+        self.nextExpiry = float('inf')
+        self.peakDepth = 0
+        self.delays = {}
+        self.counts = {'submitted': 0, 'payloads': 0, 'coalesced': 0, 'delivered': 0,
+                       'timeouts': 0, 'failed': 0, 'expired': 0, 'strayCompletes': 0}
+        self.subscription = None
+        self.is_running = False
+        self.thread = None
+
+    def start(self):
+        self.subscription = self.modem.subscribe('Info', self.onInfo, consume=False)
+        self.is_running = True
+        self.thread = threading.Thread(target=self.run, name="TransmitScheduler")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def close(self):
+        """
+        Stops sending.  Messages still queued are left in the QUEUED state.
+        """
+        with self.cond:
+            self.is_running = False
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.subscription is not None:
+            self.subscription.unsubscribe()
+            self.subscription = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def submit(self, message, priority=PRIORITY_NORMAL, coalesce=True, ttl=None):
+        """
+        Queues a JSON message for transmission.
+
+        :param      message:   The message, encoded once here if not already JSON text
+        :type       message:   dictionary, list or string
+        :param      priority:  PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW; lower
+                               numbers are sent first
+        :type       priority:  integer
+        :param      coalesce:  Allow the message to share a payload with others
+        :type       coalesce:  boolean
+        :param      ttl:       Drop the message if it has not been sent after ttl seconds
+        :type       ttl:       number
+        :returns    ticket:    The delivery record
+        :type       ticket:    TxTicket
+        :raises     ValueError: If a string message is not valid JSON
+        """
+        if isinstance(message, (dict, list)):
+            payload = json.dumps(message, separators=(',', ':'))
+        else:
+            json.loads(message)
+            payload = message
+        return self.enqueue(TxTicket(payload, priority, coalesce, ttl))
+
+    def submitFile(self, filename, power, priority=PRIORITY_NORMAL, ttl=None):
+        """
+        Queues a file to be sent with streamUpload when the channel is free.
+
+        :param      filename:  The filename to be sent with path
+        :type       filename:  string
+        :param      power:     The desired power in watts
+        :type       power:     number
+        :returns    ticket:    The delivery record
+        :type       ticket:    TxTicket
+        """
+        return self.enqueue(TxTicket(None, priority, False, ttl, filename, power))
+
+    def enqueue(self, ticket):
+        with self.cond:
+            heapq.heappush(self.heap, (ticket.priority, next(self.order), ticket))
+            self.counts['submitted'] += 1
+            self.queuedBytes += ticket.size
+            if ticket.expires is not None:
+                self.ttlQueued += 1
+                self.nextExpiry = min(self.nextExpiry, ticket.expires)
+            self.peakDepth = max(self.peakDepth, len(self.heap))
+            self.cond.notify()
+        return ticket
+
+    def onInfo(self, msgType, reply):
+        if reply.get('Info') != TX_COMPLETE:
+            return
+        now = time.time()
+        with self.cond:
+            batch = self.inFlight
+            if batch is None:
+                # A transmission the scheduler did not send
+                self.counts['strayCompletes'] += 1
+                return
+            self.inFlight = None
+            self.deadline = None
+            self.counts['delivered'] += len(batch)
+            sent = batch[0].sent
+            nbytes = sum(t.size for t in batch) + (len(batch) + 1 if len(batch) > 1 else 0)
+            if now > sent:
+                rate = nbytes * 8.0 / (now - sent)
+                self.bitRate = rate if self.bitRate is None else 0.8 * self.bitRate + 0.2 * rate
+            self.cond.notify()
+        for ticket in batch:
+            ticket.finish(DELIVERED, now)
+
+    def run(self):
+        with self.cond:
+            while self.is_running:
+                now = time.time()
+                if self.inFlight is not None:
+                    if now < self.deadline:
+                        self.cond.wait(self.deadline - now)
+                        continue
+                    self.txTimedOut()
+                    continue
+                self.expire(now)
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+                head = self.heap[0][2]
+                if head.coalesce and self.queuedBytes < self.maxPayload:
+                    ready = head.submitted + self.coalesceWindow
+                    if now < ready:
+                        self.cond.wait(ready - now)
+                        continue
+                batch = self.takeBatch()
+                self.inFlight = batch
+                self.deadline = float('inf')
+                self.cond.release()
+                try:
+                    self.sendBatch(batch)
+                finally:
+                    self.cond.acquire()
+
+    def expire(self, now):
+        if not self.ttlQueued or now < self.nextExpiry:
+            return
+        kept = []
+        self.nextExpiry = float('inf')
+        for entry in self.heap:
+            ticket = entry[2]
+            if ticket.expires is not None and ticket.expires <= now:
+                self.queuedBytes -= ticket.size
+                self.ttlQueued -= 1
+                self.counts['expired'] += 1
+                ticket.finish(EXPIRED)
+            else:
+                if ticket.expires is not None:
+                    self.nextExpiry = min(self.nextExpiry, ticket.expires)
+                kept.append(entry)
+        heapq.heapify(kept)
+        self.heap = kept
+
+    def takeBatch(self):
+        """
+        Pops the next payload: the head message, plus while it is coalescible,
+        the following coalescible messages that fit in maxPayload.
+        """
+        head = self.pop()
+        batch = [head]
+        if not head.coalesce:
+            return batch
+        # The array brackets and separators
+        size = head.size + 2
+        while self.heap:
+            ticket = self.heap[0][2]
+            if not ticket.coalesce or size + ticket.size + 1 > self.maxPayload:
+                break
+            self.pop()
+            size += ticket.size + 1
+            batch.append(ticket)
+        return batch
+
+    def pop(self):
+        ticket = heapq.heappop(self.heap)[2]
+        self.queuedBytes -= ticket.size
+        if ticket.expires is not None:
+            self.ttlQueued -= 1
+        return ticket
+
+    def sendBatch(self, batch):
+        now = time.time()
+        for ticket in batch:
+            ticket.sent = now
+            ticket.state = SENT
+            ticket.batchSize = len(batch)
+            histogram = self.delays.get(ticket.priority)
+            if histogram is None:
+                histogram = self.delays[ticket.priority] = LatencyHistogram(QUEUE_DELAY_BUCKETS)
+            histogram.observe(now - ticket.submitted)
+        head = batch[0]
+        if head.filename is not None:
+            uploader = self.modem.streamUpload(head.filename, head.power)
+            ok = uploader is not None and uploader.sent == head.size
+        elif len(batch) == 1:
+            ok = self.modem.transmitJSON(head.payload, validate=False)
+        else:
+            payload = '[' + ','.join(t.payload for t in batch) + ']'
+            ok = self.modem.transmitJSON(payload, validate=False)
+        with self.cond:
+            self.counts['payloads'] += 1
+            if len(batch) > 1:
+                self.counts['coalesced'] += len(batch)
+            if not ok:
+                self.counts['failed'] += len(batch)
+                self.inFlight = None
+                self.deadline = None
+                for ticket in batch:
+                    ticket.finish(FAILED)
+            elif self.inFlight is batch:
+                nbytes = sum(t.size for t in batch)
+                self.deadline = time.time() + max(self.minTxTimeout,
+                                                  self.txTimeoutFactor * self.expectedTxTime(nbytes))
+
+    def expectedTxTime(self, nbytes):
+        if not self.bitRate:
+            return 0.0
+        return nbytes * 8.0 / self.bitRate
+
+    def txTimedOut(self):
+        batch = self.inFlight
+        self.inFlight = None
+        self.deadline = None
+        self.counts['timeouts'] += len(batch)
+        tracer.warning("No {} for a {} message payload; freeing the channel",
+                       TX_COMPLETE, len(batch))
+        for ticket in batch:
+            ticket.finish(TIMEOUT)
+
+    def stats(self):
+        """
+        :returns    stats:  Queue depth and peak, message and payload counts, the
+                            effective bit rate estimate and queueing delay histograms
+                            per priority.  depth, peakDepth and dropped (expired
+                            messages) let ClientMetrics.watchQueue export it.
+        :type       stats:  dictionary
+        """
+        with self.cond:
+            stats = dict(self.counts)
+            stats.update({'depth': len(self.heap), 'peakDepth': self.peakDepth,
+                          'dropped': self.counts['expired'], 'queuedBytes': self.queuedBytes,
+                          'busy': self.inFlight is not None, 'bitRate': self.bitRate})
+            stats['queueDelay'] = dict((priority, h.snapshot())
+                                       for priority, h in self.delays.items())
+        return stats
@@ -0,0 +1,36 @@
+import time
+
+import pytest
+
+from popoto.popoto import popoto
+from popoto.simulator import PopotoSimulator
+
+
+@pytest.fixture
+def sim():
+    simulator = PopotoSimulator(basePort=0, extraElements=40)
+    simulator.start()
+    yield simulator
+    simulator.stop()
+
+
+@pytest.fixture
+def modem(sim):
+    p = popoto('localhost', sim.basePort, schemaCache=False)
+    yield p
+    p.is_running = False
+    p.close()
+
+
+@pytest.fixture
+def until():
+    """
+    Polls a condition, e.g. a simulator value set by a command that is not
+    acknowledged, until it holds or the timeout expires.
+    """
+    def wait(condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.005)
+        return condition()
+    return wait
@@ -0,0 +1,132 @@
+import asyncio
+
+import numpy as np
+
+from popoto.aiopopoto import AsyncPopoto
+from popoto.pcmformat import PCM_FRAME_BYTES, PCM_FRAME_SAMPLES
+
+
+def run(sim, body, **kwargs):
+    """
+    Connects an AsyncPopoto to the simulator, runs body(modem) and closes it.
+    """
+    async def main():
+        modem = AsyncPopoto('localhost', sim.basePort, schemaCache=False, **kwargs)
+        await modem.connect()
+        try:
+            return await body(modem)
+        finally:
+            await modem.close()
+    return asyncio.run(main())
+
+
+def test_connect_loads_the_parameters(sim):
+    async def body(modem):
+        return modem.intParams, modem.floatParams, await modem.getVersion()
+    intParams, floatParams, version = run(sim, body, paramWindow=8)
+    names = set(intParams) | set(floatParams)
+    assert names == set(El['Name'] for El in sim.elements[:-1])
+    assert 'TxPowerWatts' in floatParams
+    assert version == sim.version
+
+
+def test_get_and_set_values(sim):
+    async def body(modem):
+        failed = await modem.setValues({'CarrierTxMode': 1, 'TxPowerWatts': 2.5,
+                                        'NoSuchElement': 3})
+        return failed, await modem.getValues(['CarrierTxMode', 'TxPowerWatts'])
+    failed, values = run(sim, body)
+    assert failed == ['NoSuchElement']
+    assert values == {'CarrierTxMode': 1, 'TxPowerWatts': 2.5}
+    assert sim.values['TxPowerWatts'] == 2.5
+
+
+def test_send_range_waits_for_the_acknowledgements(sim):
+    async def body(modem):
+        failed = await modem.sendRange(power=4)
+        reply = await asyncio.wait_for(modem.replyQ.get(), 5)
+        while 'Range' not in reply:
+            reply = await asyncio.wait_for(modem.replyQ.get(), 5)
+        return failed, reply
+    failed, reply = run(sim, body)
+    assert failed == []
+    assert sim.values['TxPowerWatts'] == 4.0
+    assert sim.transmissions == 1
+    assert reply['Range'] == sim.values['RangeMeters']
+
+
+def test_unsolicited_messages_go_to_the_reply_queue(sim):
+    async def body(modem):
+        for i in range(5):
+            sim.broadcast('Info', {'Info': 'status {}'.format(i)})
+        replies = [await asyncio.wait_for(modem.replyQ.get(), 5) for i in range(3)]
+        return replies, modem.replyStats()
+    replies, stats = run(sim, body, replyQSize=3)
+    assert stats['peakDepth'] == 3
+    # The oldest messages make way for the newest
+    assert [r['Info'] for r in replies][-1] == 'status 4'
+    assert stats['dropped'] == 2
+
+
+def test_record_pcm_writes_whole_frames(sim, tmpdir):
+    name = str(tmpdir.join('rec.pcm'))
+
+    async def body(modem):
+        return await modem.recordPcm(name, 0.1, 0)
+    frames = run(sim, body)
+    assert frames >= 1
+    assert tmpdir.join('rec.pcm').size() == frames * PCM_FRAME_BYTES
+    assert sim.values['RecordMode'] == 0
+
+
+def test_pcmio_round_trip_is_framed(sim):
+    signal = (np.arange(PCM_FRAME_SAMPLES * 3 + 100) % 97).astype(np.float32)
+
+    async def body(modem):
+        pcmio = await modem.openPcmIo(bb=0)
+        modes = sim.values['PlayMode'], sim.values['RecordMode']
+        await pcmio.write(signal)
+        echoed = await asyncio.wait_for(pcmio.read(len(signal)), 5)
+        await pcmio.close()
+        return modes, echoed, pcmio.stats()
+    modes, echoed, stats = run(sim, body)
+    assert modes == (0, 0)
+    np.testing.assert_array_equal(echoed, signal)
+    assert stats['txFrames'] == 4
+    assert stats['rxFrames'] == 4
+    assert stats['rxLost'] == 0
+
+
+def test_pcmio_baseband_sets_and_restores_the_mode(sim):
+    signal = (np.arange(500) + 1j * np.arange(500)).astype(np.complex64)
+
+    async def body(modem):
+        pcmio = await modem.openPcmIo(bb=1)
+        modes = sim.values['PlayMode'], sim.values['RecordMode']
+        await pcmio.write(signal)
+        first = await asyncio.wait_for(pcmio.read(200), 5)
+        rest = await asyncio.wait_for(pcmio.read(300), 5)
+        await pcmio.close()
+        return modes, np.concatenate((first, rest))
+    modes, echoed = run(sim, body)
+    assert modes == (1, 1)
+    np.testing.assert_array_equal(echoed, signal)
+    assert (sim.values['PlayMode'], sim.values['RecordMode']) == (0, 0)
+
+
+def test_data_port_upload_and_payloads(sim, tmpdir):
+    name = str(tmpdir.join('upload.bin'))
+    with open(name, 'wb') as fp:
+        fp.write(b'x' * 3000)
+
+    async def body(modem):
+        sent = await modem.streamUpload(name, 1, chunkBytes=1000)
+        payloads = modem.dataPayloads(payloadGap=0.1)
+        sim.injectPayload(b'acoustic payload')
+        payload = await asyncio.wait_for(payloads.__anext__(), 5)
+        return sent, payload
+    sent, (data, startTime, endTime) = run(sim, body)
+    assert sent == 3000
+    assert sim.values['StreamingTxLen'] == 3000
+    assert data == b'acoustic payload'
+    assert startTime <= endTime
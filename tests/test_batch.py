@@ -0,0 +1,106 @@
+from popoto.batch import SetValueBatch, isRejected
+from popoto.correlation import ReplyCorrelator
+
+
+class AckingModem(object):
+    """
+    Stands in for popoto: registers the acknowledgements like requestMany and
+    records what was sent.
+    """
+    def __init__(self):
+        self.correlator = ReplyCorrelator()
+        self.sent = []
+
+    def requestMany(self, commands):
+        self.sent.append([message for message, key in commands])
+        return [self.correlator.expect(message, key, True) for message, key in commands
+                if key is not None]
+
+    def ack(self, text):
+        return self.correlator.match('Info', {'Info': text})
+
+
+def test_one_send_and_acks():
+    modem = AckingModem()
+    b = SetValueBatch(modem).setValueI('PayloadMode', 1).setValueF('TxPowerWatts', 2.5)
+    result = b.command('Event_sendRanging').flush()
+    assert modem.sent == [['SetValue PayloadMode int 1 0', 'SetValue TxPowerWatts float 2.5 0',
+                           'Event_sendRanging']]
+    assert len(result.pendingList) == 2
+    modem.ack('SetValue TxPowerWatts = 2.5')
+    modem.ack('SetValue PayloadMode = 1')
+    assert result.wait(1).ok()
+    assert sorted(result.acked) == ['PayloadMode', 'TxPowerWatts']
+
+
+def test_rejected_and_missing():
+    modem = AckingModem()
+    result = SetValueBatch(modem).setValueI('PayloadMode', 9).setValueI('CarrierTxMode', 0).flush()
+    modem.ack('SetValue PayloadMode invalid value 9')
+    result.wait(0.01)
+    assert not result.ok()
+    assert result.failed == ['PayloadMode', 'CarrierTxMode']
+
+
+def test_with_statement_commits():
+    modem = AckingModem()
+    with SetValueBatch(modem, timeout=0.01) as b:
+        b.setValueI('PayloadMode', 1)
+    assert b.result.complete and b.result.failed == ['PayloadMode']
+
+
+def test_timed_out_acks_are_withdrawn():
+    modem = AckingModem()
+    result = SetValueBatch(modem).setValueI('PayloadMode', 1).flush().wait(0.01)
+    assert result.failed == ['PayloadMode']
+    assert modem.correlator.outstanding() == 0
+    # A late ack is left for the replyQ
+    assert not modem.ack('SetValue PayloadMode = 1')
+
+
+def test_simulator_acks_and_rejects(sim, modem):
+    with modem.batch() as b:
+        b.setValueI('PayloadMode', 1)
+        b.setValueF('TxPowerWatts', 2.5)
+    assert b.result.ok()
+    assert sim.values['PayloadMode'] == 1
+    assert sim.values['TxPowerWatts'] == 2.5
+    result = modem.batch().setValueI('NoSuchElement', 1).setValueI('PayloadMode', 0).commit()
+    assert result.failed == ['NoSuchElement']
+    assert 'PayloadMode' in result.acked
+
+
+def test_late_simulator_ack_goes_to_reply_queue(sim, modem):
+    sim.replyDelay = 0.2
+    result = modem.batch().setValueI('PayloadMode', 1).flush().wait(0.01)
+    assert result.failed == ['PayloadMode']
+    assert modem.correlator.outstanding() == 0
+    sim.replyDelay = 0
+    assert 'PayloadMode' in modem.waitForReply(2)['Info']
+    assert modem.batch().setValueI('PayloadMode', 1).commit().ok()
+
+
+def test_send_range_waits_for_acks(sim, modem):
+    assert modem.sendRange(0.5).ok()
+    assert modem.correlator.outstanding() == 0
+
+
+def test_is_rejected():
+    assert isRejected({'Info': 'SetValue X invalid value y'})
+    assert isRejected({'Info': 'Error writing X'})
+    assert not isRejected({'Info': 'SetValue X = 1'})
+    assert not isRejected({'X': 1})
+
+
+def test_element_name_is_not_a_rejection():
+    assert not isRejected({'Info': 'SetValue ErrorCount = 0'}, 'ErrorCount')
+    assert not isRejected({'Info': 'SetValue InvalidFrames = 0'}, 'InvalidFrames')
+    assert isRejected({'Info': 'SetValue invalid element FailSafe'}, 'FailSafe')
+    assert isRejected({'Info': 'SetValue ErrorCount invalid value x'}, 'ErrorCount')
+
+
+def test_element_named_like_an_error_is_acked():
+    modem = AckingModem()
+    result = SetValueBatch(modem).setValueI('ErrorCount', 0).flush()
+    modem.ack('SetValue ErrorCount = 0')
+    assert result.wait(1).ok()
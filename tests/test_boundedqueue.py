@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+from popoto.boundedqueue import BLOCK, DROP_NEWEST, DROP_OLDEST, BoundedQueue, Queue
+
+
+def fill(q, items):
+    return [q.put(item) for item in items]
+
+
+def drain(q):
+    out = []
+    while not q.empty():
+        out.append(q.get_nowait())
+    return out
+
+
+def test_drop_oldest():
+    q = BoundedQueue(2, DROP_OLDEST)
+    assert fill(q, [1, 2, 3]) == [True, True, True]
+    assert drain(q) == [2, 3]
+    assert q.stats()['dropped'] == 1
+
+
+def test_drop_newest():
+    q = BoundedQueue(2, DROP_NEWEST)
+    assert fill(q, [1, 2, 3]) == [True, True, False]
+    assert drain(q) == [1, 2]
+    assert q.stats()['dropped'] == 1
+
+
+def test_block_times_out_and_drops():
+    q = BoundedQueue(1, BLOCK)
+    q.put(1)
+    assert not q.put(2, True, 0.01)
+    assert not q.put_nowait(3)
+    assert q.stats()['dropped'] == 2
+
+
+def test_block_waits_for_consumer():
+    q = BoundedQueue(1, BLOCK)
+    q.put(1)
+    consumer = threading.Timer(0.05, q.get)
+    consumer.start()
+    assert q.put(2, True, 5)
+    consumer.join()
+    assert drain(q) == [2]
+
+
+def test_unbounded_and_stats():
+    q = BoundedQueue(0)
+    fill(q, range(10))
+    stats = q.stats()
+    assert (stats['depth'], stats['peakDepth'], stats['putCount']) == (10, 10, 10)
+    assert not q.full()
+    q.clear()
+    assert q.empty()
+    assert q.stats()['bytes'] == 0
+
+
+def test_bytes_tracked():
+    q = BoundedQueue(2)
+    q.put(b'x' * 1000)
+    assert q.stats()['bytes'] >= 1000
+    q.get()
+    assert q.stats()['bytes'] == 0
+    assert q.stats()['peakBytes'] >= 1000
+    assert BoundedQueue(2, sizeOf=None).stats()['bytes'] is None
+
+
+def test_get_timeout_and_bad_policy():
+    with pytest.raises(Queue.Empty):
+        BoundedQueue(1).get(True, 0.01)
+    with pytest.raises(ValueError):
+        BoundedQueue(1, 'spill')
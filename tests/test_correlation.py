@@ -0,0 +1,80 @@
+from popoto.correlation import ReplyCorrelator, waitForReplies
+
+
+def test_match_by_key_in_order():
+    c = ReplyCorrelator()
+    first = c.expect('GetValue X int 0', 'X')
+    second = c.expect('GetValue X int 0', 'X')
+    assert c.match('Response', {'X': 1})
+    assert c.match('Response', {'X': 2})
+    assert first.result(0) == {'X': 1}
+    assert second.result(0) == {'X': 2}
+    assert c.outstanding() == 0
+
+
+def test_unmatched_reply_is_not_consumed():
+    c = ReplyCorrelator()
+    c.expect('GetValue X int 0', 'X')
+    assert not c.match('Response', {'Y': 1})
+    assert not c.match('Response', 'not a dict')
+    assert c.outstanding() == 1
+
+
+def test_info_match():
+    c = ReplyCorrelator()
+    ack = c.expect('SetValue X int 1 0', 'X', infoMatch=True)
+    assert not c.match('Info', {'Info': 'SetValue Y = 1'})
+    assert c.match('Info', {'Info': 'SetValue X = 1'})
+    assert ack.done()
+    assert ack.latency() is not None
+
+
+def test_cancel_keeps_late_reply_from_next_request():
+    c = ReplyCorrelator()
+    stale = c.expect('GetValue X int 0', 'X')
+    assert stale.result(0) is None
+    c.cancel(stale)
+    fresh = c.expect('GetValue X int 0', 'X')
+    c.match('Response', {'X': 'late'})
+    assert not stale.done()
+    assert fresh.result(0) == {'X': 'late'}
+    # Cancelling twice, or after the reply, is harmless
+    c.cancel(stale)
+    c.cancel(fresh)
+    assert c.outstanding() == 0
+
+
+def test_cancel_info_match():
+    c = ReplyCorrelator()
+    ack = c.expect('SetValue X int 1 0', 'X', infoMatch=True)
+    c.cancel(ack)
+    assert not c.match('Info', {'Info': 'SetValue X = 1'})
+    assert c.outstanding() == 0
+
+
+def test_wait_for_replies():
+    c = ReplyCorrelator()
+    a = c.expect('GetVersion', 'Version')
+    b = c.expect('GetRTC', 'RTC')
+    c.match('Info', {'Version': '1'})
+    assert waitForReplies([a, b], 0.01) == [{'Version': '1'}, None]
+
+
+def test_invalid_index_answers_oldest_get_parameters():
+    c = ReplyCorrelator()
+    first = c.expect('GetParameters 5', 'Element')
+    second = c.expect('GetParameters 6', 'Element')
+    assert c.match('Info', {'Info': 'GetParameters invalid index 5'})
+    assert first.result(0) == {'Info': 'GetParameters invalid index 5'}
+    assert not second.done()
+
+
+def test_fail_all_wakes_every_request():
+    c = ReplyCorrelator()
+    get = c.expect('GetValue X int 0', 'X')
+    ack = c.expect('SetValue Y int 1 0', 'Y', infoMatch=True)
+    c.failAll()
+    assert get.done() and ack.done()
+    assert get.result(0) is None and ack.result(0) is None
+    assert c.outstanding() == 0
+    assert not c.match('Response', {'X': 1})
@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+from popoto.dataport import DataUploader
+
+
+def writeFile(tmpdir, size):
+    name = str(tmpdir.join('upload.bin'))
+    with open(name, 'wb') as fp:
+        fp.write(bytes(bytearray(i & 0xff for i in range(size))))
+    return name
+
+
+def test_upload_streams_the_whole_file(modem, sim, until, tmpdir):
+    name = writeFile(tmpdir, 10000)
+    reports = []
+    uploader = modem.streamUpload(name, 1, chunkBytes=512,
+                                  progress=lambda *args: reports.append(args))
+    assert uploader.sent == 10000
+    assert uploader.position == 10000
+    assert sim.values['StreamingTxLen'] == 10000
+    assert sim.values['ConsolePacketBytes'] == 512
+    assert until(lambda: sim.uploadBytes == 10000)
+    # the last progress report covers the whole file
+    assert reports[-1][:2] == (10000, 10000)
+
+
+def test_upload_resumes_from_an_offset(modem, sim, until, tmpdir):
+    name = writeFile(tmpdir, 4096)
+    uploader = modem.streamUpload(name, 1, offset=1000)
+    assert uploader.sent == 3096
+    assert uploader.position == 4096
+    assert sim.values['StreamingTxLen'] == 3096
+    assert until(lambda: sim.uploadBytes == 3096)
+
+
+def test_upload_rejects_an_offset_outside_the_file(modem, sim, tmpdir):
+    name = writeFile(tmpdir, 100)
+    with pytest.raises(ValueError):
+        modem.streamUpload(name, 1, offset=101)
+    with pytest.raises(ValueError):
+        modem.streamUpload(name, 1, offset=-1)
+    assert sim.uploadBytes == 0
+
+
+def test_uploader_handles_partial_sends(tmpdir):
+    class TrickleSocket(object):
+        def __init__(self):
+            self.data = bytearray()
+
+        def send(self, view):
+            # accept at most 7 bytes per call, like a full receive window
+            chunk = bytes(view[:7])
+            self.data.extend(chunk)
+            return len(chunk)
+
+    name = writeFile(tmpdir, 1000)
+    sock = TrickleSocket()
+    uploader = DataUploader(sock, chunkBytes=64)
+    assert uploader.upload(name, offset=10, length=500) == 500
+    with open(name, 'rb') as fp:
+        assert bytes(sock.data) == fp.read()[10:510]
+    assert uploader.position == 510
+
+
+def test_receiver_splits_payloads_on_the_idle_gap(modem, sim, until):
+    receiver = modem.startDataRx(payloadGap=0.2)
+    assert until(lambda: sim.dataClients)
+    sim.injectPayload(b'first payload')
+    first = receiver.read(timeout=5)
+    sim.injectPayload(b'second')
+    second = receiver.read(timeout=5)
+    modem.stopDataRx()
+    assert first.data == b'first payload'
+    assert second.data == b'second'
+    assert first.packets[0][:2] == (0, len(first.data))
+    assert first.startTime <= first.endTime < second.startTime
+    assert receiver.payloads == 2
+    assert receiver.bytesReceived == len(first.data) + len(second.data)
+
+
+def test_receiver_delivers_to_a_callback_and_files(modem, sim, until, tmpdir):
+    payloads = []
+    modem.startDataRx(callback=payloads.append, payloadGap=0.1, outDir=str(tmpdir))
+    assert until(lambda: sim.dataClients)
+    sim.injectPayload(b'\x00\x01payload')
+    assert until(lambda: payloads)
+    modem.stopDataRx()
+    assert modem.dataReceiver is None
+    assert payloads[0].data == b'\x00\x01payload'
+    files = os.listdir(str(tmpdir))
+    assert len(files) == 1
+    with open(os.path.join(str(tmpdir), files[0]), 'rb') as fp:
+        assert fp.read() == b'\x00\x01payload'
@@ -0,0 +1,87 @@
+import threading
+import time
+
+from popoto.boundedqueue import BLOCK
+from popoto.dispatch import ANY_TOPIC, EventDispatcher
+
+
+def test_routes_by_key_and_type():
+    d = EventDispatcher()
+    keyed = d.subscribe('Range')
+    typed = d.subscribe('Status', byType=True)
+    assert d.dispatch('Info', {'Range': 100.0})
+    assert d.dispatch('Status', {'Busy': 1})
+    assert not d.dispatch('Info', {'Other': 1})
+    assert keyed.read(0) == {'Range': 100.0}
+    assert typed.read(0) == {'Busy': 1}
+    assert d.unrouted == 1
+
+
+def test_callback_and_single_delivery():
+    d = EventDispatcher()
+    got = []
+    d.subscribe(ANY_TOPIC, lambda msgType, reply: got.append((msgType, reply)))
+    d.subscribe('Range', lambda msgType, reply: got.append('range'))
+    d.dispatch('Info', {'Range': 1, 'SoundSpeed': 1500})
+    assert got == [('Info', {'Range': 1, 'SoundSpeed': 1500}), 'range']
+
+
+def test_observer_does_not_consume():
+    d = EventDispatcher()
+    watcher = d.subscribe('Info', consume=False)
+    assert not d.dispatch('Info', {'Info': 'x'})
+    assert watcher.read(0) == {'Info': 'x'}
+
+
+def test_failing_callback_is_counted():
+    d = EventDispatcher()
+
+    def fail(msgType, reply):
+        raise RuntimeError('boom')
+
+    sub = d.subscribe('Info', fail)
+    d.dispatch('Info', {'Info': 'x'})
+    assert sub.stats()['errors'] == 1
+
+
+def test_unsubscribe():
+    d = EventDispatcher()
+    with d.subscribe('Info') as sub:
+        d.dispatch('Info', {'Info': 'x'})
+    assert not d.dispatch('Info', {'Info': 'y'})
+    assert sub.read(0) == {'Info': 'x'}
+    assert sub.read(0) is None
+
+
+
+def test_block_waits_for_the_reader():
+    d = EventDispatcher()
+    sub = d.subscribe('Info', maxsize=1, overflow=BLOCK, blockTimeout=5)
+    d.dispatch('Info', {'Info': 1})
+    reader = threading.Timer(0.1, sub.read)
+    reader.start()
+    start = time.time()
+    d.dispatch('Info', {'Info': 2})
+    assert time.time() - start >= 0.05
+    reader.join()
+    assert sub.read(0) == {'Info': 2}
+    assert sub.stats()['dropped'] == 0
+
+
+def test_block_drops_after_the_timeout():
+    d = EventDispatcher()
+    sub = d.subscribe('Info', maxsize=1, overflow=BLOCK, blockTimeout=0.05)
+    d.dispatch('Info', {'Info': 1})
+    start = time.time()
+    d.dispatch('Info', {'Info': 2})
+    assert time.time() - start < 1
+    assert sub.read(0) == {'Info': 1}
+    assert sub.read(0) is None
+    assert sub.stats()['dropped'] == 1
+
+
+def test_modem_subscription(sim, modem):
+    sub = modem.subscribe('Range')
+    modem.sendRange(0.1)
+    reply = sub.read(5)
+    assert reply is not None and reply['Range'] == sim.values['RangeMeters']
@@ -0,0 +1,119 @@
+import socket
+import time
+
+import pytest
+
+from popoto.fleet import PopotoFleet
+from popoto.simulator import PopotoSimulator
+
+
+@pytest.fixture
+def sims():
+    simulators = [PopotoSimulator(basePort=0, extraElements=10).start() for i in range(3)]
+    yield simulators
+    for simulator in simulators:
+        simulator.stop()
+
+
+@pytest.fixture
+def fleet(sims):
+    f = PopotoFleet([('localhost', s.basePort) for s in sims], schemaCache=False)
+    failed = f.connect()
+    assert failed == {}
+    yield f
+    f.close()
+
+
+def names(sims):
+    return ['localhost:{}'.format(s.basePort) for s in sims]
+
+
+def closedPort():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('localhost', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def test_connect_loads_every_schema(sims, fleet):
+    for sim, modem in zip(sims, fleet.modems.values()):
+        assert modem.connected
+        names = set(modem.intParams) | set(modem.floatParams)
+        assert names == set(e['Name'] for e in sim.elements[:-1])
+    # One I/O thread serves the whole fleet
+    assert fleet.ioThread.is_alive()
+
+
+def test_broadcast_set_and_get(sims, fleet):
+    acked = fleet.setValueF('TxPowerWatts', 3.5)
+    assert list(acked.values()) == [True] * 3
+    assert [s.values['TxPowerWatts'] for s in sims] == [3.5] * 3
+    assert fleet.setValueI('NoSuchElement', 1) == dict.fromkeys(names(sims), False)
+
+    sims[1].values['CarrierTxMode'] = 7
+    values = fleet.getValueI('CarrierTxMode')
+    assert list(values.values()) == [0, 7, 0]
+
+
+def test_group_addresses_only_its_modems(sims, fleet):
+    group = fleet.group(names(sims)[:2])
+    assert list(group.setValueI('CarrierTxMode', 2).keys()) == names(sims)[:2]
+    assert [s.values['CarrierTxMode'] for s in sims] == [2, 2, 0]
+
+
+def test_unreachable_modem_is_reported(sims):
+    port = closedPort()
+    f = PopotoFleet([('localhost', sims[0].basePort), ('localhost', port)], schemaCache=False)
+    try:
+        failed = f.connect(timeout=2)
+        assert list(failed) == ['localhost:{}'.format(port)]
+        start = time.time()
+        values = f.getValueI('CarrierTxMode', timeout=3)
+        # The unreachable modem fails at once instead of timing out
+        assert time.time() - start < 1
+        assert list(values.values()) == [0, None]
+    finally:
+        f.close()
+
+
+def test_closed_modem_fails_its_requests(sims, fleet, until):
+    modem = fleet.modems[names(sims)[2]]
+    sims[2].stop()
+    assert until(lambda: not modem.connected)
+    start = time.time()
+    values = fleet.getValueI('CarrierTxMode', timeout=3)
+    assert time.time() - start < 1
+    assert list(values.values()) == [0, 0, None]
+    assert modem.correlator.outstanding() == 0
+
+
+class BrokenSocket(object):
+    """
+    Wraps a socket whose sends fail, as on a reset connection.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, data):
+        raise ConnectionResetError(104, 'Connection reset by peer')
+
+
+def test_send_error_drops_the_modem(sims, fleet, until):
+    modem = fleet.modems[names(sims)[0]]
+    modem.sock = BrokenSocket(modem.sock)
+    pending = fleet.requestModem(modem, 'GetValue CarrierTxMode int  0', 'CarrierTxMode')
+    assert until(lambda: not modem.connected)
+    # The request fails at once, and the loop no longer polls the socket
+    assert pending.result(1) is None and pending.done()
+    assert isinstance(modem.error, ConnectionResetError)
+    assert modem.errorcount == 1
+    assert len(modem.outbuf) == 0
+    assert modem.sock.fileno() not in fleet.selector.get_map()
+    # The rest of the fleet carries on
+    values = fleet.getValueI('CarrierTxMode', timeout=3)
+    assert list(values.values()) == [None, 0, 0]
+    modem.sock = modem.sock.sock
@@ -0,0 +1,76 @@
+import socket
+
+import pytest
+
+from popoto.framing import CommandReader, formatCommand
+
+
+@pytest.fixture
+def link():
+    a, b = socket.socketpair()
+    a.settimeout(5)
+    yield a, b
+    a.close()
+    b.close()
+
+
+def readFrames(reader, count):
+    got = []
+    while len(got) < count:
+        assert reader.fill() > 0
+        got.extend(reader.frames())
+    return got
+
+
+def test_frames_split_on_cr(link):
+    a, b = link
+    reader = CommandReader(a, bufSize=64)
+    b.sendall(b'Info {"Info": "a"}\rResponse {"X": 1}\r')
+    assert readFrames(reader, 2) == [('Info', '{"Info": "a"}'), ('Response', '{"X": 1}')]
+
+
+def test_partial_frame_waits_for_terminator(link):
+    a, b = link
+    reader = CommandReader(a, bufSize=64)
+    b.sendall(b'Info {"Info": ')
+    assert reader.fill() > 0
+    assert list(reader.frames()) == []
+    b.sendall(b'"b"}\r')
+    assert readFrames(reader, 1) == [('Info', '{"Info": "b"}')]
+
+
+def test_frame_larger_than_buffer_grows_it(link):
+    a, b = link
+    reader = CommandReader(a, bufSize=16)
+    text = '{"Info": "' + 'x' * 100 + '"}'
+    b.sendall(text.encode() + b'\rInfo {"RTC": "now"}\r')
+    assert readFrames(reader, 2) == [('', text), ('Info', '{"RTC": "now"}')]
+
+
+def test_line_without_json_and_blank_lines(link):
+    a, b = link
+    reader = CommandReader(a, bufSize=64)
+    b.sendall(b'Ready\r\r \rInfo {}\r')
+    assert readFrames(reader, 2) == [('Ready', ''), ('Info', '{}')]
+
+
+def test_peer_close(link):
+    a, b = link
+    reader = CommandReader(a, bufSize=8)
+    b.close()
+    assert reader.fill() == 0
+
+
+def test_feed_without_socket():
+    reader = CommandReader(bufSize=16)
+    reader.feed(b'Info {"Info": ')
+    assert list(reader.frames()) == []
+    reader.feed(b'"' + b'y' * 40 + b'"}\r')
+    assert list(reader.frames()) == [('Info', '{"Info": "' + 'y' * 40 + '"}')]
+
+
+def test_format_command():
+    assert formatCommand('GetValue Foo int 0') == \
+        b'{ "Command": "GetValue", "Arguments": "Foo int 0"}\n'
+    assert formatCommand('Event_StartRx') == \
+        b'{ "Command": "Event_StartRx", "Arguments": "Unused Arguments"}\n'
@@ -0,0 +1,90 @@
+import time
+
+from popoto.metrics import ClientMetrics, LatencyHistogram, ThroughputCounter
+
+
+def test_histogram_buckets_and_quantiles():
+    h = LatencyHistogram((0.01, 0.1, 1.0))
+    for value in (0.005, 0.005, 0.05, 0.5, 3.0):
+        h.observe(value)
+    snap = h.snapshot()
+    assert snap['count'] == 5
+    assert snap['max'] == 3.0
+    assert [n for bound, n in snap['buckets']] == [2, 1, 1, 1]
+    assert h.quantile(0.4) == 0.01
+    assert h.quantile(0.5) == 0.1
+    assert h.quantile(1.0) == 3.0
+    assert LatencyHistogram().quantile(0.5) is None
+
+
+def test_sources_are_read_and_folded_in():
+    counter = ThroughputCounter()
+    moved = [100, 2]
+    source = counter.attach(lambda: tuple(moved))
+    counter.add(10, 1)
+    assert counter.totals() == (110, 3)
+    moved[:] = [300, 5]
+    counter.detach(source)
+    moved[:] = [1000, 50]
+    assert counter.totals() == (310, 6)
+
+
+def test_each_consumer_keeps_its_own_rate_baseline():
+    counter = ThroughputCounter()
+    first = counter.snapshot()
+    second = counter.snapshot()
+    counter.add(1000, 10)
+    time.sleep(0.05)
+    # A snapshot taken by one consumer does not move the other's baseline
+    assert counter.snapshot(first)['bytes'] == 1000
+    later = counter.snapshot(second)
+    elapsed = later['time'] - second['time']
+    assert abs(later['bytesPerSec'] - 1000 / elapsed) < 1e-6
+    assert abs(later['framesPerSec'] - 10 / elapsed) < 1e-6
+    # Nothing moved since the last snapshot
+    assert counter.snapshot(later)['bytesPerSec'] == 0.0
+
+
+def test_prometheus_text():
+    metrics = ClientMetrics({'modem': 'm1'})
+    metrics.sockets['pcmlog'].add(640, 1)
+    metrics.countError('timeout')
+
+    class Pending(object):
+        command = 'GetValue X int 0'
+        sentTime = 1.0
+        replyTime = 1.002
+
+    metrics.observeReply(Pending())
+    text = metrics.prometheusText()
+    assert 'popoto_command_latency_seconds_count{command="GetValue",modem="m1"} 1' in text
+    assert 'popoto_command_latency_seconds_bucket{command="GetValue",le="0.0025",modem="m1"} 1' in text
+    assert 'popoto_socket_bytes_total{modem="m1",socket="pcmlog"} 640' in text
+    assert 'popoto_errors_total{kind="timeout",modem="m1"} 1' in text
+
+
+def test_export_writes_the_file(tmp_path):
+    metrics = ClientMetrics()
+    path = str(tmp_path / 'popoto.prom')
+    metrics.startExport(path, interval=0.05)
+    deadline = time.time() + 5
+    while not (tmp_path / 'popoto.prom').exists() and time.time() < deadline:
+        time.sleep(0.01)
+    metrics.stopExport()
+    assert 'popoto_socket_bytes_total' in (tmp_path / 'popoto.prom').read_text()
+
+
+def test_modem_metrics(sim, modem, tmpdir):
+    modem.getVersion()
+    name = str(tmpdir.join('upload.bin'))
+    with open(name, 'wb') as fp:
+        fp.write(b'u' * 2048)
+    start = modem.getMetrics()
+    modem.streamUpload(name, 1)
+    snap = modem.getMetrics(start)
+    # Replies matched by the correlator are timed per command
+    assert snap['latency']['GetVersion']['count'] >= 1
+    assert snap['latency']['SetValue']['count'] >= 6
+    assert snap['sockets']['data']['bytes'] == 2048
+    assert snap['sockets']['data']['bytesPerSec'] > 0
+    assert snap['queues']['replyQ']['dropped'] == 0
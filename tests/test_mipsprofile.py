@@ -0,0 +1,20 @@
+import threading
+
+from popoto.mipsprofile import MipsProfiler
+
+
+def test_callback_may_read_profile(modem):
+    seen = []
+
+    def callback(now, module, peakMips):
+        seen.append((module, profiler.summary()))
+
+    profiler = MipsProfiler(modem, warnFraction=1e-6, callback=callback)
+    poll = threading.Thread(target=profiler.poll)
+    poll.daemon = True
+    poll.start()
+    poll.join(5)
+    assert not poll.is_alive()
+    assert seen and len(seen) == len(profiler.alerts)
+    assert profiler.samples == 1
+    assert len(profiler.series()['time']) == 1
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from popoto.aiopopoto import AsyncPopoto
+from popoto.fleet import PopotoFleet
+from popoto.popoto import popoto
+from popoto.schemacache import SchemaCache
+
+
+@pytest.mark.parametrize('window', [1, 8])
+def test_get_all_parameters(sim, window):
+    p = popoto('localhost', sim.basePort, schemaCache=False, paramWindow=window)
+    try:
+        names = set(p.intParams) | set(p.floatParams)
+        # Every element of the chain except the terminating one
+        assert names == set(e['Name'] for e in sim.elements[:-1])
+        # The requests sent past the end are answered and consumed, not queued
+        assert p.correlator.outstanding() == 0
+        assert p.replyQ.qsize() == 0
+    finally:
+        p.is_running = False
+        p.close()
+
+
+@pytest.fixture
+def brokenChain(sim, monkeypatch):
+    # The modem stops answering part way along the chain
+    command = sim.command
+
+    def failing(client, line):
+        if b'"GetParameters", "Arguments": "10"' in line:
+            return [('Info', {'Info': 'GetParameters invalid index 10'})]
+        return command(client, line)
+
+    monkeypatch.setattr(sim, 'command', failing)
+    return sim
+
+
+def test_partial_walk_is_not_cached(brokenChain, tmp_path):
+    cache = SchemaCache(str(tmp_path))
+    p = popoto('localhost', brokenChain.basePort, schemaCache=cache)
+    try:
+        assert len(p.intParams) + len(p.floatParams) == 10
+        assert cache.load(p.ip, p.cmdport, p.version) is None
+    finally:
+        p.is_running = False
+        p.close()
+
+
+def test_complete_walk_is_cached(sim, tmp_path):
+    cache = SchemaCache(str(tmp_path))
+    p = popoto('localhost', sim.basePort, schemaCache=cache)
+    try:
+        assert cache.load(p.ip, p.cmdport, p.version) == (p.intParams, p.floatParams)
+    finally:
+        p.is_running = False
+        p.close()
+
+
+def test_fleet_partial_walk_is_not_cached(brokenChain, tmp_path):
+    cache = SchemaCache(str(tmp_path))
+    fleet = PopotoFleet([('localhost', brokenChain.basePort)], schemaCache=cache)
+    try:
+        fleet.connect()
+        modem = list(fleet.modems.values())[0]
+        assert len(modem.intParams) + len(modem.floatParams) == 10
+        assert cache.load(modem.ip, modem.cmdport, modem.version) is None
+    finally:
+        fleet.close()
+
+
+def test_async_partial_walk_is_not_cached(brokenChain, tmp_path):
+    cache = SchemaCache(str(tmp_path))
+
+    async def run():
+        modem = AsyncPopoto('localhost', brokenChain.basePort, schemaCache=cache)
+        await modem.connect()
+        try:
+            assert len(modem.intParams) + len(modem.floatParams) == 10
+            assert cache.load(modem.ip, modem.cmdport, modem.version) is None
+        finally:
+            await modem.close()
+
+    asyncio.run(run())
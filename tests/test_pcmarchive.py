@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from popoto.pcmarchive import PcmArchive, PcmArchiveWriter
+from popoto.pcmformat import PCM_FRAME_SAMPLES, floatsPerSecond
+
+from test_pcmparse import makeFrames
+
+PERIOD = PCM_FRAME_SAMPLES / float(floatsPerSecond(0))
+
+
+@pytest.fixture
+def archive(tmp_path):
+    path = str(tmp_path / 'run')
+    writer = PcmArchiveWriter(path, 0, chunkFrames=4, metadata={'modem': 'sim'})
+    # 10 frames arriving in two buffers, the first chunk of the second one
+    # continuing the open chunk of the first
+    writer.write(makeFrames(range(100, 105)), endTime=1000 + 4 * PERIOD)
+    writer.write(makeFrames(range(105, 110)), endTime=1000 + 9 * PERIOD)
+    writer.close()
+    return PcmArchive(path + '.pcm')
+
+
+def test_metadata_and_size(archive):
+    assert archive.frames == 10
+    assert archive.metadata['modem'] == 'sim'
+    assert archive.metadata['frames'] == 10
+    assert archive.duration() == pytest.approx(10 * PERIOD)
+
+
+def test_frame_times(archive):
+    assert np.allclose(archive.frameTimes(), 1000 + np.arange(10) * PERIOD)
+
+
+def test_frame_at_time(archive):
+    assert archive.frameAtTime(0) == 0
+    assert archive.frameAtTime(1000 + 3 * PERIOD) == 3
+    assert archive.frameAtTime(1000 + 6.5 * PERIOD) == 7
+    assert archive.frameAtTime(2000) == 10
+
+
+def test_frame_at_counter(archive):
+    assert archive.frameAtCounter(0) == 0
+    assert archive.frameAtCounter(104) == 4
+    assert archive.frameAtCounter(108) == 8
+    assert archive.frameAtCounter(1 << 40) == 10
+
+
+def test_ranges(archive):
+    frames = archive.counterRange(103, 107)
+    assert list(frames.counters) == [103, 104, 105, 106]
+    assert frames.samples.shape == (4, PCM_FRAME_SAMPLES)
+    assert len(archive.offsetRange(0, 2 * PERIOD).counters) == 2
+    assert len(archive.timeRange(1000 + PERIOD, 1000 + 3 * PERIOD).counters) == 2
+
+
+def test_counter_wrap_inside_a_chunk(tmp_path):
+    path = str(tmp_path / 'wrap')
+    writer = PcmArchiveWriter(path, 0, chunkFrames=4)
+    # The counter wraps in the middle of the second chunk
+    writer.write(makeFrames([0xfffffffa + i for i in range(5)]))
+    writer.write(makeFrames([0xffffffff, 0, 1, 2, 3]))
+    writer.close()
+    archive = PcmArchive(path)
+    assert archive.frameAtCounter(0xfffffffe) == 4
+    assert archive.frameAtCounter((1 << 32) + 1) == 7
+    frames = archive.counterRange(0xfffffffd, (1 << 32) + 1)
+    assert list(frames.counters) == [0xfffffffd, 0xfffffffe, 0xffffffff, 0]
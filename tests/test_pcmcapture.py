@@ -0,0 +1,105 @@
+import os
+import socket
+import threading
+import time
+
+from popoto.pcmcapture import PcmCapture
+from popoto.pcmformat import PCM_FRAME_BYTES, framesForDuration
+from popoto.pcmparse import droppedFrames, parseFile
+
+from test_pcmparse import makeFrames
+
+
+class SlowSink(object):
+    """
+    A sink whose writes stall, like a busy disk.
+    """
+    def __init__(self, delay=0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.data = bytearray()
+        self.closed = False
+
+    def write(self, data, endTime):
+        if self.fail:
+            raise IOError('disk full')
+        time.sleep(self.delay)
+        self.data.extend(data)
+
+    def close(self):
+        self.closed = True
+
+
+def feed(writer, data, step=1000):
+    for start in range(0, len(data), step):
+        writer.sendall(data[start:start + step])
+    writer.close()
+
+
+def test_capture_writes_whole_frames(sim, modem, until, tmpdir):
+    name = str(tmpdir.join('capture.pcm'))
+    capture = modem.recPcmCapture(name, duration=0.2)
+    frames = framesForDuration(0.2, 0)
+    assert capture.frames == frames
+    assert os.path.getsize(name) == frames * PCM_FRAME_BYTES
+    assert droppedFrames(parseFile(name, 0).counters) == 0
+    assert until(lambda: sim.values['RecordMode'] == 0)
+    assert modem.getMetrics()['sockets']['pcmlog']['bytes'] >= frames * PCM_FRAME_BYTES
+
+
+def test_capture_rotates_files(sim, modem, tmpdir):
+    name = str(tmpdir.join('rot.pcm'))
+    capture = modem.recPcmCapture(name, duration=0.3, rotateSeconds=0.1)
+    files = capture.stats()['files']
+    perFile = framesForDuration(0.1, 0) * PCM_FRAME_BYTES
+    assert len(files) == 3
+    assert all(f.startswith(str(tmpdir.join('rot_'))) and f.endswith('.pcm') for f in files)
+    assert [os.path.getsize(f) for f in files] == [perFile] * 3
+
+
+def test_stalled_writer_uses_the_pool_without_losing_data():
+    reader, writer = socket.socketpair()
+    reader.settimeout(0.1)
+    sink = SlowSink(delay=0.02)
+    capture = PcmCapture(reader, None, buffers=2, bufferFrames=1, sink=sink)
+    data = makeFrames(range(20))
+    feeder = threading.Thread(target=feed, args=(writer, data))
+    feeder.start()
+    assert capture.run() == 20
+    feeder.join()
+    reader.close()
+    stats = capture.stats()
+    assert bytes(sink.data) == data
+    assert sink.closed
+    assert stats['poolStalls'] > 0
+    assert stats['maxWriteSeconds'] >= 0.02
+    assert stats['bytesWritten'] == stats['bytesReceived'] == len(data)
+
+
+def test_partial_frame_is_not_written(tmpdir):
+    reader, writer = socket.socketpair()
+    reader.settimeout(0.1)
+    name = str(tmpdir.join('part.pcm'))
+    capture = PcmCapture(reader, name)
+    feed(writer, makeFrames(range(3))[:-10])
+    assert capture.run() == 2
+    reader.close()
+    assert os.path.getsize(name) == 2 * PCM_FRAME_BYTES
+
+
+def test_write_error_ends_the_capture():
+    reader, writer = socket.socketpair()
+    reader.settimeout(0.1)
+    done = []
+    capture = PcmCapture(reader, None, bufferFrames=1, sink=SlowSink(fail=True),
+                         onDone=lambda: done.append(True)).start()
+    writer.sendall(makeFrames(range(4)))
+    deadline = time.time() + 5
+    while capture.is_running and time.time() < deadline:
+        time.sleep(0.01)
+    capture.stop()
+    writer.close()
+    reader.close()
+    assert isinstance(capture.writeError, IOError)
+    assert capture.frames == 0
+    assert done == [True]
@@ -0,0 +1,71 @@
+import time
+
+import numpy as np
+import pytest
+
+
+def test_loopback_round_trip_and_idle_frames(sim, modem):
+    with modem.pcmDuplex(bb=1, loopback=True) as duplex:
+        probe = (np.arange(duplex.frameSamples * 4) % 7).astype(np.complex64)
+        assert duplex.write(probe, 5) == len(probe)
+        assert duplex.flush(5)
+        # Run idle for a few frames after the signal
+        time.sleep(6 * duplex.framePeriod)
+        received = duplex.read(duplex.frameSamples * 20, 5)
+        stats = duplex.stats()
+    assert len(received) == duplex.frameSamples * 20
+    assert np.count_nonzero(received) > 0
+    assert stats['txUnderruns'] == 0
+    assert stats['lastRoundTrip'] is not None
+    assert stats['roundTrip']['count'] > 0
+    assert modem.correlator.outstanding() == 0
+    assert sim.values['PlayMode'] == 0 and sim.values['RecordMode'] == 0
+
+
+def test_round_trip_only_on_loopback(sim, modem):
+    with modem.pcmDuplex(bb=1) as duplex:
+        duplex.read(duplex.frameSamples * 2, 5)
+        stats = duplex.stats()
+    assert stats['rxFrames'] >= 2
+    assert stats['roundTrip'] is None and stats['lastRoundTrip'] is None
+
+
+def test_padded_last_frame_is_not_an_underrun(sim, modem):
+    with modem.pcmDuplex(bb=1) as duplex:
+        duplex.write(np.ones(duplex.frameSamples * 2 + duplex.frameSamples // 2, np.complex64), 5)
+        assert duplex.flush(5)
+        time.sleep(4 * duplex.framePeriod)
+        stats = duplex.stats()
+    assert stats['txUnderruns'] == 0
+
+
+def test_running_dry_before_the_end_is_an_underrun(sim, modem):
+    with modem.pcmDuplex(bb=1) as duplex:
+        # Whole frames, so the ring runs dry on a frame boundary
+        duplex.write(np.ones(duplex.frameSamples * 2, np.complex64), 5)
+        time.sleep(6 * duplex.framePeriod)
+        late = duplex.stats()['txUnderruns']
+        # The rest of the signal arrives, and its end is marked
+        duplex.write(np.ones(duplex.frameSamples // 2, np.complex64), 5)
+        assert duplex.flush(5)
+        ended = duplex.stats()['txUnderruns']
+        time.sleep(4 * duplex.framePeriod)
+        stats = duplex.stats()
+    assert late >= 3
+    # The silence after the end is not counted
+    assert stats['txUnderruns'] == ended
+
+
+def test_rejected_mode_closes_and_raises(sim, modem, monkeypatch):
+    command = sim.command
+
+    def rejectRecordMode(client, line):
+        if b'"SetValue", "Arguments": "RecordMode' in line:
+            return [('Info', {'Info': 'SetValue RecordMode invalid value'})]
+        return command(client, line)
+
+    monkeypatch.setattr(sim, 'command', rejectRecordMode)
+    with pytest.raises(IOError) as err:
+        modem.pcmDuplex(bb=1)
+    assert 'RecordMode' in str(err.value)
+    assert modem.metrics.sockets['pcmio'].sources == []
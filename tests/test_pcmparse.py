@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from popoto.pcmformat import PCM_FRAME_BYTES, PCM_FRAME_SAMPLES, PCM_FRAME_WORDS, PCMLOG_OFFSET
+from popoto.pcmparse import droppedFrames, parseFile, parseFrames
+
+
+def makeFrames(counters, gain=1):
+    frames = np.zeros((len(counters), PCM_FRAME_WORDS), np.float32)
+    words = frames.view(np.uint32)
+    words[:, 0] = counters
+    words[:, 1] = gain
+    frames[:, PCMLOG_OFFSET:] = np.arange(PCM_FRAME_SAMPLES, dtype=np.float32)
+    return frames.tobytes()
+
+
+def test_parse_passband():
+    frames = parseFrames(makeFrames([7, 8, 9]), 0)
+    assert frames.samples.dtype == np.float32
+    assert frames.samples.shape == (3 * PCM_FRAME_SAMPLES,)
+    assert list(frames.counters) == [7, 8, 9]
+    assert list(frames.gains) == [1, 1, 1]
+    assert frames.samples[PCM_FRAME_SAMPLES + 5] == 5
+
+
+def test_parse_baseband_not_flat():
+    frames = parseFrames(makeFrames([0, 1]), 1, flat=False)
+    assert frames.samples.dtype == np.complex64
+    assert frames.samples.shape == (2, PCM_FRAME_SAMPLES // 2)
+    assert frames.samples[1, 1] == 2 + 3j
+
+
+def test_partial_frame_ignored():
+    data = makeFrames([0, 1]) + b'\0' * 10
+    assert len(parseFrames(data, 0).counters) == 2
+    assert len(parseFrames(b'\0' * (PCM_FRAME_BYTES - 1), 0).counters) == 0
+
+
+def test_parse_file(tmp_path):
+    path = tmp_path / 'rec.pcm'
+    path.write_bytes(makeFrames([1, 2]))
+    assert list(parseFile(str(path), 0).counters) == [1, 2]
+
+
+@pytest.mark.parametrize('counters, dropped', [
+    ([], 0), ([5], 0), ([1, 2, 3], 0), ([1, 3, 4, 8], 4), ([5, 5, 6], 0),
+])
+def test_dropped_frames(counters, dropped):
+    assert droppedFrames(np.array(counters, np.uint32)) == dropped
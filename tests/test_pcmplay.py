@@ -0,0 +1,71 @@
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from popoto.pcmformat import BASEBAND_RATE, PCM_FRAME_BYTES, PCM_FRAME_SAMPLES
+from popoto.pcmparse import parseFrames
+from popoto.pcmplay import PcmPlayer, blockFrames, frameSamples
+
+
+def test_frame_samples_pads_and_counts():
+    samples = np.arange(PCM_FRAME_SAMPLES + 10, dtype=np.float32)
+    frames = parseFrames(frameSamples(samples, firstFrame=7), 0)
+    assert list(frames.counters) == [7, 8]
+    assert np.array_equal(frames.samples[:len(samples)], samples)
+    assert not frames.samples[len(samples):].any()
+
+
+def test_block_frames_carry_partial_frames():
+    blocks = [np.ones(100, np.complex64)] * 7
+    data = b''.join(bytes(chunk) for chunk in blockFrames(blocks, 8))
+    frames = parseFrames(data, 1)
+    # 700 complex samples are 1400 floats: two whole frames and a padded third
+    assert list(frames.counters) == [0, 1, 2]
+    assert np.count_nonzero(frames.samples) == 700
+    assert np.all(frames.samples[:700] == 1)
+
+
+@pytest.fixture
+def sink():
+    a, b = socket.socketpair()
+    received = []
+
+    def drain():
+        while True:
+            data = b.recv(65536)
+            if not data:
+                break
+            received.append(len(data))
+
+    thread = threading.Thread(target=drain)
+    thread.start()
+    yield a, received
+    a.close()
+    thread.join()
+    b.close()
+
+
+def test_player_paces_to_sample_rate(sink):
+    sock, received = sink
+    player = PcmPlayer(sock, 1, lead=0.05)
+    samples = np.zeros(BASEBAND_RATE // 4, np.complex64)
+    start = time.time()
+    floats = player.play(samples)
+    elapsed = time.time() - start
+    assert floats == 2 * len(samples)
+    assert player.duration == pytest.approx(0.25)
+    # Returns once the signal has played out, not as fast as the socket takes it
+    assert elapsed >= 0.24
+    assert player.underruns == 0
+    assert player.bytesSent % PCM_FRAME_BYTES == 0
+
+
+def test_modem_play(sim, modem, until):
+    # Four whole frames of baseband samples
+    samples = np.ones(4 * PCM_FRAME_SAMPLES // 2, np.complex64)
+    player = modem.playPcmLoop(samples, 1, lead=0.05)
+    assert player.duration == pytest.approx(0.125)
+    assert until(lambda: sim.playedBytes == player.bytesSent)
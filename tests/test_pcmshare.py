@@ -0,0 +1,66 @@
+import socket
+import time
+
+import pytest
+
+from popoto.pcmformat import PCM_FRAME_BYTES
+from popoto.pcmshare import PcmOverrun, PcmPublisher, PcmSubscriber
+
+from test_pcmparse import makeFrames
+
+
+@pytest.fixture
+def feed():
+    reader, writer = socket.socketpair()
+    reader.settimeout(0.1)
+    publisher = PcmPublisher(reader, 0, slots=4, slotFrames=1).start()
+    yield publisher, writer
+    writer.close()
+    publisher.close()
+    reader.close()
+
+
+def waitPublished(publisher, count):
+    deadline = time.time() + 5
+    while publisher.published < count and time.time() < deadline:
+        time.sleep(0.005)
+    assert publisher.published == count
+
+
+def test_subscriber_reads_slots(feed):
+    publisher, writer = feed
+    with PcmSubscriber(publisher.name) as sub:
+        writer.sendall(makeFrames([10, 11]))
+        seq, frames = sub.readFrames(5)
+        assert seq == 0 and list(frames.counters) == [10]
+        seq, view = sub.read(5)
+        assert seq == 1 and len(view) == PCM_FRAME_BYTES
+        assert sub.stillValid(seq)
+        view.release()
+        del frames
+        assert sub.read(0.01) is None
+
+
+def test_subscriber_overrun(feed):
+    publisher, writer = feed
+    with PcmSubscriber(publisher.name) as sub:
+        writer.sendall(makeFrames(range(10)))
+        waitPublished(publisher, 10)
+        with pytest.raises(PcmOverrun) as overrun:
+            sub.read(0)
+        # The ring holds slots - 1 readable slots
+        assert overrun.value.lost == 7
+        assert sub.overruns == 1
+        seq, frames = sub.readFrames(0)
+        assert seq == 7 and list(frames.counters) == [7]
+        del frames
+
+
+def test_from_oldest_and_bad_name(feed):
+    publisher, writer = feed
+    writer.sendall(makeFrames(range(6)))
+    waitPublished(publisher, 6)
+    with PcmSubscriber(publisher.name, fromOldest=True) as sub:
+        assert sub.available() == 3
+    with pytest.raises(Exception):
+        PcmSubscriber('no_such_popoto_ring')
@@ -0,0 +1,65 @@
+import socket
+
+import numpy as np
+import pytest
+
+from popoto.boundedqueue import DROP_NEWEST
+from popoto.pcmformat import PCM_FRAME_SAMPLES
+from popoto.pcmstream import PcmStream
+
+from test_pcmparse import makeFrames
+
+
+@pytest.fixture
+def link():
+    reader, writer = socket.socketpair()
+    reader.settimeout(0.1)
+    yield reader, writer
+    writer.close()
+
+
+def test_blocks_span_frames_and_reads(link):
+    reader, writer = link
+    stream = PcmStream(reader, 0, 300).start()
+    data = makeFrames(range(4))
+    # Split the frames at odd offsets
+    for start in range(0, len(data), 1001):
+        writer.sendall(data[start:start + 1001])
+    writer.close()
+    blocks = list(stream)
+    stream.close()
+    samples = np.concatenate(blocks)
+    assert len(blocks) == 4 * PCM_FRAME_SAMPLES // 300
+    assert np.array_equal(samples, np.tile(np.arange(PCM_FRAME_SAMPLES, dtype=np.float32), 4)[:len(samples)])
+    assert stream.stats()['frames'] == 4
+
+
+def test_lost_frames_counted(link):
+    reader, writer = link
+    with PcmStream(reader, 1, 64) as stream:
+        stream.start()
+        writer.sendall(makeFrames([1, 2, 5]))
+        writer.sendall(makeFrames([9]))
+        writer.close()
+        list(stream)
+        assert stream.stats()['lostFrames'] == 5
+
+
+def test_slow_consumer_drops_blocks(link):
+    reader, writer = link
+    stream = PcmStream(reader, 0, PCM_FRAME_SAMPLES, maxBlocks=2, overflow=DROP_NEWEST).start()
+    writer.sendall(makeFrames(range(5)))
+    writer.close()
+    stream.thread.join(5)
+    stats = stream.stats()
+    assert (stats['depth'], stats['dropped']) == (2, 3)
+    assert stream.read(0)[0] == 0
+    stream.close()
+
+
+def test_modem_stream(sim, modem, until):
+    with modem.pcmStream(1024, bb=1) as stream:
+        block = stream.read(5)
+        assert sim.values['RecordMode'] == 1
+    assert block.dtype == np.complex64 and len(block) == 1024
+    assert until(lambda: sim.values['RecordMode'] == 0)
@@ -0,0 +1,41 @@
+import numpy as np
+
+
+def test_campaign_acks_checked_per_ping(sim, modem):
+    campaign = modem.rangingCampaign(3, powers=(0.1, 0.5), timeout=5)
+    stats = campaign.stats()
+    assert stats['pings'] == 6
+    assert stats['timeouts'] == 0
+    # One TxPowerWatts and one CarrierTxMode change at most per power level
+    assert stats['setValues'] <= 3
+    assert stats['failedSetValues'] == []
+    assert modem.correlator.outstanding() == 0
+    assert not np.isnan(campaign.results.range).any()
+
+
+def test_missing_acks_are_withdrawn(sim, modem):
+    modem.setValueI('CarrierTxMode', 1)
+    sim.replyDelay = 0.05
+    campaign = modem.rangingCampaign(1, powers=(2.0,), timeout=0.02)
+    sim.replyDelay = 0
+    assert sorted(campaign.stats()['failedSetValues']) == ['CarrierTxMode', 'TxPowerWatts']
+    assert modem.correlator.outstanding() == 0
+
+
+def test_failed_setting_is_sent_again(sim, modem, monkeypatch):
+    command = sim.command
+    rejected = []
+
+    def rejectOnce(client, line):
+        if b'"SetValue", "Arguments": "TxPowerWatts' in line and not rejected:
+            rejected.append(line)
+            return [('Info', {'Info': 'SetValue TxPowerWatts invalid value'})]
+        return command(client, line)
+
+    monkeypatch.setattr(sim, 'command', rejectOnce)
+    campaign = modem.rangingCampaign(3, powers=(2.0,), timeout=5)
+    stats = campaign.stats()
+    assert stats['failedSetValues'] == ['TxPowerWatts']
+    # Sent with the first ping, rejected, and sent again with the second only
+    assert stats['setValues'] == 2
+    assert sim.values['TxPowerWatts'] == 2.0
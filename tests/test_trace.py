@@ -0,0 +1,94 @@
+import logging
+
+import pytest
+
+from popoto import trace
+from popoto.trace import LazyFormat, TRACE, tracer
+
+
+class Exploding(object):
+    def __format__(self, spec):
+        raise AssertionError('formatted while the level is off')
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+@pytest.fixture
+def level():
+    saved = tracer.logger.level
+    yield trace.setTraceLevel
+    trace.setTraceLevel(saved)
+
+
+def test_disabled_level_does_not_format(level):
+    level(logging.WARNING)
+    assert not tracer.enabled(TRACE)
+    tracer.debug("{}", Exploding())
+    tracer.trace(TRACE, "{}", Exploding())
+
+
+def test_message_is_formatted_when_emitted(level):
+    level(logging.DEBUG)
+    handler = ListHandler()
+    tracer.logger.addHandler(handler)
+    try:
+        tracer.debug("{} of {}", 1, 2)
+        tracer.info("no arguments {}")
+    finally:
+        tracer.logger.removeHandler(handler)
+    assert handler.messages == ['1 of 2', 'no arguments {}']
+    assert str(LazyFormat('{:.1f}', (0.25,))) == '0.2'
+
+
+def test_async_sink_writes_on_its_own_thread(level):
+    handler = ListHandler()
+    sink = trace.startAsyncLogging([handler], level=logging.INFO)
+    try:
+        assert not tracer.logger.propagate
+        for i in range(10):
+            tracer.info("record {}", i)
+    finally:
+        trace.stopAsyncLogging(sink)
+    assert tracer.logger.propagate
+    assert sink not in tracer.logger.handlers
+    assert handler.messages == ['record {}'.format(i) for i in range(10)]
+    assert sink.stats()['dropped'] == 0
+
+
+def test_async_sink_drops_when_full(level):
+    handler = ListHandler()
+    sink = trace.AsyncLogSink([handler], maxsize=2)
+    sink.is_running = False
+    sink.thread.join()
+    records = [logging.LogRecord('popoto', logging.INFO, __file__, 1, 'r', None, None)
+               for i in range(5)]
+    for record in records:
+        sink.emit(record)
+    stats = sink.stats()
+    sink.thread = None
+    sink.close()
+    assert stats['dropped'] == 3
+
+
+def test_received_messages_are_traced_not_printed(sim, modem, level, until, capsys):
+    handler = ListHandler()
+    tracer.logger.addHandler(handler)
+    try:
+        level(logging.INFO)
+        modem.getVersion()
+        assert not any(m.startswith('Info') for m in handler.messages)
+        level(TRACE)
+        modem.getVersion()
+        # The message is traced after it has been handed to the caller
+        assert until(lambda: any(m.startswith('Info') and 'Version' in m
+                                 for m in handler.messages))
+    finally:
+        tracer.logger.removeHandler(handler)
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,116 @@
+import json
+import time
+
+import pytest
+
+from popoto.txqueue import (TransmitScheduler, TX_COMPLETE, DELIVERED, EXPIRED, TIMEOUT,
+                            PRIORITY_HIGH, PRIORITY_LOW)
+
+
+@pytest.fixture
+def air(sim, monkeypatch):
+    """
+    Records each payload the simulator is asked to transmit, with its arrival time.
+    """
+    payloads = []
+    command = sim.command
+
+    def recording(client, line):
+        msg = json.loads(line.decode('utf-8'))
+        if msg.get('Command') == 'TransmitJSON':
+            payloads.append((time.time(), msg['Arguments']))
+        return command(client, line)
+
+    monkeypatch.setattr(sim, 'command', recording)
+    return payloads
+
+
+def until_sent(ticket, timeout=5):
+    deadline = time.time() + timeout
+    while ticket.sent is None and time.time() < deadline:
+        time.sleep(0.005)
+    return ticket.sent is not None
+
+
+def test_small_messages_are_coalesced(sim, modem, air):
+    with modem.transmitScheduler(coalesceWindow=0.2) as scheduler:
+        tickets = [scheduler.submit({'seq': i}) for i in range(10)]
+        assert [t.wait(5) for t in tickets] == [DELIVERED] * 10
+        stats = scheduler.stats()
+    assert [payload for when, payload in air] == [[{'seq': i} for i in range(10)]]
+    assert all(t.batchSize == 10 for t in tickets)
+    assert stats['payloads'] == 1 and stats['coalesced'] == 10
+    assert stats['delivered'] == 10
+
+
+def test_payloads_respect_max_payload(sim, modem, air):
+    message = {'data': 'x' * 40}
+    size = len(json.dumps(message, separators=(',', ':')))
+    with modem.transmitScheduler(maxPayload=3 * size + 4, coalesceWindow=0.2) as scheduler:
+        tickets = [scheduler.submit(message) for i in range(7)]
+        assert [t.wait(5) for t in tickets] == [DELIVERED] * 7
+    assert [len(payload) for when, payload in air] == [3, 3, 1]
+    for when, payload in air:
+        assert len(json.dumps(payload, separators=(',', ':'))) <= 3 * size + 4
+
+
+def test_one_payload_in_flight_paced_by_tx_complete(sim, modem, air):
+    # About 0.2 seconds on the air per message
+    sim.txBitRate = 800
+    with modem.transmitScheduler() as scheduler:
+        tickets = [scheduler.submit({'msg': 'abcdefghij'}, coalesce=False) for i in range(3)]
+        assert [t.wait(5) for t in tickets] == [DELIVERED] * 3
+        bitRate = scheduler.stats()['bitRate']
+    assert len(air) == 3
+    for previous, ticket in zip(tickets, tickets[1:]):
+        # The next payload waits for the previous TX_COMPLETE
+        assert ticket.sent >= previous.completed
+    for (first, p), (second, q) in zip(air, air[1:]):
+        assert second - first >= 0.9 * len(json.dumps(p)) * 8 / 800.0
+    assert bitRate == pytest.approx(800, rel=0.5)
+
+
+def test_priority_order_while_busy(sim, modem, air):
+    sim.txBitRate = 800
+    with modem.transmitScheduler(coalesceWindow=0) as scheduler:
+        first = scheduler.submit({'first': 'x' * 10}, coalesce=False)
+        assert until_sent(first)
+        low = scheduler.submit({'low': 1}, PRIORITY_LOW, coalesce=False)
+        high = scheduler.submit({'high': 1}, PRIORITY_HIGH, coalesce=False)
+        assert low.wait(5) == DELIVERED
+        assert high.sent < low.sent
+    assert [list(payload)[0] for when, payload in air] == ['first', 'high', 'low']
+
+
+def test_expired_messages_are_not_sent(sim, modem, air):
+    sim.txBitRate = 400
+    with modem.transmitScheduler(coalesceWindow=0) as scheduler:
+        busy = scheduler.submit({'busy': 'x' * 10}, coalesce=False)
+        assert until_sent(busy)
+        stale = scheduler.submit({'stale': 1}, ttl=0.05)
+        assert stale.wait(5) == EXPIRED
+        assert busy.wait(5) == DELIVERED
+        assert scheduler.stats()['expired'] == 1
+    assert len(air) == 1
+
+
+def test_missing_tx_complete_frees_the_channel(sim, modem, monkeypatch):
+    monkeypatch.setattr(sim, 'transmit', lambda client, nbytes, result=None: None)
+    scheduler = TransmitScheduler(modem, coalesceWindow=0, minTxTimeout=0.1).start()
+    try:
+        tickets = [scheduler.submit({'n': i}, coalesce=False) for i in range(2)]
+        assert [t.wait(5) for t in tickets] == [TIMEOUT] * 2
+        assert scheduler.stats()['timeouts'] == 2
+    finally:
+        scheduler.close()
+
+
+def test_stray_tx_complete_is_counted(sim, modem):
+    with modem.transmitScheduler() as scheduler:
+        sim.broadcast('Info', {'Info': TX_COMPLETE})
+        deadline = time.time() + 5
+        while not scheduler.stats()['strayCompletes'] and time.time() < deadline:
+            time.sleep(0.005)
+        assert scheduler.stats()['strayCompletes'] == 1
+        assert not scheduler.stats()['busy']
+    assert modem.getMetrics()['queues']['txQueue']['depth'] == 0